@@ -1,4 +1,5 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import rembg
 from rembg import remove, new_session
@@ -8,13 +9,28 @@ import base64
 import logging
 import re
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import quote_plus, urlparse
+from bs4 import BeautifulSoup, Tag
+import soupsieve as sv
+try:
+    from lxml import etree
+except Exception:
+    etree = None  # type: ignore
+from urllib.parse import quote_plus, urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
 import random
+import threading
 import time
 from typing import Dict, Any, List
 import os  # added for env flag
-import json  # NEW
+import fast_json
+import image_cache
+from product_record import Product, PRICE_REGEX, normalize_items
+import ranking
+import dedupe
+import constructor_client
+import upstream
+import metrics
+import tracing
 
 # Try to import decoupled real search module
 try:
@@ -55,13 +71,41 @@ except Exception:
     rf_fetch_search = None  # type: ignore
     rf_extract_from_search = None  # type: ignore
 
+# Local full-text index of previously fetched products (SQLite FTS5)
+try:
+    import product_index
+except Exception:
+    product_index = None  # type: ignore
+
+# Perceptual-hash index of result images ("more like this")
+try:
+    import visual_index
+except Exception:
+    visual_index = None  # type: ignore
+
+# Dominant-colour palettes of result images
+try:
+    import palette
+except Exception:
+    palette = None  # type: ignore
+
 # Centralized Constructor.io key storage
 try:
     from constructor_keys import get_keys as ctor_get_keys, save_keys as ctor_save_keys, status as ctor_status
+    from constructor_keys import price_filter_params as ctor_price_filters
 except Exception:
     ctor_get_keys = None  # type: ignore
     ctor_save_keys = None  # type: ignore
     ctor_status = None  # type: ignore
+    ctor_price_filters = None  # type: ignore
+
+# Background Playwright refresh of the Constructor.io keys
+try:
+    from key_refresher import refresher as key_refresher, PLAYWRIGHT_AVAILABLE
+    from key_refresher import REFRESH_INTERVAL as KEY_REFRESH_INTERVAL, SCHEDULE_LOCK
+except Exception:
+    key_refresher = None  # type: ignore
+    PLAYWRIGHT_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -80,11 +124,109 @@ try:
 except Exception:
     pass
 
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by fast_json (orjson when installed)."""
+
+    @staticmethod
+    def default(o):
+        # Product records are converted to the public schema here, at the edge
+        if isinstance(o, Product):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return fast_json.dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), default=self.default)
+
+    def loads(self, s, **kwargs):
+        return fast_json.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Same argument rules as flask.json.jsonify: one value, several (a list), or keywords (a dict)
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        obj = (args[0] if len(args) == 1 else list(args)) if args else (kwargs or None)
+        return self._app.response_class(fast_json.dumpb(obj, sort_keys=self.sort_keys, default=self.default), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json_provider_class = FastJSONProvider
+app.json = FastJSONProvider(app)
 CORS(app)  # Enable CORS for all routes
 
-# Global session variable
-session = None
+# Request tracing: every request gets a trace and an X-Request-ID (the caller's, if
+# sane); spans opened while it runs show where the time went. See tracing.py.
+_UNTRACED_PATHS = ('/health', '/metrics', '/debug/traces')
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+@app.before_request
+def _start_trace():
+    if request.path.startswith(_UNTRACED_PATHS):
+        return
+    request_id = request.headers.get('X-Request-ID', '')
+    g.trace = tracing.start_trace(f'{request.method} {request.path}',
+                                  request_id if _REQUEST_ID_RE.match(request_id) else None)
+
+@app.after_request
+def _trace_headers(response):
+    t = tracing.current_trace()
+    if t is not None:
+        t.root.set(status=response.status_code)
+        response.headers['X-Request-ID'] = t.request_id
+        response.headers['Server-Timing'] = t.server_timing()
+    return response
+
+@app.teardown_request
+def _finish_trace(exc):
+    handle = g.pop('trace', None)
+    if handle is not None and exc is not None:
+        handle[0].root.error = f'{type(exc).__name__}: {exc}'[:200]
+    tracing.finish_trace(handle)
+
+# rembg sessions by model name. Loaded once per process and shared by all request
+# threads (onnxruntime sessions are safe to run concurrently). Under gunicorn the
+# REMBG_PRELOAD_MODELS are loaded in the master before forking, so workers share
+# the model memory copy-on-write (see wsgi.py).
+REMBG_PRELOAD_MODELS = [m.strip() for m in os.getenv('REMBG_PRELOAD_MODELS', 'u2net').split(',') if m.strip()]
+_sessions: Dict[str, Any] = {}
+_sessions_lock = threading.Lock()
+
+def get_session(model_name: str):
+    """rembg session for model_name, loading it on first use; falls back to u2net."""
+    sess = _sessions.get(model_name)
+    if sess is not None:
+        return sess
+    with _sessions_lock:
+        sess = _sessions.get(model_name)
+        if sess is not None:
+            return sess
+        logger.info(f"Creating rembg session with model: {model_name}")
+        with tracing.span('rembg.load_model', model=model_name):
+            try:
+                sess = new_session(model_name)
+            except Exception as model_error:
+                if model_name == 'u2net':
+                    raise
+                logger.warning(f"Failed to create session with model {model_name}: {model_error}")
+                logger.info("Falling back to u2net model")
+                sess = _sessions.get('u2net') or new_session('u2net')
+                sess._model_name = 'u2net'
+                _sessions['u2net'] = sess
+                return sess
+        sess._model_name = model_name
+        _sessions[model_name] = sess
+        return sess
+
+def preload_models(names=None) -> List[str]:
+    """Load rembg sessions ahead of the first request; returns the models loaded."""
+    loaded = []
+    for name in REMBG_PRELOAD_MODELS if names is None else names:
+        try:
+            logger.info(f"Preloading rembg model ({name})...")
+            model = get_session(name)._model_name
+            if model not in loaded:
+                loaded.append(model)
+        except Exception as e:
+            logger.warning(f"Failed to preload rembg model {name}: {e}")
+    return loaded
 
 USER_AGENTS = [
     'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0 Safari/537.36',
@@ -93,7 +235,20 @@ USER_AGENTS = [
 ]
 DEFAULT_HEADERS_BASE = {"Accept-Language": "en-US,en;q=0.9", "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"}
 TIMEOUT = 10
+# Retailer requests of one search stop queueing behind host rate limits after this many seconds
+SEARCH_DEADLINE = float(os.getenv('SEARCH_DEADLINE', '15'))
+
+# Prometheus metrics (see metrics.py; summed across worker processes at scrape time)
+SEARCH_REQUESTS = metrics.counter('search_requests_total', 'Furniture searches by mode.', ('mode',))
+SEARCH_DURATION = metrics.histogram('search_duration_seconds', 'Furniture search latency by mode.', ('mode',))
+SEARCH_RESULTS = metrics.counter('search_results_total', 'Results gathered by source (before ranking).', ('source',))
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+REMBG_SECONDS = metrics.histogram('rembg_inference_seconds', 'Background removal time by model.', ('model',),
+                                  buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0))
 MAX_PER_SITE = 6  # limit per retailer to reduce scraping load
+# Stream retailer pages through a push parser and hang up once enough cards are found
+INCREMENTAL_PARSE = os.getenv('INCREMENTAL_PARSE', '0') == '1'
+STREAM_CHUNK_SIZE = 16 * 1024
 
 # --- Utility helpers ---
 
@@ -134,36 +289,97 @@ def base64_to_image(base64_string):
         logger.error(f"Error converting base64 to image: {e}")
         raise
 
+# Shared keep-alive pool for image downloads (CDN hosts are few and hot)
+_image_session = requests.Session()
+_image_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32))
+_image_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+# Fetch images from {IMAGE_FETCH_BASE_URL}/{host}{path} instead of the CDN itself (replay.py)
+IMAGE_FETCH_BASE_URL = os.getenv('IMAGE_FETCH_BASE_URL', '').rstrip('/')
+
+def _image_fetch_url(url: str) -> str:
+    if not IMAGE_FETCH_BASE_URL:
+        return url
+    parts = urlparse(url)
+    return f"{IMAGE_FETCH_BASE_URL}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+
+# Redirects are followed by hand so each hop's host can be checked
+IMAGE_MAX_REDIRECTS = int(os.getenv('IMAGE_MAX_REDIRECTS', '3'))
+
+def _image_upstream(url: str) -> str:
+    # One breaker per retailer CDN; any other host shares one, which keeps metric labels bounded
+    host = (urlparse(url).hostname or '').lower()
+    return f'image:{host}' if _proxy_allowed(url) else 'image'
+
+def _get_image(url: str, headers: Dict[str, str], allowed=None):
+    """GET url without letting requests follow redirects: each Location is
+    resolved, checked with allowed(url) when given, and fetched for at most
+    IMAGE_MAX_REDIRECTS hops. Each hop goes through upstream.get, so it
+    takes a slot from the host's limiter and holds it until the body is read."""
+    for _ in range(IMAGE_MAX_REDIRECTS + 1):
+        resp = upstream.get(_image_upstream(url), _image_fetch_url(url), timeout=TIMEOUT, session=_image_session,
+                            headers=headers, stream=True, allow_redirects=False)
+        if not resp.is_redirect:
+            return resp
+        location = urljoin(url, resp.headers['Location'])
+        resp.close()
+        if allowed is not None and not allowed(location):
+            raise requests.exceptions.InvalidURL(f'Redirect to a host that is not allowed: {location}')
+        url = location
+    raise requests.exceptions.TooManyRedirects(f'More than {IMAGE_MAX_REDIRECTS} redirects')
+
+def _fetch_image_response(url: str, max_bytes: int | None = None, allowed=None):
+    """GET an image through the pooled session with CDN Referer handling.
+    Returns (content_bytes, content_type). Raises on HTTP errors, oversize
+    bodies, and redirects to URLs that allowed(url) rejects.
+    """
+    if url.startswith('//'):
+        url = 'https:' + url
+    headers = {**_pick_headers(), 'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'}
+    ref = _referer_for_url(url)
+    if ref:
+        headers['Referer'] = ref
+    resp = _get_image(url, headers, allowed)
+    if resp.status_code == 403 and 'Referer' not in headers:
+        # Retry with a best-guess referer for hotlink-protected CDNs
+        resp.close()
+        guess_ref = _referer_for_url(url) or 'https://www.potterybarn.com/'
+        headers['Referer'] = guess_ref
+        resp = _get_image(url, headers, allowed)
+    with resp:
+        resp.raise_for_status()
+        content_type = (resp.headers.get('Content-Type') or '').lower()
+        if max_bytes is None:
+            return resp.content, content_type
+        chunks, size = [], 0
+        for chunk in resp.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f'Image larger than {max_bytes} bytes')
+            chunks.append(chunk)
+        return b''.join(chunks), content_type
+
+@tracing.traced('image.fetch')
 def fetch_image_from_url(url: str) -> Image.Image:
     """Fetch an image from a URL and return a PIL Image with RGB mode.
     Supports WebP/AVIF/HEIF when plugins are available. Adds Referer for PB/CDN if needed.
     """
     try:
-        if url.startswith('//'):
-            url = 'https:' + url
-        headers = {**_pick_headers(), 'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'}
-        ref = _referer_for_url(url)
-        if ref:
-            headers['Referer'] = ref
-        resp = requests.get(url, headers=headers, timeout=TIMEOUT, stream=True)
-        if resp.status_code == 403 and 'Referer' not in headers:
-            # Retry with a best-guess referer for hotlink-protected CDNs
-            guess_ref = _referer_for_url(url) or 'https://www.potterybarn.com/'
-            headers['Referer'] = guess_ref
-            resp = requests.get(url, headers=headers, timeout=TIMEOUT, stream=True)
-        resp.raise_for_status()
-        content_type = (resp.headers.get('Content-Type') or '').lower()
+        with tracing.span('image.download', host=urlparse(url).hostname) as span:
+            content, content_type = _fetch_image_response(url)
+            span.set(bytes=len(content), content_type=content_type)
         if 'svg' in content_type or url.lower().endswith('.svg'):
             raise ValueError('SVG images are not supported for background removal')
-        img = Image.open(io.BytesIO(resp.content))
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+        with tracing.span('image.decode') as span:
+            img = Image.open(io.BytesIO(content))
+            span.set(format=img.format, size=list(img.size))
+            if img.mode in ('RGBA', 'LA', 'P'):
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                if img.mode == 'P':
+                    img = img.convert('RGBA')
+                background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
         return img
     except Exception as e:
         logger.error(f"Error fetching image from URL: {e}")
@@ -183,9 +399,48 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'rembg_version': rembg.__version__ if hasattr(rembg, '__version__') else 'unknown',
-        'session_loaded': session is not None
+        'session_loaded': bool(_sessions),
+        'models_loaded': sorted(_sessions),
+        # Circuit breaker state, latency percentiles and current timeout per retailer upstream
+        'upstreams': upstream.status(),
+        # Token-bucket / concurrency limiter per retailer host, with queueing wait times
+        'limiters': upstream.limiter_status(),
     })
 
+def _queue_depths():
+    depths = {
+        ('visual_hash',): _hash_executor._work_queue.qsize(),
+        ('palette',): _color_executor._work_queue.qsize(),
+        ('visual_hash_pending',): len(_hash_pending),
+    }
+    job = key_refresher.job() if key_refresher is not None else None
+    depths[('key_refresh',)] = 1 if job and job['state'] in ('queued', 'running') else 0
+    return depths
+
+
+metrics.gauge_callback('queue_depth', 'Background work waiting, by queue.', ('queue',), _queue_depths)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this backend's metrics across all worker processes."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/traces', methods=['GET'])
+def debug_traces():
+    """Slowest traces kept by this worker process (?limit=N), or one trace by ?request_id=."""
+    request_id = request.args.get('request_id')
+    if request_id:
+        trace = tracing.get(request_id)
+        if trace is None:
+            return jsonify({'error': 'Trace not found (evicted, or served by another worker)'}), 404
+        return jsonify(trace)
+    try:
+        limit = max(1, int(request.args.get('limit', tracing.KEEP_SLOWEST)))
+    except ValueError:
+        limit = tracing.KEEP_SLOWEST
+    return jsonify({'pid': os.getpid(), 'traces': tracing.slowest(limit)})
+
 @app.route('/models', methods=['GET'])
 def list_models():
     """List available rembg models."""
@@ -201,35 +456,39 @@ def list_models():
 @app.route('/remove-background', methods=['POST'])
 def remove_background():
     """Remove background from uploaded image. Accepts base64 data URI or direct image URL."""
-    global session
     try:
         data = request.get_json()
         if not data or ('image' not in data and 'imageUrl' not in data):
             return jsonify({'error': 'No image data provided'}), 400
-        model_name = data.get('model', 'u2net')
-        if session is None or getattr(session, '_model_name', None) != model_name:
-            logger.info(f"Creating rembg session with model: {model_name}")
-            try:
-                session = new_session(model_name)
-                session._model_name = model_name
-            except Exception as model_error:
-                logger.warning(f"Failed to create session with model {model_name}: {model_error}")
-                logger.info("Falling back to u2net model")
-                session = new_session('u2net')
-                session._model_name = 'u2net'
+        session = get_session(data.get('model', 'u2net'))
         # Support both base64 and URL inputs
         img_input = data.get('image') or data.get('imageUrl')
+        source_url = None
         if isinstance(img_input, str) and (img_input.startswith('http://') or img_input.startswith('https://') or img_input.startswith('//')):
             input_image = fetch_image_from_url(img_input)
+            source_url = img_input
+            with tracing.span('visual_hash'):
+                _add_visual_hash(source_url, input_image)
         else:
-            input_image = base64_to_image(img_input)
-        logger.info(f"Processing image of size: {input_image.size} with model: {getattr(session, '_model_name', 'unknown')}")
-        output_image = remove(input_image, session=session)
-        result_base64 = image_to_base64(output_image, 'PNG')
+            with tracing.span('image.decode', source='base64'):
+                input_image = base64_to_image(img_input)
+        model_used = session._model_name
+        logger.info(f"Processing image of size: {input_image.size} with model: {model_used}")
+        with REMBG_SECONDS.time(model=model_used), tracing.span('rembg.remove', model=model_used, size=list(input_image.size)):
+            output_image = remove(input_image, session=session)
+        if source_url and palette is not None:
+            # The cutout gives the product's colours without its backdrop
+            try:
+                with tracing.span('palette.extract'):
+                    palette.cache.put(source_url, palette.extract(output_image), cutout=True)
+            except Exception as e:
+                logger.warning(f"Palette extraction failed for cutout: {e}")
+        with tracing.span('image.encode', format='PNG'):
+            result_base64 = image_to_base64(output_image, 'PNG')
         return jsonify({
             'success': True,
             'image': result_base64,
-            'model_used': getattr(session, '_model_name', 'unknown'),
+            'model_used': model_used,
             'original_size': input_image.size,
             'output_size': output_image.size
         })
@@ -237,6 +496,204 @@ def remove_background():
         logger.error(f"Error in remove_background: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# -------- Image proxy (resized, cached thumbnails) ---------
+
+# Retailer CDNs the proxy may fetch from; extend with IMAGE_PROXY_HOSTS=host1,host2
+IMAGE_PROXY_HOSTS = ('wayfair.com', 'wfcdn.com', 'ikea.com', 'ikea.net', 'westelm.com', 'weimgs.com',
+                     'potterybarn.com', 'pbimgs.com', 'williams-sonoma.com', 'wsimgs.com',
+                     'raymourflanigan.com', 'scene7.com', 'images.unsplash.com') + tuple(
+    h.strip().lower() for h in os.getenv('IMAGE_PROXY_HOSTS', '').split(',') if h.strip())
+# Rewrite result image fields to go through /image-proxy
+IMAGE_PROXY_RESULTS = os.getenv('IMAGE_PROXY_RESULTS', '0') == '1'
+IMAGE_PROXY_RESULT_WIDTH = int(os.getenv('IMAGE_PROXY_RESULT_WIDTH', '320'))
+
+def _proxy_allowed(url: str) -> bool:
+    try:
+        parts = urlparse('https:' + url if url.startswith('//') else url)
+    except Exception:
+        return False
+    host = (parts.hostname or '').lower()
+    if parts.scheme not in ('http', 'https') or not host:
+        return False
+    return any(host == h or host.endswith('.' + h) for h in IMAGE_PROXY_HOSTS)
+
+def _proxied_image_url(url: str) -> str:
+    if not url or not _proxy_allowed(url):
+        return url
+    return f"{request.host_url}image-proxy?url={quote_plus(url)}&w={IMAGE_PROXY_RESULT_WIDTH}"
+
+@app.route('/image-proxy', methods=['GET'])
+def image_proxy():
+    """Serve a retailer image resized to ?w= (snapped to image_cache.WIDTHS).
+    Encodes AVIF/WebP when the Accept header allows it, caches variants on
+    disk and answers If-None-Match with 304.
+    """
+    url = (request.args.get('url') or '').strip()
+    if url.startswith('//'):
+        url = 'https:' + url
+    if not url or not _proxy_allowed(url):
+        return jsonify({'success': False, 'error': 'url missing or host not allowed'}), 400
+    width = image_cache.snap_width(request.args.get('w'))
+    fmt = image_cache.negotiate_format(request.headers.get('Accept'))
+    key = image_cache.variant_key(url, width, fmt)
+
+    data = None
+    hit = image_cache.lookup(key, fmt)
+    if hit is not None and not request.if_none_match.contains(hit[1]):
+        data = image_cache.read(hit[0])
+        if data is None:  # evicted between lookup and read
+            hit = None
+    CACHE_REQUESTS.inc(cache='image_proxy', result='hit' if hit is not None else 'miss')
+    if hit is None:
+        try:
+            source, content_type = _fetch_image_response(url, max_bytes=image_cache.MAX_SOURCE_BYTES,
+                                                          allowed=_proxy_allowed)
+            if 'svg' in content_type:
+                return jsonify({'success': False, 'error': 'SVG images are not resized'}), 415
+            data = image_cache.render(source, width, fmt)
+            hit = image_cache.store(key, fmt, data)
+        except requests.RequestException as e:
+            logger.warning(f"Image proxy fetch failed for {url}: {e}")
+            return jsonify({'success': False, 'error': 'upstream fetch failed'}), 502
+        except Exception as e:
+            logger.warning(f"Image proxy could not process {url}: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 422
+    etag = hit[1]
+
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(data, mimetype=image_cache.FORMATS[fmt][1])
+    resp.set_etag(etag)
+    resp.headers['Vary'] = 'Accept'
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 86400
+    return resp
+
+# -------- Visual similarity (perceptual hashes) ---------
+
+# Hash result images in the background after each live search
+VISUAL_HASH_RESULTS = os.getenv('VISUAL_HASH_RESULTS', '0') == '1'
+_hash_executor = ThreadPoolExecutor(max_workers=int(os.getenv('VISUAL_HASH_WORKERS', '4')), thread_name_prefix='vhash')
+_hash_pending = set()
+
+def _add_visual_hash(image_url: str, img: Image.Image) -> None:
+    """Index an already-decoded image; never fails the caller."""
+    if visual_index is None or not image_url:
+        return
+    try:
+        visual_index.index.add(image_url, img)
+    except Exception as e:
+        logger.warning(f"Visual hash failed for {image_url}: {e}")
+
+def _hash_image_job(image_url: str) -> None:
+    try:
+        _add_visual_hash(image_url, fetch_image_from_url(image_url))
+    except Exception:
+        pass  # fetch_image_from_url already logged it
+    finally:
+        _hash_pending.discard(image_url)
+
+def _queue_visual_hashes(records) -> None:
+    """Fetch and hash result images that are not indexed yet (off the request path)."""
+    if visual_index is None or not VISUAL_HASH_RESULTS:
+        return
+    for r in records:
+        url = r.image
+        if not url or not url.startswith(('http://', 'https://', '//')) or url in _hash_pending:
+            continue
+        if visual_index.image_hash(url) is not None:
+            continue
+        _hash_pending.add(url)
+        _hash_executor.submit(_hash_image_job, url)
+
+def _record_image_hash(record):
+    return visual_index.image_hash(record.image) if visual_index is not None else None
+
+@app.route('/similar', methods=['POST'])
+def similar_products():
+    """Products whose images are within a pHash Hamming radius of a given image.
+    Body: {"imageUrl": ..., "radius": 10, "limit": 20}. The query image is
+    hashed (and indexed) on first use; candidates come from the local index.
+    """
+    if visual_index is None:
+        return jsonify({'success': False, 'error': 'Visual index unavailable'}), 500
+    data = request.get_json(silent=True) or {}
+    image_url = (data.get('imageUrl') or '').strip()
+    if not image_url:
+        return jsonify({'success': False, 'error': 'imageUrl is required'}), 400
+    try:
+        radius = int(data.get('radius', 10))
+        limit = max(1, min(int(data.get('limit', 20)), 100))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'radius and limit must be integers'}), 400
+    started = time.perf_counter()
+    hashes = visual_index.index.get(image_url)
+    if hashes is None:
+        try:
+            img = fetch_image_from_url(image_url)
+        except Exception as e:
+            return jsonify({'success': False, 'error': f'Could not fetch image: {e}'}), 502
+        hashes = visual_index.index.add(image_url, img)
+    matches = visual_index.index.search(hashes[0], radius=radius, limit=limit, dh=hashes[1], exclude=image_url)
+    rows = product_index.products_by_image(m[0] for m in matches) if product_index is not None else {}
+    results = []
+    for image, distance in matches:
+        row = rows.get(image)
+        if not row:
+            continue  # hashed image no longer tied to an indexed product
+        item = product_index.to_result(row, len(results), 'all', 'all').to_dict()
+        item['distance'] = distance
+        results.append(item)
+    return jsonify({
+        'success': True,
+        'results': results,
+        'total': len(results),
+        'indexed_images': len(visual_index.index),
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+# -------- Dominant colours ---------
+
+# Always attach a `colors` field to search results (otherwise only with "colors": true)
+COLOR_RESULTS = os.getenv('COLOR_RESULTS', '0') == '1'
+# Images fetched per request to fill palette cache misses; the rest stay unknown
+COLOR_MAX_FETCH = int(os.getenv('COLOR_MAX_FETCH', '40'))
+COLOR_FETCH_TIMEOUT = float(os.getenv('COLOR_FETCH_TIMEOUT', '8'))
+_color_executor = ThreadPoolExecutor(max_workers=int(os.getenv('COLOR_WORKERS', '8')), thread_name_prefix='palette')
+
+def _palette_for_url(image_url: str):
+    img = fetch_image_from_url(image_url)
+    colors = palette.extract(img)
+    palette.cache.put(image_url, colors)
+    return colors
+
+@tracing.traced('palette.attach')
+def _attach_colors(records) -> None:
+    """Set record.colors from the palette cache, fetching misses in parallel."""
+    if palette is None:
+        return
+    urls = [r.image for r in records if r.image and r.image.startswith(('http://', 'https://', '//'))]
+    unique = list(dict.fromkeys(urls))
+    known = palette.cache.get_many(unique)
+    missing = [u for u in unique if u not in known]
+    CACHE_REQUESTS.inc(len(known), cache='palette', result='hit')
+    CACHE_REQUESTS.inc(len(missing), cache='palette', result='miss')
+    missing = missing[:COLOR_MAX_FETCH]
+    futures = {u: _color_executor.submit(_palette_for_url, u) for u in missing}
+    deadline = time.monotonic() + COLOR_FETCH_TIMEOUT
+    for u, fut in futures.items():
+        try:
+            known[u] = fut.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            pass  # unknown colours: left as None
+    for r in records:
+        r.colors = known.get(r.image)
+
+def _filter_by_color(records, color: str):
+    _attach_colors(records)
+    return [r for r in records if palette.matches(r.colors, color)]
+
 # -------- Furniture Search (Refactored Wayfair only) ---------
 
 PRICE_RANGE_MAP = {
@@ -255,112 +712,79 @@ def price_in_range(value, price_min, price_max):
         return False
     return True
 
+SORT_OPTIONS = ('relevance', 'price_asc', 'price_desc')
+
+def _ctor_filters(site: str, price_min, price_max) -> Dict[str, str]:
+    """Constructor.io params pushing a price range down to `site` ({} if unsupported)."""
+    if not ctor_price_filters:
+        return {}
+    try:
+        return ctor_price_filters(site, price_min, price_max)
+    except Exception:
+        return {}
+
+def _filter_by_price(records: List[Product], price_min, price_max) -> List[Product]:
+    if price_min is None and price_max is None:
+        return records
+    return [r for r in records if price_in_range(r.price, price_min, price_max)]
+
+def _order_results(records: List[Product], sort) -> List[Product]:
+    """Apply a price sort (unpriced items last); other orders are left as-is."""
+    if sort == 'price_asc':
+        return sorted(records, key=lambda r: (r.price is None, r.price or 0.0))
+    if sort == 'price_desc':
+        return sorted(records, key=lambda r: (r.price is None, -(r.price or 0.0)))
+    return records
+
+@tracing.traced('top_results')
+def _top_results(records: List[Product], query: str, sort, limit: int = 20,
+                 color=None, with_colors: bool = False) -> List[Product]:
+    """Pick the results to return: optional colour filter, then BM25 relevance
+    by default or a price sort."""
+    if color:
+        records = _filter_by_color(records, color)
+    if sort in ('price_asc', 'price_desc'):
+        top = _order_results(records, sort)[:limit]
+    else:
+        top = ranking.rank(records, query, limit=limit)
+    if with_colors and not color:
+        _attach_colors(top)
+    return top
+
 def _pick_headers():
     return {**DEFAULT_HEADERS_BASE, 'User-Agent': random.choice(USER_AGENTS)}
 
-def make_result(idx_prefix: str, idx: int, title: str, price_val, site: str, image: str, url: str, category: str, style: str) -> Dict[str, Any]:
-    return {
-        'id': f'{idx_prefix}-{idx}',
-        'title': title,
-        'price': f"${price_val:.2f}" if price_val is not None else 'N/A',
-        'originalPrice': None,
-        'site': site,
-        'image': image,
-        'url': url,
-        'category': category if category != 'all' else 'general',
-        'style': style if style != 'all' else 'unspecified',
-        'inStock': True
-    }
+def make_result(idx_prefix: str, idx: int, title: str, price_val, site: str, image: str, url: str, category: str, style: str) -> Product:
+    return Product(f'{idx_prefix}-{idx}', title, price_val, None, site, image, url,
+                   category if category != 'all' else 'general',
+                   style if style != 'all' else 'unspecified')
 
 # --- Wayfair module adapter (moved up so it's defined before use) ---
 
-def _adapt_wayfair_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Dict[str, Any]]:
-    """Convert results from python-backend/wayfair.get_products() into app schema.
+@tracing.traced('adapt.wayfair')
+def _adapt_wayfair_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Product]:
+    """Convert results from python-backend/wayfair.get_products() into product records.
     Expected input item keys: title, price, url, image
-    Output schema keys: id, title, price, originalPrice, site, image, url, category, style, inStock
     """
-    adapted: List[Dict[str, Any]] = []
-    if not isinstance(items, list):
-        return adapted
-
-    PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
-
-    def _extract_price_str(p):
-        if p is None:
-            return None
-        s = str(p)
-        m = PRICE_REGEX.search(s)
-        if m:
-            return f"${m.group(1)}"
-        return s if '$' in s else None
-
-    def _extract_price_float(p):
-        try:
-            m = PRICE_REGEX.search(str(p))
-            if not m:
-                return None
-            return float(m.group(1).replace(',', ''))
-        except Exception:
-            return None
-
-    for i, it in enumerate(items):
-        if not isinstance(it, dict):
-            continue
-        title = (it.get('title') or '').strip()
-        if not title:
-            continue
-        url = it.get('url') or ''
-        price_str = _extract_price_str(it.get('price'))
-        price_val = _extract_price_float(it.get('price'))
-
-        img_url = it.get('image') or ''
-        if isinstance(img_url, str):
-            if img_url.startswith('//'):
-                img_url = 'https:' + img_url
-            elif img_url.startswith('/'):
-                img_url = 'https://www.wayfair.com' + img_url
-        else:
-            img_url = ''
-
-        adapted.append({
-            'id': f'wayfair-{i+1}',
-            'title': title,
-            'price': price_str or (f"${price_val:.2f}" if isinstance(price_val, float) else None) or '$',
-            'originalPrice': None,
-            'site': 'Wayfair',
-            'image': img_url or '/window.svg',
-            'url': url,
-            'category': category or 'all',
-            'style': style or 'all',
-            'inStock': True,
-        })
-
-    return adapted
+    return normalize_items(items, 'wayfair', 'Wayfair', category, style, image_origin='https://www.wayfair.com')
 
 # NEW: Pottery Barn helpers (API-based)
 
-def _fetch_pottery_barn_raw(query: str, num_results: int = 20):
+def _fetch_pottery_barn_raw(query: str, num_results: int = 20, filters=None):
     """Fetch Pottery Barn search JSON via Constructor.io API for a given query."""
     try:
-        url = f"https://ac.cnstrc.com/search/{quote_plus(query)}"
-        # Pull API key/clientlib from persistent store if available
-        api_key = "key_w3v8XC1kGR9REv46"
-        client_lib = "ciojs-client-2.66.0"
-        if ctor_get_keys:
-            k, c = ctor_get_keys('pottery_barn', fallback_key=api_key, fallback_clientlib=client_lib)
-            api_key = k or api_key
-            client_lib = c or client_lib
+        url = f"{constructor_client.api_base('pottery_barn')}/search/{quote_plus(query)}"
         params = {
-            "c": client_lib,
-            "key": api_key,
             "i": "f70eef75-549d-4dc0-98e1-5addb6c8c3cc",
             "s": "3",
             "offset": "0",
             "num_results_per_page": str(num_results),
         }
-        r = requests.get(url, params=params, timeout=TIMEOUT)
-        r.raise_for_status()
-        return r.json()
+        if filters:
+            params.update(filters)
+        # Key/clientlib come from the persistent store; a rejected key triggers a refresh and one retry
+        return constructor_client.get_json('pottery_barn', url, params, "key_w3v8XC1kGR9REv46", "ciojs-client-2.66.0",
+                                           timeout=TIMEOUT, label="Pottery Barn search")
     except Exception as e:
         logger.warning(f"Pottery Barn fetch failed: {e}")
         return None
@@ -392,8 +816,13 @@ def _pb_simple_extract(data) -> List[Dict[str, Any]]:
         return []
     return items
 
-def pb_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
-    raw = _fetch_pottery_barn_raw(query, num_results=num_results)
+@tracing.traced('retailer.pottery_barn')
+def pb_get_products(query: str, num_results: int = 20, price_min=None, price_max=None) -> List[Dict[str, Any]]:
+    filters = _ctor_filters('pottery_barn', price_min, price_max)
+    raw = _fetch_pottery_barn_raw(query, num_results=num_results, filters=filters)
+    if not raw and filters:
+        # A rejected facet must not cost us the whole retailer: retry unfiltered
+        raw = _fetch_pottery_barn_raw(query, num_results=num_results)
     if not raw:
         return []
     if pb_extract_product_info:
@@ -404,48 +833,21 @@ def pb_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
     return _pb_simple_extract(raw)
 
 
-def _adapt_pottery_barn_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Dict[str, Any]]:
-    adapted: List[Dict[str, Any]] = []
-    PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
-
-    def _price_str(p):
-        if p is None:
-            return None
-        s = str(p)
-        m = PRICE_REGEX.search(s)
-        if m:
-            return f"${m.group(1)}"
-        return s if '$' in s else None
-
-    for i, it in enumerate(items):
-        if not isinstance(it, dict):
-            continue
-        title = (it.get('title') or '').strip()
-        if not title:
-            continue
-        url = it.get('url') or ''
-        img = it.get('image') or ''
-        adapted.append({
-            'id': f'potterybarn-{i+1}',
-            'title': title,
-            'price': _price_str(it.get('price')) or '$',
-            'originalPrice': None,
-            'site': 'Pottery Barn',
-            'image': img or '/window.svg',
-            'url': url,
-            'category': category or 'all',
-            'style': style or 'all',
-            'inStock': True,
-        })
-    return adapted
+@tracing.traced('adapt.pottery_barn')
+def _adapt_pottery_barn_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Product]:
+    return normalize_items(items, 'potterybarn', 'Pottery Barn', category, style)
 
 # NEW: West Elm helpers (API-based)
 
-def we_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
+@tracing.traced('retailer.west_elm')
+def we_get_products(query: str, num_results: int = 20, price_min=None, price_max=None) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
     try:
         if we_fetch_autocomplete and we_extract_results:
-            raw = we_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results)
+            filters = _ctor_filters('west_elm', price_min, price_max)
+            raw = we_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results, filters=filters or None)
+            if not raw and filters:
+                raw = we_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results)
             if raw:
                 items = we_extract_results(raw, fallback_query=query, include_suggestions=False) or []
     except Exception as e:
@@ -453,55 +855,28 @@ def we_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
     return items
 
 
-def _adapt_west_elm_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Dict[str, Any]]:
-    adapted: List[Dict[str, Any]] = []
-    PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
-
-    def _price_str(p):
-        if p is None:
-            return None
-        s = str(p)
-        m = PRICE_REGEX.search(s)
-        if m:
-            return f"${m.group(1)}"
-        return s if '$' in s else None
-
-    for i, it in enumerate(items or []):
-        if not isinstance(it, dict):
-            continue
-        title = (it.get('title') or '').strip()
-        if not title:
-            continue
-        url = it.get('url') or ''
-        img = it.get('image') or ''
-        adapted.append({
-            'id': f'westelm-{i+1}',
-            'title': title,
-            'price': _price_str(it.get('price')) or '$',
-            'originalPrice': None,
-            'site': 'West Elm',
-            'image': img or '/window.svg',
-            'url': url,
-            'category': category or 'all',
-            'style': style or 'all',
-            'inStock': True,
-        })
-    return adapted
+@tracing.traced('adapt.west_elm')
+def _adapt_west_elm_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Product]:
+    return normalize_items(items, 'westelm', 'West Elm', category, style)
 
 # NEW: Raymour & Flanigan helpers (API-based)
 
-def rf_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
+@tracing.traced('retailer.raymour_flanigan')
+def rf_get_products(query: str, num_results: int = 20, price_min=None, price_max=None) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
     try:
         if rf_fetch_autocomplete and rf_extract_results:
-            raw = rf_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results)
+            filters = _ctor_filters('raymour_flanigan', price_min, price_max)
+            raw = rf_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results, filters=filters or None)
+            if not raw and filters:
+                raw = rf_fetch_autocomplete(query=query, num_suggestions=0, num_products=num_results)
             if raw:
                 items = rf_extract_results(raw, fallback_query=query, include_suggestions=False) or []
                 # Fallback to full search if autocomplete has no prices
                 if (not items) or all(not (isinstance(it, dict) and (it.get('price') or '')) for it in items):
                     if rf_fetch_search and rf_extract_from_search:
                         try:
-                            sraw = rf_fetch_search(query=query, num_results_per_page=num_results, page=1)
+                            sraw = rf_fetch_search(query=query, num_results_per_page=num_results, page=1, filters=filters or None)
                             if sraw:
                                 alt = rf_extract_from_search(sraw) or []
                                 if alt:
@@ -513,65 +888,11 @@ def rf_get_products(query: str, num_results: int = 20) -> List[Dict[str, Any]]:
     return items
 
 
-def _adapt_raymour_flanigan_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Dict[str, Any]]:
-    adapted: List[Dict[str, Any]] = []
-    PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
-
-    def _price_str(p):
-        if p is None:
-            return None
-        s = str(p)
-        m = PRICE_REGEX.search(s)
-        if m:
-            return f"${m.group(1)}"
-        return s if '$' in s else None
-
-    for i, it in enumerate(items or []):
-        if not isinstance(it, dict):
-            continue
-        title = (it.get('title') or '').strip()
-        if not title:
-            continue
-        url = it.get('url') or ''
-        img = it.get('image') or ''
-        adapted.append({
-            'id': f'raymourflanigan-{i+1}',
-            'title': title,
-            'price': _price_str(it.get('price')) or '$',
-            'originalPrice': None,
-            'site': 'Raymour & Flanigan',
-            'image': img or '/window.svg',
-            'url': url,
-            'category': category or 'all',
-            'style': style or 'all',
-            'inStock': True,
-        })
-    return adapted
+@tracing.traced('adapt.raymour_flanigan')
+def _adapt_raymour_flanigan_products(items: List[Dict[str, Any]], category: str, style: str) -> List[Product]:
+    return normalize_items(items, 'raymourflanigan', 'Raymour & Flanigan', category, style)
 
-# --- Wayfair scraping helpers (resilient) ---
-PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
-
-SELECTOR_SETS = [
-    '[data-enzyme-id="ProductCard"]',
-    'a.ProductCard',
-    '[data-hb-id="ProductCard"]',
-    'div[class*="ProductCard"]',
-    'li[class*="ProductCard"]',
-]
-
-TITLE_SELECTORS = [
-    '[data-enzyme-id="ProductName"]',
-    '[data-hb-id="ProductName"]',
-    'div[class*="Title"], span[class*="Title"], span'
-]
-
-PRICE_SELECTORS = [
-    '[data-enzyme-id="RegularPrice"]',
-    '[data-enzyme-id="SalePrice"]',
-    '[data-hb-id*="Price"]',
-    'span[class*="Price"], div[class*="Price"]',
-    'span'
-]
+# --- HTML scraping engine (declarative, site-spec driven) ---
 
 IMAGE_ATTRS = ['data-src', 'data-srcset', 'src', 'data-original']
 
@@ -579,70 +900,19 @@ IMAGE_ATTRS = ['data-src', 'data-srcset', 'src', 'data-original']
 LDJSON_PRODUCT_TYPES = {"Product", "ListItem"}
 PRODUCT_KEY_HINTS = ["product", "Product", "name", "price"]
 
-def _extract_first(selector_list, root):
-    for sel in selector_list:
-        el = root.select_one(sel)
-        if el and el.get_text(strip=True):
-            return el.get_text(strip=True), el
-    return None, None
-
-def _extract_price(root):
-    # Try explicit selectors
-    for sel in PRICE_SELECTORS:
-        el = root.select_one(sel)
-        if el:
-            txt = el.get_text(" ", strip=True)
-            m = PRICE_REGEX.search(txt)
-            if m:
-                try:
-                    return float(m.group(1).replace(',', ''))
-                except ValueError:
-                    pass
-    # Fallback: any text containing $ in card
-    txt = root.get_text(" ", strip=True)
-    m = PRICE_REGEX.search(txt)
-    if m:
-        try:
-            return float(m.group(1).replace(',', ''))
-        except ValueError:
-            return None
-    return None
-
-def _extract_image(card):
-    img = card.select_one('img')
-    if not img:
-        return None
-    for attr in IMAGE_ATTRS:
-        val = img.get(attr)
-        if val:
-            # handle srcset
-            if ' ' in val and ',' in val:
-                # pick last (largest) candidate
-                parts = [p.strip().split(' ')[0] for p in val.split(',') if p.strip()]
-                if parts:
-                    return parts[-1]
-            return val
-    return None
-
-def _normalize_url(url):
-    if not url:
-        return None
-    if url.startswith('//'):
-        return 'https:' + url
-    if url.startswith('/'):
-        return 'https://www.wayfair.com' + url
-    return url
 
 # NEW: parse application/ld+json structured data for products
 
-def _json_products_from_ldjson(soup):
+def _json_products_from_ldjson(soup, scripts=None):
     products = []
-    for script in soup.find_all('script', type=lambda v: v and 'ld+json' in v):
+    if scripts is None:
+        scripts = soup.find_all('script', type=lambda v: v and 'ld+json' in v)
+    for script in scripts:
         txt = script.string or script.get_text(strip=True) or ''
         if not txt:
             continue
         try:
-            data = json.loads(txt)
+            data = fast_json.loads(txt)
         except Exception:
             continue
         candidates = []
@@ -705,18 +975,63 @@ def _json_products_from_ldjson(soup):
 
 INLINE_JSON_PRODUCT_REGEX = re.compile(r'\{[^{}]{0,500}?"name"\s*:\s*"([^"\\]{1,120})"[^{}]{0,300}?"price"\s*:\s*"?\$?([0-9][0-9,]*\.?[0-9]{0,2})"?[^{}]*?\}', re.IGNORECASE)
 
-def _json_products_from_inline(soup, limit=50):
+# Pieces of INLINE_JSON_PRODUCT_REGEX used by the linear-time scanner below
+_BRACE_REGEX = re.compile(r'[{}]')
+_PRICE_KEY_REGEX = re.compile(r'"price"', re.IGNORECASE)
+_NAME_FIELD_REGEX = re.compile(r'"name"\s*:\s*"([^"\\]{1,120})"', re.IGNORECASE)
+_PRICE_FIELD_REGEX = re.compile(r'"price"\s*:\s*"?\$?([0-9][0-9,]*\.?[0-9]{0,2})', re.IGNORECASE)
+
+def _scan_inline_products(txt: str):
+    """Yield (name, price_digits) exactly like INLINE_JSON_PRODUCT_REGEX.finditer(txt).
+
+    The regex backtracks through up to 500 x 300 positions per "{" on large
+    bundles. Here each "name" key is checked once with bounded lookups:
+      - the nearest brace before it must be "{", at most 500 chars back
+      - a "price" key must follow the name value within 300 chars, brace-free
+      - the first brace after the price must be "}"
+    """
+    resume = 0
+    rfind = txt.rfind
+    nm = _NAME_FIELD_REGEX.search(txt)
+    while nm:
+        k = nm.start()
+        next_pos = k + 1
+        lo = k - 501 if k - 501 > resume else resume
+        b = max(rfind('{', lo, k), rfind('}', lo, k))
+        if b >= 0 and txt[b] == '{':
+            e = nm.end()
+            window_end = e + 300 + 7  # len('"price"')
+            pk = _PRICE_KEY_REGEX.search(txt, e, window_end)
+            while pk:
+                p = pk.start()
+                if txt.find('{', e, p) != -1 or txt.find('}', e, p) != -1:
+                    break
+                pm = _PRICE_FIELD_REGEX.match(txt, p)
+                if pm:
+                    # Later price keys share the same next brace, so this
+                    # decides the name candidate either way.
+                    close = _BRACE_REGEX.search(txt, pm.end())
+                    if close and close.group() == '}':
+                        yield nm.group(1), pm.group(1)
+                        resume = next_pos = close.end()
+                    break
+                pk = _PRICE_KEY_REGEX.search(txt, p + 1, window_end)
+        nm = _NAME_FIELD_REGEX.search(txt, next_pos)
+
+def _json_products_from_inline(soup, limit=50, scripts=None):
     text_sources = []
-    for script in soup.find_all('script'):
+    if scripts is None:
+        scripts = soup.find_all('script')
+    for script in scripts:
         txt = script.string or script.get_text() or ''
         if any(k in txt for k in PRODUCT_KEY_HINTS):
             text_sources.append(txt)
     products = []
     for txt in text_sources:
-        for m in INLINE_JSON_PRODUCT_REGEX.finditer(txt):
-            name = m.group(1).strip()
+        for raw_name, raw_price in _scan_inline_products(txt):
+            name = raw_name.strip()
             try:
-                price_val = float(m.group(2).replace(',', ''))
+                price_val = float(raw_price.replace(',', ''))
             except Exception:
                 price_val = None
             products.append({'name': name, 'price': price_val, 'image': None, 'url': None})
@@ -724,468 +1039,397 @@ def _json_products_from_inline(soup, limit=50):
                 return products
     return products
 
-def scrape_wayfair(query: str, price_min, price_max, category: str, style: str):
-    """Scrape Wayfair for products matching the query with resilient parsing.
-    NOTE: Scraping HTML can break if site markup changes; handle errors gracefully.
+
+class SiteSpec:
+    """Declarative description of one retailer's search results markup.
+
+    Selectors are compiled once here; _extract_with_spec() then walks the
+    document a single time, matching cards, fallback links, alt-text images
+    and scripts as it goes.
     """
-    results = []
-    debug_meta: Dict[str, Any] = {}
+
+    def __init__(self, key: str, site: str, origin: str, search_url: str, card_selector: str,
+                 title_selectors: List[str], price_selectors: List[str], link_hints: tuple,
+                 link_needs_price: bool = False, card_hints: tuple = ()):
+        self.key = key
+        self.site = site
+        self.origin = origin
+        self.search_url = search_url
+        self.card = sv.compile(card_selector)
+        self.titles = [sv.compile(s) for s in title_selectors]
+        # Only specific price selectors; a single card-text scan replaces the
+        # old generic 'span'/'div' fallbacks.
+        self.prices = [sv.compile(s) for s in price_selectors]
+        self.link_hints = link_hints
+        self.link_needs_price = link_needs_price
+        # Lowercase attribute substrings every card must contain; lets the
+        # incremental parser skip selector matching on unrelated elements.
+        self.card_hints = card_hints
+
+    def absolute_url(self, href):
+        if not href:
+            return None
+        if href.startswith('//'):
+            return 'https:' + href
+        if href.startswith('/'):
+            return self.origin + href
+        if href.startswith('http'):
+            return href
+        return None
+
+
+_IMG = sv.compile('img')
+_LINK = sv.compile('a[href]')
+
+def _fetch_base(name: str, default: str) -> str:
+    """Origin search pages are fetched from; <NAME>_BASE_URL points it at e.g. a replay.py server.
+    Result links still use the spec's real origin."""
+    return os.getenv(f'{name}_BASE_URL', default).rstrip('/')
+
+WAYFAIR_SPEC = SiteSpec(
+    key='wayfair', site='Wayfair', origin='https://www.wayfair.com',
+    search_url=_fetch_base('WAYFAIR', 'https://www.wayfair.com') + '/keyword.php?keyword={q}',
+    card_selector=', '.join([
+        '[data-enzyme-id="ProductCard"]',
+        'a.ProductCard',
+        '[data-hb-id="ProductCard"]',
+        'div[class*="ProductCard"]',
+        'li[class*="ProductCard"]',
+    ]),
+    title_selectors=[
+        '[data-enzyme-id="ProductName"]',
+        '[data-hb-id="ProductName"]',
+        'div[class*="Title"], span[class*="Title"], span',
+    ],
+    price_selectors=[
+        '[data-enzyme-id="RegularPrice"]',
+        '[data-enzyme-id="SalePrice"]',
+        '[data-hb-id*="Price"]',
+        'span[class*="Price"], div[class*="Price"]',
+    ],
+    link_hints=('/product/', 'keyword.php'),
+    link_needs_price=True,
+    card_hints=('productcard',),
+)
+
+IKEA_SPEC = SiteSpec(
+    key='ikea', site='IKEA', origin='https://www.ikea.com',
+    search_url=_fetch_base('IKEA', 'https://www.ikea.com') + '/us/en/search/products/?q={q}',
+    card_selector='div[class*="product" i], article[class*="product" i]',
+    title_selectors=['h3', 'h2', 'span[class*="name"]', '[data-testid*="name"]'],
+    price_selectors=['span[class*="price"]', '[data-testid*="price"]'],
+    link_hints=('/products/',),
+    card_hints=('product',),
+)
+
+WESTELM_SPEC = SiteSpec(
+    key='westelm', site='West Elm', origin='https://www.westelm.com',
+    search_url=_fetch_base('WESTELM', 'https://www.westelm.com') + '/search/results.html?words={q}',
+    card_selector=', '.join([
+        'div[class*="product" i]', 'article[class*="product" i]',
+        'div[class*="grid" i]', 'article[class*="grid" i]',
+    ]),
+    title_selectors=['h3', 'h2', 'span[class*="name"]', '[class*="title"]'],
+    price_selectors=['span[class*="price"]', '[class*="price"]'],
+    link_hints=('/products/',),
+    card_hints=('product', 'grid'),
+)
+
+
+def _parse_price_match(m):
+    if not m:
+        return None
     try:
-        w_url = f"https://www.wayfair.com/keyword.php?keyword={quote_plus(query)}"
-        resp = requests.get(
-            w_url,
-            timeout=TIMEOUT,
-            headers=_pick_headers(),
-            allow_redirects=True,
-        )
-        debug_meta['status_code'] = resp.status_code
-        if not resp.ok:
-            logger.warning(f"Wayfair request failed: {resp.status_code}")
-            return results, debug_meta
-        soup = BeautifulSoup(resp.text, 'html.parser')
-
-        # Aggregate candidate cards from multiple selector patterns
-        seen = set()
-        cards = []
-        per_selector_counts = {}
-        for sel in SELECTOR_SETS:
-            found = soup.select(sel)
-            per_selector_counts[sel] = len(found)
-            for f in found:
-                if id(f) not in seen:
-                    cards.append(f)
-                    seen.add(id(f))
-        # Fallback heuristic: anchors to product pages containing price
-        if not cards:
-            for a in soup.find_all('a', href=True):
-                if '/product/' in a['href'] or 'keyword.php' in a['href']:
-                    if '$' in a.get_text():
-                        cards.append(a)
-        logger.info(f"Wayfair candidate cards found: {len(cards)} for query '{query}'")
-        debug_meta['candidate_cards'] = len(cards)
-        debug_meta['per_selector'] = per_selector_counts
-
-        for card in cards:
+        return float(m.group(1).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def _card_title(spec: SiteSpec, card):
+    for sel in spec.titles:
+        el = sel.select_one(card)
+        if el:
+            txt = el.get_text(strip=True)
+            if txt:
+                return txt
+    title = card.get('aria-label') or card.get('title')
+    if not title:
+        img = _IMG.select_one(card)
+        if img and img.get('alt'):
+            title = img.get('alt')
+    return title or None
+
+
+def _card_price(spec: SiteSpec, card):
+    for sel in spec.prices:
+        el = sel.select_one(card)
+        if el:
+            val = _parse_price_match(PRICE_REGEX.search(el.get_text(" ", strip=True)))
+            if val is not None:
+                return val
+    # Fallback: first price-looking text anywhere in the card
+    return _parse_price_match(PRICE_REGEX.search(card.get_text(" ", strip=True)))
+
+
+def _img_src(spec: SiteSpec, img):
+    for attr in IMAGE_ATTRS:
+        val = img.get(attr)
+        if val:
+            # srcset: pick last (largest) candidate
+            if ' ' in val and ',' in val:
+                parts = [p.strip().split(' ')[0] for p in val.split(',') if p.strip()]
+                if parts:
+                    val = parts[-1]
+            return spec.absolute_url(val) or val
+    return None
+
+
+def _card_href(spec: SiteSpec, card):
+    if card.name == 'a':
+        return card.get('href')
+    link = _LINK.select_one(card)
+    return link.get('href') if link else None
+
+
+def _card_result(spec: SiteSpec, card, idx: int, page_url: str, price_min, price_max, category: str, style: str):
+    """Build one result from a matched card, or None if it has no title or is out of range."""
+    title = _card_title(spec, card)
+    if not title:
+        return None
+    price_val = _card_price(spec, card)
+    if not price_in_range(price_val, price_min, price_max):
+        return None
+    img = _IMG.select_one(card)
+    image_url = _img_src(spec, img) if img else None
+    href = spec.absolute_url(_card_href(spec, card)) or page_url
+    return make_result(spec.key, idx, title, price_val, spec.site, image_url, href, category, style)
+
+
+def _extract_with_spec(spec: SiteSpec, soup, query: str, page_url: str, price_min, price_max,
+                       category: str, style: str, debug_meta: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Extract up to MAX_PER_SITE results from a parsed search page.
+
+    One pass over the document: cards are extracted as they are met and the
+    walk stops once MAX_PER_SITE results exist. Fallback link cards are only
+    collected while no card has matched; alt-text images and scripts are
+    collected over the whole page. They are used (links, then ld+json, inline
+    JSON, alt text) when no card produced a result.
+    """
+    results: List[Dict[str, Any]] = []
+    cards_seen = 0
+    fallback_links = []
+    alt_imgs = []
+    scripts = []
+    first_word = (query.lower().split() or [''])[0]
+
+    def _add_card(card):
+        item = _card_result(spec, card, len(results), page_url, price_min, price_max, category, style)
+        if item:
+            results.append(item)
+
+    for el in soup.descendants:
+        if not isinstance(el, Tag):
+            continue
+        if spec.card.match(el):
+            cards_seen += 1
+            _add_card(el)
             if len(results) >= MAX_PER_SITE:
                 break
-            title_text, title_el = _extract_first(TITLE_SELECTORS, card)
-            if not title_text:
-                # fallback: use aria-label or alt text from image
-                title_text = card.get('aria-label') or None
-                if not title_text:
-                    img_alt = card.select_one('img')
-                    if img_alt and img_alt.get('alt'):
-                        title_text = img_alt.get('alt')
-            if not title_text:
+            continue
+        name = el.name
+        if name == 'a':
+            # Fallback links are only used when no card matched at all
+            if cards_seen:
                 continue
-            price_val = _extract_price(card)
+            href = el.get('href') or ''
+            if len(fallback_links) < MAX_PER_SITE * 4 and any(h in href for h in spec.link_hints):
+                if not spec.link_needs_price or '$' in el.get_text():
+                    fallback_links.append(el)
+        elif name == 'img':
+            alt = (el.get('alt') or '').strip()
+            if len(alt) > 5 and first_word and first_word in alt.lower() and len(alt_imgs) < MAX_PER_SITE:
+                alt_imgs.append((alt, el))
+        elif name == 'script':
+            # Also after the first card: the JSON fallbacks run when the
+            # matched cards yield no result, and need every script
+            scripts.append(el)
+
+    if not cards_seen:
+        for card in fallback_links:
+            if len(results) >= MAX_PER_SITE:
+                break
+            cards_seen += 1
+            _add_card(card)
+    logger.info(f"{spec.site} candidate cards found: {cards_seen} for query '{query}'")
+    debug_meta['candidate_cards'] = cards_seen
+
+    # JSON fallback(s)
+    json_products_used = 0
+    if not results:
+        ld_scripts = [sc for sc in scripts if 'ld+json' in (sc.get('type') or '')]
+        for p in _json_products_from_ldjson(soup, scripts=ld_scripts):
+            if len(results) >= MAX_PER_SITE:
+                break
+            price_val = p.get('price')
             if not price_in_range(price_val, price_min, price_max):
                 continue
-            image_url = _extract_image(card)
-            href = None
-            # Prefer nearest anchor
-            if card.name == 'a':
-                href = card.get('href')
-            else:
-                a_inside = card.select_one('a[href]')
-                if a_inside:
-                    href = a_inside.get('href')
-            href = _normalize_url(href) or w_url
-            results.append(make_result('wayfair', len(results), title_text, price_val, 'Wayfair', image_url, href, category, style))
-        # JSON fallback(s)
-        json_products_used = 0
-        if not results:
-            ld_products = _json_products_from_ldjson(soup)
-            for p in ld_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
-                    continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
-                    continue
-                results.append(make_result('wayfair', len(results), p['name'], price_val, 'Wayfair', p.get('image'), _normalize_url(p.get('url')) or w_url, category, style))
-                json_products_used += 1
-        if not results:
-            inline_products = _json_products_from_inline(soup)
-            for p in inline_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
-                    continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
-                    continue
-                results.append(make_result('wayfair', len(results), p['name'], price_val, 'Wayfair', p.get('image'), w_url, category, style))
-                json_products_used += 1
-        debug_meta['json_products_used'] = json_products_used
+            results.append(make_result(spec.key, len(results), p['name'], price_val, spec.site, p.get('image'), spec.absolute_url(p.get('url')) or page_url, category, style))
+            json_products_used += 1
+    if not results:
+        for p in _json_products_from_inline(soup, scripts=scripts):
+            if len(results) >= MAX_PER_SITE:
+                break
+            price_val = p.get('price')
+            if not price_in_range(price_val, price_min, price_max):
+                continue
+            results.append(make_result(spec.key, len(results), p['name'], price_val, spec.site, p.get('image'), page_url, category, style))
+            json_products_used += 1
+    debug_meta['json_products_used'] = json_products_used
 
-        # Alt/IMG fallback: grab imgs containing query in alt
-        if not results:
-            alts = []
-            lowered_query = query.lower()
-            for img in soup.find_all('img'):
-                alt = (img.get('alt') or '').strip()
-                if len(alt) > 5 and lowered_query.split()[0] in alt.lower():
-                    alts.append((alt, _extract_image(img.parent) if img.parent else img.get('src')))
-            for alt, img_url in alts[:MAX_PER_SITE]:
-                results.append(make_result('wayfair', len(results), alt, None, 'Wayfair', img_url, w_url, category, style))
-            debug_meta['alt_fallback_used'] = len(results)
+    # Alt/IMG fallback: images whose alt text mentions the query
+    if not results:
+        for alt, img in alt_imgs:
+            results.append(make_result(spec.key, len(results), alt, None, spec.site, _img_src(spec, img), page_url, category, style))
+        debug_meta['alt_fallback_used'] = len(results)
+    return results
 
-        if not results:
-            # Log diagnostic snippet when empty
-            snippet = resp.text[:2000].replace('\n', ' ') if resp.text else ''
-            logger.info(f"Wayfair parse produced zero results. HTML snippet: {snippet}")
-            debug_meta['html_snippet'] = snippet
-    except Exception as e:
-        logger.warning(f"Wayfair scrape failed: {e}")
-        debug_meta['exception'] = str(e)
-    return results, debug_meta
 
-def scrape_ikea(query: str, price_min, price_max, category: str, style: str):
-    """Scrape IKEA for furniture items."""
-    results = []
-    debug_meta = {}
+def _scrape_site(spec: SiteSpec, query: str, price_min, price_max, category: str, style: str):
+    """Fetch a retailer search page and run the spec extractor over it.
+    NOTE: Scraping HTML can break if site markup changes; handle errors gracefully.
+    """
+    results: List[Dict[str, Any]] = []
+    debug_meta: Dict[str, Any] = {}
     try:
-        ikea_url = f"https://www.ikea.com/us/en/search/products/?q={quote_plus(query)}"
-        resp = requests.get(
-            ikea_url,
+        page_url = spec.search_url.format(q=quote_plus(query))
+        incremental = INCREMENTAL_PARSE and etree is not None
+        resp = upstream.get(
+            spec.key,
+            page_url,
             timeout=TIMEOUT,
             headers=_pick_headers(),
             allow_redirects=True,
+            stream=incremental,
         )
         debug_meta['status_code'] = resp.status_code
         if not resp.ok:
-            logger.warning(f"IKEA request failed: {resp.status_code}")
+            logger.warning(f"{spec.site} request failed: {resp.status_code}")
+            resp.close()
             return results, debug_meta
-            
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        
-        # IKEA product selectors
-        def _class_has_product(x):
-            if not x:
-                return False
-            if isinstance(x, (list, tuple, set)):
-                s = ' '.join(x).lower()
-            else:
-                s = str(x).lower()
-            return 'product' in s
-        product_cards = soup.find_all(['div', 'article'], class_=_class_has_product)
-        if not product_cards:
-            # Fallback selectors
-            product_cards = soup.find_all('a', href=lambda x: x and '/products/' in x)[:MAX_PER_SITE]
-        
-        logger.info(f"IKEA candidate cards found: {len(product_cards)} for query '{query}'")
-        debug_meta['candidate_cards'] = len(product_cards)
-        
-        for card in product_cards:
-            if len(results) >= MAX_PER_SITE:
-                break
-                
-            # Extract title (use CSS selectors)
-            title = None
-            title_selectors = ['h3', 'h2', 'span[class*="name"]', '[data-testid*="name"]']
-            for sel in title_selectors:
-                title_el = card.select_one(sel)
-                if title_el and title_el.get_text(strip=True):
-                    title = title_el.get_text(strip=True)
-                    break
-            
-            if not title:
-                # Try aria-label or alt text
-                title = card.get('aria-label') or card.get('title')
-                if not title:
-                    img = card.find('img')
-                    if img:
-                        title = img.get('alt')
-            
-            if not title:
-                continue
-                
-            # Extract price
-            price_val = None
-            price_selectors = ['span[class*="price"]', '[data-testid*="price"]', 'span', 'div']
-            for sel in price_selectors:
-                price_el = card.select_one(sel)
-                if price_el:
-                    price_text = price_el.get_text()
-                    price_match = PRICE_REGEX.search(price_text)
-                    if price_match:
-                        try:
-                            price_val = float(price_match.group(1).replace(',', ''))
-                            break
-                        except ValueError:
-                            continue
-            
-            if not price_in_range(price_val, price_min, price_max):
-                continue
-                
-            # Extract image
-            image_url = None
-            img = card.find('img')
-            if img:
-                for attr in IMAGE_ATTRS:
-                    val = img.get(attr)
-                    if val:
-                        if val.startswith('//'):
-                            image_url = 'https:' + val
-                        elif val.startswith('/'):
-                            image_url = 'https://www.ikea.com' + val
-                        else:
-                            image_url = val
-                        break
-            
-            # Extract URL
-            product_url = ikea_url
-            if card.name == 'a':
-                href = card.get('href')
-                if href:
-                    if href.startswith('/'):
-                        product_url = 'https://www.ikea.com' + href
-                    elif href.startswith('http'):
-                        product_url = href
-            else:
-                link = card.find('a', href=True)
-                if link:
-                    href = link['href']
-                    if href.startswith('/'):
-                        product_url = 'https://www.ikea.com' + href
-                    elif href.startswith('http'):
-                        product_url = href
-            
-            results.append(make_result('ikea', len(results), title, price_val, 'IKEA', image_url, product_url, category, style))
-        
-        # JSON fallbacks similar to Wayfair
-        json_products_used = 0
-        if not results:
-            ld_products = _json_products_from_ldjson(soup)
-            for p in ld_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
-                    continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
-                    continue
-                url = p.get('url')
-                if url and url.startswith('/'):
-                    url = 'https://www.ikea.com' + url
-                results.append(make_result('ikea', len(results), p['name'], price_val, 'IKEA', p.get('image'), url or ikea_url, category, style))
-                json_products_used += 1
-        if not results:
-            inline_products = _json_products_from_inline(soup)
-            for p in inline_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
-                    continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
-                    continue
-                results.append(make_result('ikea', len(results), p['name'], price_val, 'IKEA', p.get('image'), ikea_url, category, style))
-                json_products_used += 1
-        debug_meta['json_products_used'] = json_products_used
-
-        # Alt/IMG fallback
-        if not results:
-            alts = []
-            lowered_query = query.lower()
-            for img in soup.find_all('img'):
-                alt = (img.get('alt') or '').strip()
-                if len(alt) > 5 and lowered_query.split()[0] in alt.lower():
-                    src = None
-                    for attr in IMAGE_ATTRS:
-                        val = img.get(attr)
-                        if val:
-                            src = val
-                            break
-                    alts.append((alt, src))
-            for alt, img_url in alts[:MAX_PER_SITE]:
-                results.append(make_result('ikea', len(results), alt, None, 'IKEA', img_url, ikea_url, category, style))
-            debug_meta['alt_fallback_used'] = len(results)
-
+        if incremental:
+            results, html = _stream_extract(spec, resp, query, page_url, price_min, price_max, category, style, debug_meta)
+        else:
+            html = resp.text
+        if html is not None:
+            soup = BeautifulSoup(html, 'html.parser')
+            results = _extract_with_spec(spec, soup, query, page_url, price_min, price_max, category, style, debug_meta)
         if not results:
-            snippet = resp.text[:2000].replace('\n', ' ') if resp.text else ''
-            logger.info(f"IKEA parse produced zero results. HTML snippet: {snippet}")
+            # Log diagnostic snippet when empty
+            snippet = html[:2000].replace('\n', ' ') if html else ''
+            logger.info(f"{spec.site} parse produced zero results. HTML snippet: {snippet}")
             debug_meta['html_snippet'] = snippet
-            
     except Exception as e:
-        logger.warning(f"IKEA scrape failed: {e}")
+        logger.warning(f"{spec.site} scrape failed: {e}")
         debug_meta['exception'] = str(e)
-    
     return results, debug_meta
 
-def scrape_westelm(query: str, price_min, price_max, category: str, style: str):
-    """Scrape West Elm for furniture items."""
-    results = []
-    debug_meta = {}
+def _stream_extract(spec: SiteSpec, resp, query: str, page_url: str, price_min, price_max,
+                    category: str, style: str, debug_meta: Dict[str, Any]):
+    """Push the streamed body through lxml's HTMLPullParser, extracting cards
+    as their end tags arrive, and close the connection as soon as
+    MAX_PER_SITE results (or an ld+json block with that many products) exist.
+
+    Returns (results, None) on an early stop, or ([], full_html) when the
+    whole page was read so the caller can run the regular extractor on it.
+    """
+    parser = etree.HTMLPullParser(events=('end',))
+    chunks: List[bytes] = []
+    bytes_read = 0
+    results: List[Dict[str, Any]] = []
+    ld_results: List[Dict[str, Any]] = []
+    cards_seen = 0
+    stopped = False
     try:
-        westelm_url = f"https://www.westelm.com/search/results.html?words={quote_plus(query)}"
-        resp = requests.get(
-            westelm_url,
-            timeout=TIMEOUT,
-            headers=_pick_headers(),
-            allow_redirects=True,
-        )
-        debug_meta['status_code'] = resp.status_code
-        if not resp.ok:
-            logger.warning(f"West Elm request failed: {resp.status_code}")
-            return results, debug_meta
-            
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        
-        # West Elm product selectors
-        def _class_has_product(x):
-            if not x:
-                return False
-            if isinstance(x, (list, tuple, set)):
-                s = ' '.join(x).lower()
-            else:
-                s = str(x).lower()
-            return 'product' in s or 'grid' in s
-        product_cards = soup.find_all(['div', 'article'], class_=_class_has_product)
-        if not product_cards:
-            # Fallback selectors
-            product_cards = soup.find_all('a', href=lambda x: x and '/products/' in x)[:MAX_PER_SITE]
-        
-        logger.info(f"West Elm candidate cards found: {len(product_cards)} for query '{query}'")
-        debug_meta['candidate_cards'] = len(product_cards)
-        
-        for card in product_cards:
-            if len(results) >= MAX_PER_SITE:
-                break
-                
-            # Extract title
-            title = None
-            title_selectors = ['h3', 'h2', 'span[class*="name"]', '[class*="title"]']
-            for sel in title_selectors:
-                title_el = card.select_one(sel)
-                if title_el and title_el.get_text(strip=True):
-                    title = title_el.get_text(strip=True)
-                    break
-            
-            if not title:
-                title = card.get('aria-label') or card.get('title')
-                if not title:
-                    img = card.find('img')
-                    if img:
-                        title = img.get('alt')
-            
-            if not title:
-                continue
-                
-            # Extract price
-            price_val = None
-            price_selectors = ['span[class*="price"]', '[class*="price"]', 'span', 'div']
-            for sel in price_selectors:
-                price_el = card.select_one(sel)
-                if price_el:
-                    price_text = price_el.get_text()
-                    price_match = PRICE_REGEX.search(price_text)
-                    if price_match:
-                        try:
-                            price_val = float(price_match.group(1).replace(',', ''))
-                            break
-                        except ValueError:
-                            continue
-            
-            if not price_in_range(price_val, price_min, price_max):
+        for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if not chunk:
                 continue
-                
-            # Extract image
-            image_url = None
-            img = card.find('img')
-            if img:
-                for attr in IMAGE_ATTRS:
-                    val = img.get(attr)
-                    if val:
-                        if val.startswith('//'):
-                            image_url = 'https:' + val
-                        elif val.startswith('/'):
-                            image_url = 'https://www.westelm.com' + val
-                        else:
-                            image_url = val
-                        break
-            
-            # Extract URL
-            product_url = westelm_url
-            if card.name == 'a':
-                href = card.get('href')
-                if href:
-                    if href.startswith('/'):
-                        product_url = 'https://www.westelm.com' + href
-                    elif href.startswith('http'):
-                        product_url = href
-            else:
-                link = card.find('a', href=True)
-                if link:
-                    href = link['href']
-                    if href.startswith('/'):
-                        product_url = 'https://www.westelm.com' + href
-                    elif href.startswith('http'):
-                        product_url = href
-            
-            results.append(make_result('westelm', len(results), title, price_val, 'West Elm', image_url, product_url, category, style))
-        
-        # JSON fallbacks
-        json_products_used = 0
-        if not results:
-            ld_products = _json_products_from_ldjson(soup)
-            for p in ld_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
+            chunks.append(chunk)
+            bytes_read += len(chunk)
+            parser.feed(chunk)
+            for _, el in parser.read_events():
+                if not isinstance(el.tag, str):
                     continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
+                if el.tag == 'script':
+                    if 'ld+json' in (el.get('type') or '') and el.text:
+                        frag = BeautifulSoup(f'<script type="application/ld+json">{el.text}</script>', 'html.parser')
+                        ld_results = []
+                        for p in _json_products_from_ldjson(frag):
+                            if len(ld_results) >= MAX_PER_SITE:
+                                break
+                            if price_in_range(p.get('price'), price_min, price_max):
+                                ld_results.append(make_result(spec.key, len(ld_results), p['name'], p.get('price'), spec.site, p.get('image'), spec.absolute_url(p.get('url')) or page_url, category, style))
+                        if len(ld_results) >= MAX_PER_SITE:
+                            stopped = True
+                            break
                     continue
-                url = p.get('url')
-                if url and url.startswith('/'):
-                    url = 'https://www.westelm.com' + url
-                results.append(make_result('westelm', len(results), p['name'], price_val, 'West Elm', p.get('image'), url or westelm_url, category, style))
-                json_products_used += 1
-        if not results:
-            inline_products = _json_products_from_inline(soup)
-            for p in inline_products:
-                if len(results) >= MAX_PER_SITE:
-                    break
-                if not p.get('name'):
+                attrs = ' '.join(el.attrib.values()).lower()
+                if not any(h in attrs for h in spec.card_hints):
                     continue
-                price_val = p.get('price')
-                if not price_in_range(price_val, price_min, price_max):
+                card = BeautifulSoup(etree.tostring(el, encoding='unicode', method='html'), 'html.parser').find(True)
+                if card is None or not spec.card.match(card):
                     continue
-                results.append(make_result('westelm', len(results), p['name'], price_val, 'West Elm', p.get('image'), westelm_url, category, style))
-                json_products_used += 1
-        debug_meta['json_products_used'] = json_products_used
+                cards_seen += 1
+                item = _card_result(spec, card, len(results), page_url, price_min, price_max, category, style)
+                if item:
+                    results.append(item)
+                    if len(results) >= MAX_PER_SITE:
+                        stopped = True
+                        break
+            if stopped:
+                break
+    finally:
+        wire_read = None
+        try:
+            wire_read = resp.raw.tell()
+        except Exception:
+            pass
+        resp.close()
+
+    content_length = resp.headers.get('Content-Length')
+    content_length = int(content_length) if content_length and content_length.isdigit() else None
+    bytes_saved = None
+    if stopped and content_length is not None and wire_read is not None:
+        bytes_saved = max(content_length - wire_read, 0)
+    debug_meta['incremental'] = {
+        'stopped_early': stopped,
+        'bytes_read': bytes_read,
+        'wire_bytes_read': wire_read,
+        'content_length': content_length,
+        'bytes_saved': bytes_saved,
+    }
+    logger.info(f"{spec.site} incremental parse: stopped_early={stopped} read={bytes_read}B saved={bytes_saved if bytes_saved is not None else 'unknown'}B")
+    if not stopped:
+        return [], b''.join(chunks).decode(resp.encoding or 'utf-8', errors='replace')
+    debug_meta['candidate_cards'] = cards_seen
+    if len(results) >= MAX_PER_SITE:
+        return results, None
+    debug_meta['json_products_used'] = len(ld_results)
+    return ld_results, None
+
+@tracing.traced('scrape.wayfair')
+def scrape_wayfair(query: str, price_min, price_max, category: str, style: str):
+    """Scrape Wayfair for products matching the query with resilient parsing."""
+    return _scrape_site(WAYFAIR_SPEC, query, price_min, price_max, category, style)
 
-        # Alt/IMG fallback
-        if not results:
-            alts = []
-            lowered_query = query.lower()
-            for img in soup.find_all('img'):
-                alt = (img.get('alt') or '').strip()
-                if len(alt) > 5 and lowered_query.split()[0] in alt.lower():
-                    src = None
-                    for attr in IMAGE_ATTRS:
-                        val = img.get(attr)
-                        if val:
-                            src = val
-                            break
-                    alts.append((alt, src))
-            for alt, img_url in alts[:MAX_PER_SITE]:
-                results.append(make_result('westelm', len(results), alt, None, 'West Elm', img_url, westelm_url, category, style))
-            debug_meta['alt_fallback_used'] = len(results)
+@tracing.traced('scrape.ikea')
+def scrape_ikea(query: str, price_min, price_max, category: str, style: str):
+    """Scrape IKEA for furniture items."""
+    return _scrape_site(IKEA_SPEC, query, price_min, price_max, category, style)
 
-        if not results:
-            snippet = resp.text[:2000].replace('\n', ' ') if resp.text else ''
-            logger.info(f"West Elm parse produced zero results. HTML snippet: {snippet}")
-            debug_meta['html_snippet'] = snippet
-            
-    except Exception as e:
-        logger.warning(f"West Elm scrape failed: {e}")
-        debug_meta['exception'] = str(e)
-    
-    return results, debug_meta
+@tracing.traced('scrape.west_elm')
+def scrape_westelm(query: str, price_min, price_max, category: str, style: str):
+    """Scrape West Elm for furniture items."""
+    return _scrape_site(WESTELM_SPEC, query, price_min, price_max, category, style)
 
 def get_fallback_results(query: str, category: str, style: str) -> List[Dict[str, Any]]:
     """Generate fallback results when scraping fails."""
@@ -1242,12 +1486,15 @@ def get_fallback_results(query: str, category: str, style: str) -> List[Dict[str
     return results[:6]  # Return up to 6 fallback results
 
 SERPAPI_KEY = os.getenv('SERPAPI_KEY')
+SERPAPI_BASE_URL = os.getenv('SERPAPI_BASE_URL', 'https://serpapi.com').rstrip('/')
 DISABLE_SEARCH_FALLBACK = os.getenv('DISABLE_SEARCH_FALLBACK') == '1'
 # Default to using the decoupled real search module when it is available, unless explicitly disabled via env
 _env_use_real = os.getenv('USE_REAL_SEARCH_MODULE')
 USE_REAL_SEARCH_MODULE = (search_furniture_real is not None) if _env_use_real is None else (_env_use_real == '1')  # UPDATED
 # NEW: Flag to route searches to Wayfair module only (default on for now)
 WAYFAIR_ONLY = os.getenv('WAYFAIR_ONLY', '1') == '1'
+# Upsert live results into the local product index (used by "mode": "local")
+PRODUCT_INDEX_ENABLED = os.getenv('PRODUCT_INDEX', '1') == '1'
 
 # --- SerpAPI helpers (optional real results) ---
 
@@ -1280,6 +1527,7 @@ def _site_name_from_url(url: str) -> str:
 
 # Restored helper
 
+@tracing.traced('serpapi')
 def _search_serpapi_for_domain(query: str, domain: str, price_min, price_max, category: str, style: str, limit: int = 10):
     results = []
     debug = {}
@@ -1295,12 +1543,12 @@ def _search_serpapi_for_domain(query: str, domain: str, price_min, price_max, ca
             'api_key': SERPAPI_KEY,
             'num': max(limit, MAX_PER_SITE)
         }
-        r = requests.get('https://serpapi.com/search.json', params=params, timeout=TIMEOUT)
+        r = upstream.get('serpapi', f'{SERPAPI_BASE_URL}/search.json', params=params, timeout=TIMEOUT)
         debug['status_code'] = r.status_code
         if not r.ok:
             debug['error'] = f"HTTP {r.status_code}"
             return results, debug
-        data = r.json()
+        data = fast_json.response_json(r)
         items = data.get('shopping_results') or []
         debug['raw_count'] = len(items)
         for it in items:
@@ -1326,13 +1574,141 @@ def _search_serpapi_for_domain(query: str, domain: str, price_min, price_max, ca
         debug['exception'] = str(e)
         return results, debug
 
+@tracing.traced('index.upsert')
+def _index_results(items) -> None:
+    """Upsert live (non-fallback) results into the local product index."""
+    if product_index is None or not PRODUCT_INDEX_ENABLED or not items:
+        return
+    try:
+        product_index.upsert_products(items)
+    except Exception as e:
+        logger.warning(f"Product index update failed: {e}")
+
+@tracing.traced('index.search')
+def _local_search_rows(query: str, price_min, price_max):
+    if product_index is None or not PRODUCT_INDEX_ENABLED:
+        return [], None
+    try:
+        return product_index.search(query, limit=20, price_min=price_min, price_max=price_max)
+    except Exception as e:
+        logger.warning(f"Product index search failed: {e}")
+        return [], None
+
+def _proxy_result_images(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Point result (and alternate offer) images at /image-proxy when enabled."""
+    if not IMAGE_PROXY_RESULTS:
+        return body
+    for r in body.get('results') or []:
+        if isinstance(r, Product):
+            for rec in [r] + (r.offers or []):
+                rec.image = _proxied_image_url(rec.image)
+    return body
+
+def _colored(records: List[Product], color, with_colors: bool) -> List[Product]:
+    """Index rows get the same colour filter (or colour attachment) as live results."""
+    if color:
+        return _filter_by_color(records, color)
+    if with_colors:
+        _attach_colors(records)
+    return records
+
 @app.route('/search-furniture', methods=['POST'])
 def search_furniture_endpoint():
     """Multi-site furniture search aggregating results from Wayfair, IKEA, West Elm, and Pottery Barn.
     WARNING: Demo scraping only; respect site ToS and robots.txt for production use.
+
+    Pass "mode": "local" to answer from the local product index; live retailer
+    fetches then only run when the index is thin or stale for the query.
+    Pass "sort": "price_asc" | "price_desc" | "relevance" to order results
+    (default: relevance, BM25 over titles with per-site diversity).
     """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
+    if data.get('query') is not None and not isinstance(data['query'], str):
+        return jsonify({'success': False, 'error': 'query must be a string'}), 400
+    if data.get('filters') is not None and not isinstance(data['filters'], dict):
+        return jsonify({'success': False, 'error': 'filters must be an object'}), 400
+    # null query/filters mean "not given"
+    data['query'] = data.get('query') or ''
+    data['filters'] = data.get('filters') or {}
+    tracing.current_span().set(query=data['query'].strip()[:100], mode=data.get('mode') or 'live')
+    if data.get('mode') != 'local':
+        SEARCH_REQUESTS.inc(mode='live')
+        with SEARCH_DURATION.time(mode='live'), upstream.deadline(SEARCH_DEADLINE):
+            body, status = _search_furniture_live(data)
+        return jsonify(_proxy_result_images(body)), status
+    try:
+        body, status = _search_furniture_local(data)
+    except Exception as e:
+        logger.error(f"Search failed: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify(_proxy_result_images(body)), status
+
+def _search_furniture_local(data: Dict[str, Any]):
+    """Answer from the local product index, going live when it is thin. Returns (response_body, http_status)."""
+    query = data['query'].strip()
+    filters = data.get('filters', {})
+    category = filters.get('category', 'all')
+    style = filters.get('style', 'all')
+    price_min, price_max = PRICE_RANGE_MAP.get(filters.get('priceRange', 'all'), (None, None))
+    color = (filters.get('color') or '').strip().lower() or None
+    with_colors = bool(data.get('colors')) or COLOR_RESULTS
+    if color and (palette is None or not palette.valid_color(color)):
+        return {'success': False, 'error': f"Unsupported color filter: {filters.get('color')}"}, 400
+    started = time.perf_counter()
+    rows, freshest = _local_search_rows(query, price_min, price_max)
+    local_ms = round((time.perf_counter() - started) * 1000, 2)
+    SEARCH_REQUESTS.inc(mode='local')
+    if query and product_index is not None and product_index.is_sufficient(rows, freshest):
+        CACHE_REQUESTS.inc(cache='local_index', result='hit')
+        final = _colored([product_index.to_result(r, i, category, style) for i, r in enumerate(rows)], color, with_colors)
+        SEARCH_RESULTS.inc(len(final), source='local_index')
+        SEARCH_DURATION.observe(time.perf_counter() - started, mode='local')
+        if data.get('sort') in SORT_OPTIONS:
+            final = _order_results(final, data['sort'])
+        logger.info(f"Answered '{query}' from local index ({len(final)} results, {local_ms}ms)")
+        body = {
+            'success': True,
+            'results': final,
+            'total': len(final),
+            'query': query,
+            'sites_searched': sorted({r.site for r in final if r.site}),
+            'source': 'local-index',
+        }
+        if data.get('debug') or os.getenv('SEARCH_DEBUG') == '1':
+            body['debug'] = {'localIndex': {'hits': len(rows), 'lastSeen': freshest, 'ms': local_ms}}
+        return body, 200
+
+    # Index is thin or stale: fetch live (which refreshes the index), then
+    # fill remaining slots from index rows the live answer did not include.
+    CACHE_REQUESTS.inc(cache='local_index', result='miss')
+    with SEARCH_DURATION.time(mode='local_miss'), upstream.deadline(SEARCH_DEADLINE):
+        body, status = _search_furniture_live(data)
+    if status == 200 and body.get('success') and body.get('sites_searched') != ['Fallback Data']:
+        rows, _ = _local_search_rows(query, price_min, price_max)
+        results = list(body.get('results') or [])
+        seen = {r.url for r in results if r.url}
+        extra = []
+        for r in rows:
+            if r.get('url') and r['url'] in seen:
+                continue
+            seen.add(r.get('url'))
+            extra.append(product_index.to_result(r, len(results) + len(extra), category, style))
+        # Live results are already colour-filtered; index rows are not
+        results += _colored(extra, color, with_colors)[:max(0, 20 - len(results))]
+        if data.get('sort') in SORT_OPTIONS:
+            results = _order_results(results, data['sort'])
+        body['results'] = results
+        body['total'] = len(results)
+        body['source'] = 'live+local-index'
+    return body, status
+
+def _search_furniture_live(data: Dict[str, Any]):
+    """Run the live multi-site search. Returns (response_body, http_status)."""
     try:
-        data = request.get_json(silent=True) or {}
         query = data.get('query', '').strip()
         filters = data.get('filters', {})
         price_range = filters.get('priceRange', 'all')
@@ -1340,9 +1716,14 @@ def search_furniture_endpoint():
         category = filters.get('category', 'all')
         debug_flag = data.get('debug') or os.getenv('SEARCH_DEBUG') == '1'
         no_fallback = data.get('noFallback') or DISABLE_SEARCH_FALLBACK
+        sort = data.get('sort') if data.get('sort') in SORT_OPTIONS else None
+        color = (filters.get('color') or '').strip().lower() or None
+        with_colors = bool(data.get('colors')) or COLOR_RESULTS
+        if color and (palette is None or not palette.valid_color(color)):
+            return {'success': False, 'error': f"Unsupported color filter: {filters.get('color')}"}, 400
 
         if not query:
-            return jsonify({'success': True, 'results': []})
+            return {'success': True, 'results': []}, 200
 
         price_min, price_max = PRICE_RANGE_MAP.get(price_range, (None, None))
         
@@ -1358,33 +1739,29 @@ def search_furniture_endpoint():
                     wayfair_items = wayfair_get_products(query=query)
                 wf_adapted = _adapt_wayfair_products(wayfair_items, category, style)
 
-                # Pottery Barn via API
-                pb_items = pb_get_products(query)
+                # Pottery Barn via API (price range pushed down when the facet is configured)
+                pb_items = pb_get_products(query, price_min=price_min, price_max=price_max)
                 pb_adapted = _adapt_pottery_barn_products(pb_items, category, style) if pb_items else []
 
                 # West Elm via API
-                we_items = we_get_products(query)
+                we_items = we_get_products(query, price_min=price_min, price_max=price_max)
                 we_adapted = _adapt_west_elm_products(we_items, category, style) if we_items else []
 
                 # Raymour & Flanigan via API
-                rf_items = rf_get_products(query)
+                rf_items = rf_get_products(query, price_min=price_min, price_max=price_max)
                 rf_adapted = _adapt_raymour_flanigan_products(rf_items, category, style) if rf_items else []
 
-                # Combine + dedupe by URL
-                combined = []
-                seen_urls = set()
-                for lst in (wf_adapted, pb_adapted, we_adapted, rf_adapted):
-                    for it in lst:
-                        u = it.get('url') or ''
-                        if u and u in seen_urls:
-                            continue
-                        if u:
-                            seen_urls.add(u)
-                        combined.append(it)
-
-                if combined:
-                    random.shuffle(combined)
-                    final = combined[:20]
+                # Server-side price filter (unpriced items pass, as in the HTML scrapers)
+                site_lists = [_filter_by_price(lst, price_min, price_max) for lst in (wf_adapted, pb_adapted, we_adapted, rf_adapted)]
+                filtered_out = sum(map(len, (wf_adapted, pb_adapted, we_adapted, rf_adapted))) - sum(map(len, site_lists))
+
+                # Combine; canonical-URL and cross-retailer near-duplicates collapse into one entry
+                combined = dedupe.collapse([it for lst in site_lists for it in lst], image_hash=_record_image_hash)
+
+                # Everything filtered by price is still an answer; don't fall back to scraping
+                if combined or filtered_out:
+                    final = _top_results(combined, query, sort, color=color, with_colors=with_colors)
+                    SEARCH_RESULTS.inc(len(combined), source='module')
                     sites = []
                     if wf_adapted:
                         sites.append('Wayfair')
@@ -1405,13 +1782,19 @@ def search_furniture_endpoint():
                         response['debug'] = {
                             'wayfairOnly': True,
                             'priceRange': [price_min, price_max],
+                            'sort': sort,
+                            'filtered_by_price': filtered_out,
+                            'collapsed_duplicates': sum(map(len, site_lists)) - len(combined),
                             'wayfair_raw_count': len(wayfair_items) if isinstance(wayfair_items, list) else None,
                             'pb_raw_count': len(pb_items) if isinstance(pb_items, list) else None,
                             'we_raw_count': len(we_items) if isinstance(we_items, list) else None,
                             'rf_raw_count': len(rf_items) if isinstance(rf_items, list) else None,
                         }
+                    # Index everything fetched, not just this price range
+                    _index_results(wf_adapted + pb_adapted + we_adapted + rf_adapted)
+                    _queue_visual_hashes(final)
                     logger.info(f"Returning {len(response['results'])} results from Wayfair + Pottery Barn + West Elm + Raymour & Flanigan modules")
-                    return jsonify(response)
+                    return response, 200
                 else:
                     logger.warning("Wayfair+PB+WE+RF modules returned no adaptable items; falling back to HTML scrapers")
             except Exception as e:
@@ -1431,23 +1814,25 @@ def search_furniture_endpoint():
                 serp_debug[domain] = sd
                 added = 0
                 for item in serp_results:
-                    if item['url'] in seen_urls:
+                    if item.url in seen_urls:
                         continue
-                    seen_urls.add(item['url'])
+                    seen_urls.add(item.url)
                     all_results.append(item)
                     added += 1
                 if added:
                     sites_searched.append(_site_name_from_url(f'https://{domain}'))
+                SEARCH_RESULTS.inc(added, source='serpapi')
             debug_info['serpapi'] = {**serp_debug, 'used': True}
         else:
             debug_info['serpapi'] = {'used': False}
         
         # Also try HTML scrapers to supplement results
+        before_scrapers = len(all_results)
         try:
             wayfair_results, wayfair_debug = scrape_wayfair(query, price_min, price_max, category, style)
             for it in wayfair_results:
-                if it['url'] not in seen_urls:
-                    seen_urls.add(it['url'])
+                if it.url not in seen_urls:
+                    seen_urls.add(it.url)
                     all_results.append(it)
             sites_searched.append('Wayfair')
             debug_info['wayfair'] = wayfair_debug
@@ -1459,8 +1844,8 @@ def search_furniture_endpoint():
         try:
             ikea_results, ikea_debug = scrape_ikea(query, price_min, price_max, category, style)
             for it in ikea_results:
-                if it['url'] not in seen_urls:
-                    seen_urls.add(it['url'])
+                if it.url not in seen_urls:
+                    seen_urls.add(it.url)
                     all_results.append(it)
             sites_searched.append('IKEA')
             debug_info['ikea'] = ikea_debug
@@ -1472,8 +1857,8 @@ def search_furniture_endpoint():
         try:
             westelm_results, westelm_debug = scrape_westelm(query, price_min, price_max, category, style)
             for it in westelm_results:
-                if it['url'] not in seen_urls:
-                    seen_urls.add(it['url'])
+                if it.url not in seen_urls:
+                    seen_urls.add(it.url)
                     all_results.append(it)
             sites_searched.append('West Elm')
             debug_info['westelm'] = westelm_debug
@@ -1482,16 +1867,19 @@ def search_furniture_endpoint():
             logger.error(f"West Elm search failed: {e}")
             debug_info['westelm'] = {'error': str(e)}
 
+        SEARCH_RESULTS.inc(len(all_results) - before_scrapers, source='scraper')
+        before_api = len(all_results)
+
         # NEW: Add Pottery Barn API results to multi-site flow
         try:
-            pb_items = pb_get_products(query)
-            pb_adapted = _adapt_pottery_barn_products(pb_items, category, style) if pb_items else []
+            pb_items = pb_get_products(query, price_min=price_min, price_max=price_max)
+            pb_adapted = _filter_by_price(_adapt_pottery_barn_products(pb_items, category, style) if pb_items else [], price_min, price_max)
             added = 0
             for it in pb_adapted:
-                if it['url'] and it['url'] in seen_urls:
+                if it.url and it.url in seen_urls:
                     continue
-                if it['url']:
-                    seen_urls.add(it['url'])
+                if it.url:
+                    seen_urls.add(it.url)
                 all_results.append(it)
                 added += 1
             if added:
@@ -1504,14 +1892,14 @@ def search_furniture_endpoint():
 
         # NEW: Add West Elm API results to multi-site flow (in addition to HTML scraper)
         try:
-            we_items = we_get_products(query)
-            we_adapted = _adapt_west_elm_products(we_items, category, style) if we_items else []
+            we_items = we_get_products(query, price_min=price_min, price_max=price_max)
+            we_adapted = _filter_by_price(_adapt_west_elm_products(we_items, category, style) if we_items else [], price_min, price_max)
             added = 0
             for it in we_adapted:
-                if it['url'] and it['url'] in seen_urls:
+                if it.url and it.url in seen_urls:
                     continue
-                if it['url']:
-                    seen_urls.add(it['url'])
+                if it.url:
+                    seen_urls.add(it.url)
                 all_results.append(it)
                 added += 1
             if added and 'West Elm' not in sites_searched:
@@ -1524,14 +1912,14 @@ def search_furniture_endpoint():
 
         # NEW: Add Raymour & Flanigan API results to multi-site flow
         try:
-            rf_items = rf_get_products(query)
-            rf_adapted = _adapt_raymour_flanigan_products(rf_items, category, style) if rf_items else []
+            rf_items = rf_get_products(query, price_min=price_min, price_max=price_max)
+            rf_adapted = _filter_by_price(_adapt_raymour_flanigan_products(rf_items, category, style) if rf_items else [], price_min, price_max)
             added = 0
             for it in rf_adapted:
-                if it['url'] and it['url'] in seen_urls:
+                if it.url and it.url in seen_urls:
                     continue
-                if it['url']:
-                    seen_urls.add(it['url'])
+                if it.url:
+                    seen_urls.add(it.url)
                 all_results.append(it)
                 added += 1
             if added:
@@ -1542,6 +1930,9 @@ def search_furniture_endpoint():
             logger.error(f"Raymour & Flanigan API fetch failed: {e}")
             debug_info['raymour_flanigan'] = {'error': str(e)}
 
+        SEARCH_RESULTS.inc(len(all_results) - before_api, source='api')
+        _index_results(all_results)
+
         # If no results from scraping, optional fallback
         if not all_results:
             logger.warning("No results from scrapers/SerpAPI")
@@ -1549,12 +1940,13 @@ def search_furniture_endpoint():
                 logger.warning("Using fallback results")
                 all_results = get_fallback_results(query, category, style)
                 sites_searched = ['Fallback Data']
+                SEARCH_RESULTS.inc(len(all_results), source='fallback')
 
-        # Shuffle results to mix sites
-        random.shuffle(all_results)
-        
-        # Limit total results
-        final_results = all_results[:20]
+        # Collapse near-duplicates, rank (BM25 with per-site diversity) or price-sort, then limit
+        final_results = _top_results(dedupe.collapse(all_results, image_hash=_record_image_hash), query, sort,
+                                     color=color, with_colors=with_colors)
+        if sites_searched != ['Fallback Data']:
+            _queue_visual_hashes(final_results)
 
         response = {
             'success': True, 
@@ -1574,11 +1966,11 @@ def search_furniture_endpoint():
             }
             
         logger.info(f"Returning {len(final_results)} total results from {len(sites_searched)} sites")
-        return jsonify(response)
+        return response, 200
         
     except Exception as e:
         logger.error(f"Search failed: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return {'success': False, 'error': str(e)}, 500
 
 # NEW: Adapter for dedicated Wayfair module results (moved above usage)
 # def _adapt_wayfair_products(...):
@@ -1595,52 +1987,53 @@ def constructor_keys_status():
 
 @app.route('/constructor-keys/refresh', methods=['POST'])
 def constructor_keys_refresh():
-    """Refresh Constructor.io keys for supported sites using Playwright capture.
+    """Start a background Playwright capture of the Constructor.io keys.
+
+    Returns 202 with the job right away; poll GET /constructor-keys/refresh
+    for its state (any worker can answer). A refresh already in progress,
+    in any worker, is returned rather than started twice. Body (optional): {"headless": false} to watch the browser.
     Requires playwright and browser binaries installed.
     """
     try:
-        if not ctor_save_keys or not ctor_status:
+        if key_refresher is None:
             return jsonify({'success': False, 'error': 'Key store unavailable'}), 500
-        try:
-            from refresh_api_keys import fetch_keys_once  # type: ignore
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'Playwright refresh not available: {e}'}), 500
-        # Run refresh in NON-headless mode per request (use original script)
-        try:
-            keys = fetch_keys_once(headless=False)  # type: ignore
-        except TypeError:
-            # Backward compatibility if function has no headless param
-            keys = fetch_keys_once()  # type: ignore
-        if not keys:
-            return jsonify({'success': False, 'error': 'No keys captured'}), 500
-        merged = ctor_save_keys(keys)
-        stat = ctor_status()
-        # Compute sites missing key or clientlib after refresh
-        missing_sites = [
-            s for s, v in (stat or {}).items()
-            if not (isinstance(v, dict) and v.get('has_key') and v.get('has_clientlib'))
-        ]
-        return jsonify({
-            'success': True,
-            'keys': {k: {"key": v.get('key'), "clientlib": v.get('clientlib')} for k, v in merged.items()},
-            'status': stat,
-            'missing_sites': missing_sites,
-        })
+        if not PLAYWRIGHT_AVAILABLE:
+            return jsonify({'success': False, 'error': 'Playwright refresh not available: playwright is not installed'}), 500
+        data = request.get_json(silent=True) or {}
+        headless = data.get('headless')
+        job = key_refresher.start(**({'headless': bool(headless)} if headless is not None else {}))
+        return jsonify({'success': True, 'job': job, 'status': ctor_status()}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-if __name__ == '__main__':
-    logger.info("Starting furniture search + rembg backend server...")
-    # Optionally preload rembg model for faster first request
+@app.route('/constructor-keys/refresh', methods=['GET'])
+def constructor_keys_refresh_job():
+    """State of the current or most recent key refresh job."""
     try:
-        if session is None:
-            logger.info("Preloading rembg model (u2net)...")
-            session = new_session('u2net')
-            setattr(session, '_model_name', 'u2net')
-            logger.info("Model preloaded successfully")
+        if key_refresher is None:
+            return jsonify({'success': False, 'error': 'Key store unavailable'}), 500
+        job = key_refresher.job()
+        if job is None:
+            return jsonify({'success': False, 'error': 'No refresh has run yet'}), 404
+        return jsonify({'success': True, 'job': job, 'status': ctor_status()})
     except Exception as e:
-        logger.warning(f"Failed to preload rembg model: {e}")
-        session = None
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# NEW: periodic headless key refresh (CONSTRUCTOR_KEY_REFRESH_INTERVAL seconds, 0 disables).
+# Started by the server entry point, not on import: scripts and benchmarks that
+# import this module must not launch a browser.
+def start_key_refresh_schedule(leader_lock: bool = False) -> bool:
+    """leader_lock: several processes call this; one at a time refreshes (gunicorn workers)."""
+    if key_refresher is None or not PLAYWRIGHT_AVAILABLE:
+        return False
+    return key_refresher.start_schedule(KEY_REFRESH_INTERVAL, leader_lock=SCHEDULE_LOCK if leader_lock else None)
+
+if __name__ == '__main__':
+    logger.info("Starting furniture search + rembg backend server...")
+    # Preload rembg models for a faster first request (REMBG_PRELOAD_MODELS, empty to skip)
+    if preload_models():
+        logger.info("Model preloaded successfully")
+    start_key_refresh_schedule()
 
     host = os.getenv('HOST', '127.0.0.1')
     # Default to port 5000 to match frontend/tests; can override via PORT env var
@@ -0,0 +1,82 @@
+"""Worst-case and typical timings: INLINE_JSON_PRODUCT_REGEX vs _scan_inline_products.
+
+Usage:
+    python benchmarks/bench_inline_json.py [script_body.js ...] [--repeat N]
+
+Besides any script bodies given on the command line, runs synthetic state
+bundles and adversarial inputs built to maximise regex backtracking. Each
+row reports both timings and whether the outputs are identical.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py imports rembg at module load; the scanner does not need it.
+if 'rembg' not in sys.modules:
+    try:
+        import rembg  # noqa: F401
+    except Exception:
+        sys.modules['rembg'] = types.SimpleNamespace(remove=None, new_session=None)
+
+import app  # noqa: E402
+from synthetic_pages import _inline_state  # noqa: E402
+
+
+def adversarial_names_without_price(objects=400):
+    # Every "{" has ~80 "name" candidates in reach and no price: the regex
+    # retries the 300-char price window for each of them.
+    body = '"name":"x",' * 45
+    return ''.join('{' + body + '}' for _ in range(objects))
+
+
+def adversarial_far_price(objects=400):
+    # Price just past the 300-char window after every name candidate.
+    body = ('"name":"ab"' + ' ' * 12) * 20 + ' ' * 301 + '"price":"$10"'
+    return ''.join('{' + body + '}' for _ in range(objects))
+
+
+def adversarial_unclosed(objects=400):
+    # Valid name/price pairs whose object is never closed before the next "{".
+    return ''.join('{' + '"name":"Sofa","price":"$199",' * 15 for _ in range(objects))
+
+
+def _time(fn, repeat):
+    samples = []
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('scripts', nargs='*', help='saved <script> bodies')
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    cases = [(os.path.basename(p), open(p, encoding='utf-8', errors='replace').read()) for p in args.scripts]
+    rng = random.Random(5)
+    cases += [
+        ('state bundle (400 items)', _inline_state(rng, 400)),
+        ('adv: names, no price', adversarial_names_without_price()),
+        ('adv: price out of window', adversarial_far_price()),
+        ('adv: unclosed objects', adversarial_unclosed()),
+    ]
+
+    regex = app.INLINE_JSON_PRODUCT_REGEX
+    print(f"{'input':<28}{'KB':>8}{'regex ms':>11}{'scan ms':>10}{'speedup':>9}  identical")
+    for name, txt in cases:
+        r_ms, r_out = _time(lambda: [(m.group(1), m.group(2)) for m in regex.finditer(txt)], args.repeat)
+        s_ms, s_out = _time(lambda: list(app._scan_inline_products(txt)), args.repeat)
+        print(f"{name[:27]:<28}{len(txt) / 1024:>8.0f}{r_ms:>11.1f}{s_ms:>10.1f}{r_ms / max(s_ms, 1e-6):>8.1f}x  {r_out == s_out} ({len(s_out)} matches)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Decode/encode timings for the fast_json codec vs the stdlib json module.
+
+Usage:
+    python benchmarks/bench_json.py [--repeat N]
+
+Payloads mirror the backend's hot paths: a Constructor.io search response,
+an ld+json ItemList, R&F Pricing/Analytics field strings, and a 20-result
+/search-furniture response body.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json  # noqa: E402
+from synthetic_pages import product_name  # noqa: E402
+
+
+def constructor_payload(rng, n=60):
+    results = []
+    for i in range(n):
+        results.append({
+            "value": product_name(rng),
+            "data": {
+                "id": f"prod{i}", "title": product_name(rng), "url": f"/products/item-{i}/",
+                "image_url": f"https://assets.pbimgs.com/pbimgs/rk/images/dp/wcm/{i}/img{i}m.jpg",
+                "lowestPrice": round(rng.uniform(50, 3000), 2), "salePriceMin": round(rng.uniform(50, 3000), 2),
+                "variations": [{"sku": f"{i}-{v}", "color": rng.choice(["Oat", "Slate", "Ivory"])} for v in range(6)],
+                "Pricing": json.dumps({"price": round(rng.uniform(50, 3000), 2), "originalPrice": 0, "financePricing": {"amount": 42}}),
+                "Analytics": json.dumps({"name": product_name(rng), "price": str(rng.randint(50, 3000)), "brand": "House"}),
+                "facets": [{"name": f"f{k}", "values": [f"v{k}-{j}" for j in range(4)]} for k in range(8)],
+            },
+        })
+    return {"response": {"results": results, "total_num_results": 900, "facets": []}, "request": {"term": "sofa"}}
+
+
+def ldjson_payload(rng, n=48):
+    return {"@context": "https://schema.org", "@type": "ItemList", "itemListElement": [
+        {"@type": "ListItem", "position": i, "item": {"@type": "Product", "name": product_name(rng),
+                                                       "offers": {"price": str(rng.randint(50, 3000))}}} for i in range(n)]}
+
+
+def search_response(rng, n=20):
+    return {"success": True, "query": "sofa", "total": n, "sites_searched": ["Wayfair", "Pottery Barn"], "results": [
+        {"id": f"wayfair-{i}", "title": product_name(rng), "price": f"${rng.randint(50, 3000)}.00", "originalPrice": None,
+         "site": "Wayfair", "image": f"https://assets.wfcdn.com/im/{i}.jpg", "url": f"https://www.wayfair.com/p/{i}",
+         "category": "all", "style": "all", "inStock": True} for i in range(n)]}
+
+
+def _bench(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--repeat', type=int, default=200)
+    args = ap.parse_args()
+    rng = random.Random(3)
+    ctor = constructor_payload(rng)
+    pricing = [r["data"]["Pricing"] for r in ctor["response"]["results"]] + [r["data"]["Analytics"] for r in ctor["response"]["results"]]
+    cases = {
+        'constructor response': json.dumps(ctor).encode(),
+        'ld+json ItemList': json.dumps(ldjson_payload(rng)),
+    }
+    resp = search_response(rng)
+
+    print(f"fast_json backend: {fast_json.BACKEND}")
+    print(f"{'decode':<26}{'KB':>7}{'stdlib us':>12}{'fast us':>10}{'speedup':>9}")
+    for name, raw in cases.items():
+        std = _bench(lambda: json.loads(raw), args.repeat)
+        fast = _bench(lambda: fast_json.loads(raw), args.repeat)
+        print(f"{name:<26}{len(raw) / 1024:>7.1f}{std:>12.1f}{fast:>10.1f}{std / fast:>8.1f}x")
+    std = _bench(lambda: [json.loads(s) for s in pricing], args.repeat)
+    fast = _bench(lambda: [fast_json.loads(s) for s in pricing], args.repeat)
+    print(f"{'R&F Pricing/Analytics x' + str(len(pricing)):<26}{sum(map(len, pricing)) / 1024:>7.1f}{std:>12.1f}{fast:>10.1f}{std / fast:>8.1f}x")
+
+    print(f"\n{'encode':<26}{'KB':>7}{'stdlib us':>12}{'fast us':>10}{'speedup':>9}")
+    for name, obj in (('search response (20)', resp), ('constructor response', ctor)):
+        std = _bench(lambda: json.dumps(obj, sort_keys=True).encode(), args.repeat)
+        fast = _bench(lambda: fast_json.dumpb(obj, sort_keys=True), args.repeat)
+        print(f"{name:<26}{len(fast_json.dumpb(obj)) / 1024:>7.1f}{std:>12.1f}{fast:>10.1f}{std / fast:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
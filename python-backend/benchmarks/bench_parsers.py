@@ -0,0 +1,275 @@
+"""Time, allocations and output drift of every retailer extractor over a fixed corpus.
+
+Usage:
+    python benchmarks/bench_parsers.py [--only SUBSTRING] [--repeat N] [--update-golden]
+                                       [--regenerate] [--out report.json] [--baseline old_report.json]
+
+The corpus is benchmarks/corpus/manifest.json plus its documents. Each
+document lists the extraction cases to run on it:
+
+  wayfair.parse_listing_page           what get_products() does with each fetched page
+                                       (:fast = the lxml + strainer path)
+  wayfair._find_thumbnail              every title on the page (selected untimed), with an ImageIndex
+                                       (:noindex = the tree-walking fallback)
+  app._json_products_from_ldjson       ld+json Product / ItemList / @graph blocks
+  app._json_products_from_inline       the inline-script name/price scanner
+  app.scrape_wayfair / scrape_ikea /   the SiteSpec card loop (_extract_with_spec) behind
+  app.scrape_westelm                   each scrape_* function, JSON and alt-text fallbacks included
+  pottery_barn.extract_product_info    Constructor search payloads
+  west_elm.extract_results             Constructor autocomplete payloads
+  raymour_flanigan._derive_price       every product's data object in a payload
+
+HTML is parsed and JSON decoded once, outside the timed region, except
+for parse_listing_page, which includes its own parse. For each case and
+document the runner reports:
+  - the median and minimum of --repeat timed runs
+  - the tracemalloc peak during one run, and the memory still held
+    afterwards (mostly the output). tracemalloc does not see lxml's C
+    allocations.
+
+Each output is compared with benchmarks/corpus/golden/<case>/<document>.json.
+A :variant case must match its base case's golden file. Any difference
+is printed and makes the exit status 1. After an intended change to an
+extractor, rerun with --update-golden and review the golden diff in the
+commit.
+
+Every document shipped in the corpus is synthetic. Each one is written
+by the synthetic_pages.py generator named in the manifest, and
+--regenerate rewrites them. Pages saved from the live sites can be added
+to the manifest with "source": "saved".
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py imports rembg at module load; the extractors do not need it.
+if 'rembg' not in sys.modules:
+    try:
+        import rembg  # noqa: F401
+    except Exception:
+        sys.modules['rembg'] = types.SimpleNamespace(remove=None, new_session=None)
+
+import bs4  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+import app  # noqa: E402
+import pottery_barn  # noqa: E402
+import raymour_flanigan  # noqa: E402
+import synthetic_pages  # noqa: E402
+import wayfair  # noqa: E402
+import west_elm  # noqa: E402
+from product_record import Product  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+GOLDEN_DIR = os.path.join(CORPUS_DIR, 'golden')
+
+
+def _soup(text):
+    return BeautifulSoup(text, 'html.parser')
+
+
+def _titled_soup(text):
+    soup = _soup(text)
+    return soup, soup.select(wayfair.TITLE_SELECTOR)
+
+
+def _thumbnails(prepared, indexed=True):
+    # Titles are selected in prepare(): the select costs more than the lookups being compared
+    soup, titles = prepared
+    index = wayfair.ImageIndex(soup) if indexed else None
+    return [wayfair._find_thumbnail(title, index) for title in titles]
+
+
+def _card_loop(spec):
+    def run(soup, query):
+        debug_meta = {}
+        # The real origin, not search_url: that one follows <SITE>_BASE_URL overrides
+        results = app._extract_with_spec(spec, soup, query, spec.origin + '/', None, None, 'all', 'all', debug_meta)
+        return {'results': results, 'debug': debug_meta}
+    return run
+
+
+def _constructor_items(data):
+    items = (data.get('sections') or {}).get('Products') or (data.get('response') or {}).get('results') or []
+    return [item.get('data') or {} for item in items]
+
+
+# case -> (prepare(document text), run(prepared, query)); only run() is timed
+CASES = {
+    'wayfair.parse_listing_page': (str, lambda html, q: wayfair.parse_listing_page(html, fast=False)),
+    'wayfair.parse_listing_page:fast': (str, lambda html, q: wayfair.parse_listing_page(html, fast=True)),
+    'wayfair._find_thumbnail': (_titled_soup, lambda prepared, q: _thumbnails(prepared)),
+    'wayfair._find_thumbnail:noindex': (_titled_soup, lambda prepared, q: _thumbnails(prepared, indexed=False)),
+    'app._json_products_from_ldjson': (_soup, lambda soup, q: app._json_products_from_ldjson(soup)),
+    'app._json_products_from_inline': (_soup, lambda soup, q: app._json_products_from_inline(soup)),
+    'app.scrape_wayfair': (_soup, _card_loop(app.WAYFAIR_SPEC)),
+    'app.scrape_ikea': (_soup, _card_loop(app.IKEA_SPEC)),
+    'app.scrape_westelm': (_soup, _card_loop(app.WESTELM_SPEC)),
+    'pottery_barn.extract_product_info': (json.loads, lambda data, q: pottery_barn.extract_product_info(data)),
+    'west_elm.extract_results': (json.loads, lambda data, q: west_elm.extract_results(data, q)),
+    'raymour_flanigan._derive_price': (lambda text: _constructor_items(json.loads(text)),
+                                       lambda items, q: [raymour_flanigan._derive_price(d) for d in items]),
+}
+
+
+def _plain(value):
+    """Outputs as JSON-comparable data; Product records by their fields."""
+    if isinstance(value, Product):
+        return {f: _plain(getattr(value, f)) for f in Product.__slots__ if getattr(value, f) is not None}
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _golden_path(case, doc):
+    return os.path.join(GOLDEN_DIR, case.split(':')[0], os.path.splitext(doc)[0] + '.json')
+
+
+def _first_difference(expected, actual):
+    if isinstance(expected, dict):
+        for key in sorted(set(expected) | set(actual if isinstance(actual, dict) else {})):
+            if not isinstance(actual, dict) or expected.get(key) != actual.get(key):
+                return _first_difference(expected.get(key), actual.get(key) if isinstance(actual, dict) else None)
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return f"{len(expected)} items expected, got {len(actual)}"
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if e != a:
+                return f"item {i}: expected {json.dumps(e, sort_keys=True)[:160]}, got {json.dumps(a, sort_keys=True)[:160]}"
+    return f"expected {json.dumps(expected, sort_keys=True)[:160]}, got {json.dumps(actual, sort_keys=True)[:160]}"
+
+
+def measure(case, text, query, repeat):
+    prepare, run = CASES[case]
+    prepared = prepare(text)
+    out = run(prepared, query)  # warm-up, and the output checked against the golden file
+    samples = []
+    gc.collect()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run(prepared, query)
+        samples.append((time.perf_counter() - t0) * 1000)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = run(prepared, query)
+        peak = tracemalloc.get_traced_memory()[1]
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return out, {
+        'median_ms': round(statistics.median(samples), 3),
+        'min_ms': round(min(samples), 3),
+        'peak_kb': round((peak - before) / 1024, 1),
+        'retained_kb': round((current - before) / 1024, 1),
+    }
+
+
+def regenerate(manifest):
+    for doc in manifest['documents']:
+        if doc.get('source') != 'synthetic':
+            continue
+        content = getattr(synthetic_pages, doc['generator'])(**doc.get('args', {}))
+        if not isinstance(content, str):
+            content = json.dumps(content, indent=1, ensure_ascii=False)
+        with open(os.path.join(CORPUS_DIR, doc['file']), 'w', encoding='utf-8') as f:
+            f.write(content + '\n')
+        print(f"wrote {doc['file']} ({len(content) / 1024:.0f} KB)")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CORPUS_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--only', help='run cases or documents whose name contains this')
+    ap.add_argument('--repeat', type=int, default=20)
+    ap.add_argument('--update-golden', action='store_true', help='rewrite the golden files from current output')
+    ap.add_argument('--regenerate', action='store_true', help='rewrite the synthetic documents, then run')
+    ap.add_argument('--out', help='write the JSON report here')
+    ap.add_argument('--baseline', help='earlier JSON report to compare median times against')
+    args = ap.parse_args()
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    with open(os.path.join(CORPUS_DIR, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if args.regenerate:
+        regenerate(manifest)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r['case'], r['document']): r for r in json.load(f).get('results', [])}
+
+    rows, drift = [], 0
+    print(f"{'case':<36}{'document':<34}{'KB':>6}{'med ms':>9}{'min ms':>9}{'peak KB':>9}{'kept KB':>9}  golden")
+    for doc in manifest['documents']:
+        with open(os.path.join(CORPUS_DIR, doc['file']), encoding='utf-8') as f:
+            text = f.read()
+        for case in doc['cases']:
+            if args.only and args.only not in case and args.only not in doc['file']:
+                continue
+            out, stats = measure(case, text, doc.get('query', ''), args.repeat)
+            out = _plain(out)
+            path = _golden_path(case, doc['file'])
+            base_case = ':' not in case
+            if args.update_golden and base_case:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(out, f, indent=1, sort_keys=True, ensure_ascii=False)
+                    f.write('\n')
+                status = 'written'
+            elif not os.path.exists(path):
+                status = 'missing'
+            else:
+                with open(path, encoding='utf-8') as f:
+                    expected = json.load(f)
+                status = 'ok' if expected == out else 'DRIFT'
+                if status == 'DRIFT':
+                    drift += 1
+            row = {'case': case, 'document': doc['file'], 'source': doc.get('source'), 'kb': round(len(text) / 1024, 1),
+                   **stats, 'golden': status}
+            rows.append(row)
+            prev = baseline.get((case, doc['file']))
+            delta = f"  {(stats['median_ms'] - prev['median_ms']) / prev['median_ms']:+.0%} vs baseline" \
+                if prev and prev.get('median_ms') else ''
+            print(f"{case:<36}{doc['file'][:33]:<34}{row['kb']:>6.0f}{stats['median_ms']:>9.2f}{stats['min_ms']:>9.2f}"
+                  f"{stats['peak_kb']:>9.0f}{stats['retained_kb']:>9.0f}  {status}{delta}")
+            if status == 'DRIFT':
+                print(f"    {_first_difference(expected, out)}")
+
+    if args.out:
+        report = {
+            'meta': {'git_commit': _git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                     'bs4': bs4.__version__, 'wayfair_fast_parser': wayfair.FAST_PARSER, 'repeat': args.repeat},
+            'results': rows,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.out}")
+    if drift:
+        print(f"{drift} case(s) no longer match their golden output")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Per-request cost of the relevance ranking stage (ranking.rank).
+
+Usage:
+    python benchmarks/bench_ranking.py [--candidates N] [--repeat N]
+
+Builds a module-path-sized candidate set (four retailers' worth of Product
+records with synthetic titles) and times rank() with a cold and a warm
+token cache, next to the random.shuffle + slice it replaced.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ranking  # noqa: E402
+from product_record import Product  # noqa: E402
+from synthetic_pages import product_name  # noqa: E402
+
+SITES = ['Wayfair', 'Pottery Barn', 'West Elm', 'Raymour & Flanigan']
+QUERIES = ['sofa', 'walnut coffee table', 'modern velvet accent chair', 'rug']
+
+
+def candidates(rng, n):
+    return [Product(f'c-{i}', product_name(rng), round(rng.uniform(50, 3000), 2), None, SITES[i % len(SITES)],
+                    '', f'https://example.com/p/{i}', 'all', 'all') for i in range(n)]
+
+
+def _bench(fn, repeat, before=None):
+    samples = []
+    for _ in range(repeat):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--candidates', type=int, default=80)
+    ap.add_argument('--repeat', type=int, default=300)
+    args = ap.parse_args()
+    recs = candidates(random.Random(5), args.candidates)
+
+    print(f"{args.candidates} candidates, top 20")
+    print(f"{'query':<30}{'shuffle us':>11}{'cold us':>10}{'warm us':>10}{'stable':>8}")
+    for q in QUERIES:
+        shuffled = list(recs)
+        base = _bench(lambda: (random.shuffle(shuffled), shuffled[:20]), args.repeat)
+        cold = _bench(lambda: ranking.rank(recs, q), args.repeat, before=ranking.tokenize.cache_clear)
+        warm = _bench(lambda: ranking.rank(recs, q), args.repeat)
+        stable = all([r.id for r in ranking.rank(list(recs), q)] == [r.id for r in ranking.rank(recs, q)] for _ in range(5))
+        print(f"{q:<30}{base:>11.1f}{cold:>10.1f}{warm:>10.1f}{str(stable):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Throughput of the Flask dev server vs gunicorn (gunicorn.conf.py + wsgi.py).
+
+Usage:
+    python benchmarks/bench_server.py [--server dev|gunicorn|both] [--endpoint health|remove-background]
+                                      [--concurrency N] [--duration S] [--workers N] [--threads N]
+
+Each server is started on a free local port and given time to load its
+models. Then `concurrency` client threads call the endpoint back to back
+for `duration` seconds. "health" measures the server's own request
+overhead. "remove-background" sends a 256x256 PNG through rembg, which
+is the CPU-bound path where extra worker processes matter. The numbers
+depend on the machine's cores and the model, so record them with the
+hardware they came from.
+"""
+import argparse
+import base64
+import io
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _png_payload(size: int = 256) -> dict:
+    img = Image.new('RGB', (size, size), (235, 235, 230))
+    img.paste((90, 60, 40), (size // 4, size // 4, size * 3 // 4, size * 3 // 4))
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return {'image': 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode()}
+
+
+def _start(server: str, port: int, workers: int, threads: int, extra_env=None) -> subprocess.Popen:
+    env = {**os.environ, 'HOST': '127.0.0.1', 'PORT': str(port), 'WEB_CONCURRENCY': str(workers),
+           'WEB_THREADS': str(threads), 'PRODUCT_INDEX': os.getenv('PRODUCT_INDEX', '0'),
+           'CONSTRUCTOR_KEY_REFRESH_INTERVAL': '0', **(extra_env or {})}
+    if server == 'dev':
+        cmd = [sys.executable, 'app.py']
+    else:
+        env.setdefault('WEB_ACCESS_LOG', '')
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait_ready(base: str, proc: subprocess.Popen, timeout: float = 180) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            if requests.get(f'{base}/health', timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def _load(base: str, endpoint: str, concurrency: int, duration: float):
+    payload = _png_payload() if endpoint == 'remove-background' else None
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+
+    def client():
+        http = requests.Session()
+        mine, failed = [], 0
+        while time.monotonic() < end:
+            t0 = time.perf_counter()
+            try:
+                if payload is None:
+                    ok = http.get(f'{base}/health', timeout=60).ok
+                else:
+                    ok = http.post(f'{base}/remove-background', json=payload, timeout=120).ok
+            except requests.RequestException:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - t0)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, errors[0], time.monotonic() - started
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--server', choices=('dev', 'gunicorn', 'both'), default='both')
+    ap.add_argument('--endpoint', choices=('health', 'remove-background'), default='health')
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--duration', type=float, default=15)
+    ap.add_argument('--workers', type=int, default=max(2, min(4, os.cpu_count() or 1)))
+    ap.add_argument('--threads', type=int, default=4)
+    args = ap.parse_args()
+
+    print(f"{args.endpoint}, {args.concurrency} clients x {args.duration:.0f}s, {os.cpu_count()} CPUs")
+    print(f"{'server':<22}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for server in (('dev', 'gunicorn') if args.server == 'both' else (args.server,)):
+        label = 'dev (threaded)' if server == 'dev' else f'gunicorn {args.workers}w x {args.threads}t'
+        if server == 'gunicorn':
+            try:
+                import gunicorn  # noqa: F401
+            except ImportError:
+                print(f"{label:<22}  skipped: gunicorn is not installed")
+                continue
+        port = _free_port()
+        proc = _start(server, port, args.workers, args.threads)
+        try:
+            base = f'http://127.0.0.1:{port}'
+            if not _wait_ready(base, proc):
+                print(f"{label:<22}  failed to start")
+                continue
+            _load(base, args.endpoint, args.concurrency, min(2.0, args.duration))  # warm-up
+            latencies, errors, elapsed = _load(base, args.endpoint, args.concurrency, args.duration)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if not latencies:
+            print(f"{label:<22}{0:>9}{'-':>9}{'-':>9}{errors:>8}")
+            continue
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{label:<22}{len(latencies) / elapsed:>9.1f}{statistics.median(latencies) * 1e3:>9.1f}"
+              f"{p99 * 1e3:>9.1f}{errors:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Perceptual hashing and Hamming-radius lookup costs for visual_index.
+
+Usage:
+    python benchmarks/bench_visual_index.py [--images N] [--queries N]
+
+Hashes are random 64-bit values, plus a few near copies of each query, so
+every radius has real matches. MIH lookups are compared with a linear scan
+over the same hashes, and the results are checked for equality.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import visual_index  # noqa: E402
+
+
+def _flip(h, rng, bits):
+    for b in rng.sample(range(64), bits):
+        h ^= 1 << b
+    return h
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--images', type=int, default=10000)
+    ap.add_argument('--queries', type=int, default=200)
+    args = ap.parse_args()
+    rng = random.Random(11)
+
+    img = Image.fromarray((np.random.RandomState(0).rand(600, 600, 3) * 255).astype('uint8'))
+    samples = []
+    for _ in range(50):
+        t0 = time.perf_counter()
+        visual_index.phash(img)
+        visual_index.dhash(img)
+        samples.append((time.perf_counter() - t0) * 1e3)
+    print(f"pHash + dHash of a 600x600 image: {statistics.median(samples):.2f} ms")
+
+    idx = visual_index.VisualIndex()
+    idx._loaded = True  # in-memory only, don't touch the product index database
+    hashes = {}
+    queries = [rng.getrandbits(64) for _ in range(args.queries)]
+    for i in range(args.images):
+        q = queries[i % len(queries)]
+        h = _flip(q, rng, rng.randint(0, 16)) if i < len(queries) * 5 else rng.getrandbits(64)
+        hashes[f'img{i}'] = h
+        idx._insert(f'img{i}', h, 0)
+
+    print(f"\n{len(hashes)} hashes, {len(queries)} queries")
+    print(f"{'radius':>7}{'scan ms':>10}{'MIH ms':>9}{'speedup':>9}{'avg hits':>10}{'same':>6}")
+    for radius in (4, 8, 10, 12, 15):
+        t0 = time.perf_counter()
+        scan = [{k for k, h in hashes.items() if visual_index.hamming(q, h) <= radius} for q in queries]
+        scan_ms = (time.perf_counter() - t0) * 1e3 / len(queries)
+        t0 = time.perf_counter()
+        mih = [{k for k, _ in idx.search(q, radius=radius, limit=len(hashes))} for q in queries]
+        mih_ms = (time.perf_counter() - t0) * 1e3 / len(queries)
+        hits = sum(map(len, mih)) / len(queries)
+        print(f"{radius:>7}{scan_ms:>10.3f}{mih_ms:>9.3f}{scan_ms / mih_ms:>8.1f}x{hits:>10.1f}{str(scan == mih):>6}")
+
+
+if __name__ == '__main__':
+    main()
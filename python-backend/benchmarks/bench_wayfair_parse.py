@@ -0,0 +1,54 @@
+"""Compare wayfair.parse_listing_page full (html.parser) vs fast (lxml + strainer).
+
+Usage:
+    python benchmarks/bench_wayfair_parse.py [saved_page.html ...] [--repeat N]
+
+With no pages a synthetic keyword page is used. For each page the script
+prints the median parse+extract time of both paths and whether their
+outputs are identical.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wayfair  # noqa: E402
+from synthetic_pages import wayfair_listing_page  # noqa: E402
+
+
+def _time(fn, repeat):
+    samples = []
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('pages', nargs='*', help='saved Wayfair keyword.php HTML files')
+    ap.add_argument('--repeat', type=int, default=10)
+    args = ap.parse_args()
+
+    docs = []
+    for path in args.pages:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            docs.append((os.path.basename(path), f.read()))
+    if not docs:
+        docs.append(('synthetic-48-cards', wayfair_listing_page()))
+
+    print(f"fast parser: {wayfair.FAST_PARSER}")
+    print(f"{'page':<32}{'KB':>8}{'full ms':>10}{'fast ms':>10}{'speedup':>9}  identical")
+    for name, html in docs:
+        full_ms, full = _time(lambda: wayfair.parse_listing_page(html, fast=False), args.repeat)
+        fast_ms, fast = _time(lambda: wayfair.parse_listing_page(html, fast=True), args.repeat)
+        print(f"{name[:31]:<32}{len(html) / 1024:>8.0f}{full_ms:>10.1f}{fast_ms:>10.1f}{full_ms / fast_ms:>8.1f}x  {full == fast} ({len(full)} rows)")
+
+
+if __name__ == '__main__':
+    main()
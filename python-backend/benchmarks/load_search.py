@@ -0,0 +1,291 @@
+"""Load test for POST /search-furniture against replayed retailer upstreams.
+
+Usage:
+    python benchmarks/load_search.py [--levels 1,2,4,8,16] [--duration 20] [--server dev|gunicorn]
+                                     [--workers N] [--threads N] [--queries "sofa,rug,..."]
+                                     [--fixtures DIR] [--latency SPEC] [--errors SPEC] [--seed N]
+                                     [--out report.json] [--baseline old_report.json]
+
+One command starts everything it needs:
+  1. A replay.py stand-in for Wayfair and the three Constructor.io sites, on
+     a free port. By default it serves synthetic fixtures generated for each
+     query into a temp directory: a 48-card Wayfair page and 20 priced
+     Constructor results per site. --fixtures serves responses recorded
+     with `replay.py --record` instead.
+  2. The backend (dev server or gunicorn), routed to the stand-in through
+     the base-URL overrides. It gets its own product index and metrics
+     directory.
+  3. For each concurrency level, that many clients POST searches back to
+     back for --duration seconds, cycling through the queries.
+
+Per level the report gives:
+  - throughput, and p50/p95/p99 latency
+  - the error rate: non-200, success=false or transport errors
+  - the share of answers served from fallback data
+  - replay hits and misses
+  - the mean time each retailer and pipeline stage took per request,
+    read from the backend's Server-Timing header. A stage's share is that
+    time divided by the mean total.
+
+Upstream latency is injected by the stand-in. The default is
+DEFAULT_LATENCY: a few hundred ms for Wayfair HTML and ~100 ms for the
+Constructor APIs. Every report records this assumption with the run
+settings, the git commit and the host, so reports compare like for like.
+--baseline prints the change against an earlier report.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote_plus, urlencode
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import replay  # noqa: E402
+from bench_server import BACKEND_DIR, _free_port, _start, _wait_ready  # noqa: E402
+from synthetic_pages import (constructor_autocomplete_payload, constructor_search_payload,  # noqa: E402
+                             wayfair_listing_page)
+
+DEFAULT_QUERIES = ['black leather sofa', 'oak coffee table', 'wool area rug', 'velvet accent chair',
+                   'floor lamp', 'walnut sideboard']
+DEFAULT_LATENCY = 'wayfair=350:150,*=100:40'
+
+
+def build_synthetic_fixtures(store: replay.FixtureStore, queries):
+    """Fixtures for exactly the requests the search module path makes per query."""
+    for n, q in enumerate(queries):
+        seed = 100 + n
+        store.put('wayfair', 'GET', '/keyword.php', urlencode({'keyword': q, 'curpage': 1}), 200,
+                  'text/html; charset=utf-8', wayfair_listing_page(cards=48, seed=seed).encode())
+        store.put('pottery_barn_api', 'GET', f'/search/{quote_plus(q)}',
+                  urlencode({'offset': 0, 'num_results_per_page': 20}), 200, 'application/json',
+                  json.dumps(constructor_search_payload(q, 20, seed)).encode())
+        autocomplete = urlencode({'num_results_Products': 20, 'num_results_Search Suggestions': 0})
+        for prefix, host in (('west_elm_api', 'assets.weimgs.com'), ('raymour_flanigan_api', 'images.raymourflanigan.com')):
+            store.put(prefix, 'GET', f'/autocomplete/{quote_plus(q)}', autocomplete, 200, 'application/json',
+                      json.dumps(constructor_autocomplete_payload(q, 20, seed, host)).encode())
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def _server_timing(header):
+    out = {}
+    for part in (header or '').split(','):
+        name, _, rest = part.strip().partition(';dur=')
+        try:
+            out[name] = float(rest)
+        except ValueError:
+            continue
+    return out
+
+
+def run_level(base, queries, concurrency, duration):
+    lock = threading.Lock()
+    latencies, stages, errors = [], {}, {}
+    counts = {'requests': 0, 'fallback': 0}
+    end = time.monotonic() + duration
+
+    def client(offset):
+        http = requests.Session()
+        i = offset
+        while time.monotonic() < end:
+            q = queries[i % len(queries)]
+            i += 1
+            t0 = time.perf_counter()
+            kind, timing, fallback = None, {}, False
+            try:
+                resp = http.post(f'{base}/search-furniture', json={'query': q}, timeout=60)
+                elapsed = time.perf_counter() - t0
+                body = resp.json() if resp.status_code == 200 else None
+                if resp.status_code != 200:
+                    kind = f'http_{resp.status_code}'
+                elif not body.get('success'):
+                    kind = 'unsuccessful'
+                else:
+                    fallback = body.get('sites_searched') == ['Fallback Data']
+                timing = _server_timing(resp.headers.get('Server-Timing'))
+            except (requests.RequestException, ValueError) as e:
+                elapsed = time.perf_counter() - t0
+                kind = type(e).__name__
+            with lock:
+                counts['requests'] += 1
+                counts['fallback'] += fallback
+                if kind:
+                    errors[kind] = errors.get(kind, 0) + 1
+                else:
+                    latencies.append(elapsed)
+                for name, ms in timing.items():
+                    stages.setdefault(name, []).append(ms)
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    n = counts['requests']
+    total_ms = statistics.fmean(stages['total']) if stages.get('total') else None
+    stage_ms = {name: round(statistics.fmean(v), 2) for name, v in sorted(stages.items()) if name != 'total'}
+    return {
+        'concurrency': concurrency,
+        'requests': n,
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'latency_ms': {
+            'p50': round(_percentile(ms, 0.50), 1) if ms else None,
+            'p95': round(_percentile(ms, 0.95), 1) if ms else None,
+            'p99': round(_percentile(ms, 0.99), 1) if ms else None,
+            'mean': round(statistics.fmean(ms), 1) if ms else None,
+            'max': round(ms[-1], 1) if ms else None,
+        },
+        'error_rate': round(sum(errors.values()) / n, 4) if n else None,
+        'errors': errors,
+        'fallback_rate': round(counts['fallback'] / n, 4) if n else None,
+        'server_total_ms': round(total_ms, 2) if total_ms else None,
+        'retailer_ms': {name[len('retailer-'):]: {'mean': v, 'share': round(v / total_ms, 3) if total_ms else None}
+                        for name, v in stage_ms.items() if name.startswith('retailer-')},
+        'stage_ms': stage_ms,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _print_level(r):
+    lat = r['latency_ms']
+    retailers = ', '.join(f"{k} {v['mean']:.0f}ms ({v['share']:.0%})" for k, v in r['retailer_ms'].items() if v['share'] is not None)
+    print(f"{r['concurrency']:>5}{r['throughput_rps']:>9.2f}{lat['p50'] or 0:>9.0f}{lat['p95'] or 0:>9.0f}"
+          f"{lat['p99'] or 0:>9.0f}{r['error_rate'] or 0:>8.1%}  {retailers}")
+
+
+def _print_baseline(report, baseline):
+    old = {lvl['concurrency']: lvl for lvl in baseline.get('levels', [])}
+    print(f"\nvs baseline {baseline.get('meta', {}).get('git_commit')} ({baseline.get('meta', {}).get('started_at')})")
+    print(f"{'conc':>5}{'rps':>12}{'p50':>12}{'p99':>12}{'errors':>10}")
+    for lvl in report['levels']:
+        prev = old.get(lvl['concurrency'])
+        if prev is None:
+            continue
+
+        def delta(new, before):
+            if not new or not before:
+                return '-'
+            return f"{(new - before) / before:+.1%}"
+        print(f"{lvl['concurrency']:>5}{delta(lvl['throughput_rps'], prev['throughput_rps']):>12}"
+              f"{delta(lvl['latency_ms']['p50'], prev['latency_ms']['p50']):>12}"
+              f"{delta(lvl['latency_ms']['p99'], prev['latency_ms']['p99']):>12}"
+              f"{(lvl['error_rate'] or 0) - (prev['error_rate'] or 0):>+10.1%}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--levels', default='1,2,4,8,16', help='comma-separated client counts')
+    ap.add_argument('--duration', type=float, default=20, help='seconds per level')
+    ap.add_argument('--warmup', type=float, default=3)
+    ap.add_argument('--server', choices=('dev', 'gunicorn'), default='dev')
+    ap.add_argument('--workers', type=int, default=max(2, min(4, os.cpu_count() or 1)))
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--queries', help='comma-separated queries (default: a fixed mix of six)')
+    ap.add_argument('--fixtures', help='recorded fixture directory (default: synthetic fixtures)')
+    ap.add_argument('--latency', default=DEFAULT_LATENCY, help='replay.py latency spec')
+    ap.add_argument('--errors', default='', help='replay.py error spec, e.g. "wayfair=0.05:503"')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help='write the JSON report here')
+    ap.add_argument('--baseline', help='earlier JSON report to compare against')
+    args = ap.parse_args()
+
+    levels = [int(x) for x in args.levels.split(',') if x.strip()]
+    queries = [q.strip() for q in (args.queries.split(',') if args.queries else DEFAULT_QUERIES) if q.strip()]
+    workdir = tempfile.mkdtemp(prefix='load-search-')
+    if args.fixtures:
+        store = replay.FixtureStore(args.fixtures)
+    else:
+        store = replay.FixtureStore(os.path.join(workdir, 'fixtures'))
+        build_synthetic_fixtures(store, queries)
+
+    stand_in = replay.ReplayServer(store, latency=replay._parse_rules([args.latency], replay._parse_latency),
+                                   errors=replay._parse_rules([args.errors], replay._parse_error), seed=args.seed)
+    stand_in.start()
+    env = {**stand_in.env(),
+           'PRODUCT_INDEX': '1',
+           'PRODUCT_INDEX_PATH': os.path.join(workdir, 'product_index.db'),
+           'METRICS_DIR': os.path.join(workdir, 'metrics'),
+           'REMBG_PRELOAD_MODELS': '',
+           'SERPAPI_KEY': ''}
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    proc = _start(args.server, port, args.workers, args.threads, env)
+    report = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': _git_commit(),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'server': args.server,
+            'workers': args.workers if args.server == 'gunicorn' else 1,
+            'threads': args.threads if args.server == 'gunicorn' else None,
+            'duration_s': args.duration,
+            'queries': queries,
+            'fixtures': args.fixtures or 'synthetic',
+            'upstream_latency': args.latency,
+            'upstream_errors': args.errors or None,
+        },
+        'levels': [],
+    }
+    try:
+        if not _wait_ready(base, proc):
+            sys.exit('backend failed to start')
+        run_level(base, queries, max(levels), args.warmup)
+        print(f"{args.server} server, {args.duration:.0f}s per level, upstream latency {args.latency}")
+        print(f"{'conc':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}  per-retailer mean (share of total)")
+        for level in levels:
+            stand_in.reset_stats()
+            result = run_level(base, queries, level, args.duration)
+            result['replay'] = stand_in.stats
+            report['levels'].append(result)
+            _print_level(result)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        stand_in.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    misses = sum(s.get('misses', 0) for lvl in report['levels'] for s in lvl['replay'].values())
+    if misses:
+        print(f"warning: {misses} upstream requests had no fixture (see 'replay' in the report)")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            _print_baseline(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
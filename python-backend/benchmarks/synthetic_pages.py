@@ -0,0 +1,309 @@
+"""Synthetic retailer pages for benchmarks when no saved pages are given.
+
+The markup mirrors the structure the scrapers look for (Wayfair ListingCards,
+PriceDisplay spans, ld+json blocks) wrapped in a realistic amount of page
+chrome, inline script and navigation so parse costs are representative.
+The Constructor.io payloads follow the search and autocomplete response
+shapes. None of this is captured from the live sites; the generators also
+write the parser corpus in benchmarks/corpus/ (see bench_parsers.py).
+"""
+import json
+import random
+
+ADJECTIVES = ['Modern', 'Rustic', 'Mid-Century', 'Velvet', 'Leather', 'Oak', 'Linen', 'Boucle', 'Walnut', 'Rattan']
+NOUNS = ['Sofa', 'Accent Chair', 'Coffee Table', 'Floor Lamp', 'Bookshelf', 'Sideboard', 'Ottoman', 'Area Rug']
+
+
+def product_name(rng: random.Random) -> str:
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(100, 999)}"
+
+
+def _chrome(rng: random.Random, blocks: int) -> str:
+    parts = []
+    for b in range(blocks):
+        links = ''.join(f'<li class="Nav-item"><a href="/cat/{b}-{i}" class="Nav-link">Category {b}-{i}</a></li>' for i in range(20))
+        parts.append(f'<nav class="MegaMenu-{b}"><ul>{links}</ul></nav>')
+        parts.append(f'<div class="Promo"><p>Free shipping on orders over ${rng.randint(35, 99)}</p><img src="/promo/{b}.png" alt="promo banner {b}"></div>')
+    return ''.join(parts)
+
+
+def _inline_state(rng: random.Random, n: int) -> str:
+    items = [{"sku": f"W{rng.randint(100000, 999999)}", "name": product_name(rng),
+              "price": round(rng.uniform(50, 2500), 2), "rating": round(rng.uniform(1, 5), 1)} for _ in range(n)]
+    return 'window.__INITIAL_STATE__ = ' + json.dumps({"catalog": {"items": items}, "flags": {"a": True}}) + ';'
+
+
+def wayfair_listing_page(cards: int = 48, seed: int = 7, chrome_blocks: int = 30) -> str:
+    """A Wayfair keyword.php results page with `cards` ListingCards."""
+    rng = random.Random(seed)
+    card_html = []
+    ld_items = []
+    for i in range(cards):
+        name = product_name(rng)
+        price = f"${rng.randint(49, 2999):,}.{rng.randint(0, 99):02d}"
+        href = f"/furniture/pdp/item-{i}-w{100000 + i}.html"
+        img = f"https://assets.wfcdn.com/im/{rng.randint(10**7, 10**8)}/resize-h400-w400/{i}.jpg"
+        srcset = ', '.join(f"https://assets.wfcdn.com/im/{i}/resize-h{w}-w{w}/{i}.jpg {w}w" for w in (200, 300, 400, 600, 800))
+        card_html.append(
+            f'<div data-test-id="ListingCard" class="ListingCard-wrapper _1abc{i}">'
+            f'<a href="{href}" data-test-id="ListingCard-ListingCardImageCarousel">'
+            f'<div class="ImageCarousel"><img data-test-id="ListingCardImageCarousel-LeadImage" src="{img}" srcset="{srcset}" alt="{name}"></div>'
+            f'<div class="CardBody"><h2 data-test-id="ListingCard-ListingCardName-Text" class="Title">{name}</h2>'
+            f'<div class="Rating"><span class="Stars">{rng.randint(1, 5)} stars</span><span>({rng.randint(1, 900)})</span></div>'
+            f'<div class="PriceBlock"><span data-test-id="PriceDisplay" class="Price">{price}</span></div>'
+            f'<p class="Shipping">Free Shipping</p></div></a></div>'
+        )
+        ld_items.append({"@type": "ListItem", "position": i + 1,
+                         "item": {"@type": "Product", "name": name, "url": "https://www.wayfair.com" + href,
+                                  "image": [img], "offers": {"@type": "Offer", "price": price.strip('$').replace(',', '')}}})
+    ld = json.dumps({"@context": "https://schema.org", "@type": "ItemList", "itemListElement": ld_items})
+    return (
+        '<!DOCTYPE html><html><head><title>Search results</title>'
+        f'<script>{_inline_state(rng, 40)}</script>'
+        f'<script type="application/ld+json">{ld}</script>'
+        '<link rel="stylesheet" href="/static/app.css"></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header>'
+        f'<main><section class="BrowseGrid">{"".join(card_html)}</section></main>'
+        f'<footer>{_chrome(rng, chrome_blocks // 2)}</footer>'
+        f'<script>{_inline_state(rng, 120)}</script>'
+        '</body></html>'
+    )
+
+
+def _constructor_products(query: str, n: int, seed: int, image_host: str, url_prefix: str) -> list:
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        name = f"{product_name(rng)} {query.title()}"
+        items.append({
+            "value": name,
+            "data": {
+                "id": f"{seed}-{i}",
+                "title": name,
+                "url": f"{url_prefix}/item-{seed}-{i}/",
+                "image_url": f"https://{image_host}/images/{seed}/{i}.jpg",
+                "lowestPrice": round(rng.uniform(49, 2999), 2),
+                "variations": [{"sku": f"{i}-{v}", "color": rng.choice(["Oat", "Slate", "Ivory"])} for v in range(4)],
+            },
+        })
+    return items
+
+
+def constructor_search_payload(query: str, n: int = 20, seed: int = 7) -> dict:
+    """A Constructor.io /search response (Pottery Barn, R&F search) with `n` priced results."""
+    results = _constructor_products(query, n, seed, "assets.pbimgs.com", "/products")
+    return {"response": {"results": results, "total_num_results": n * 10, "facets": []},
+            "request": {"term": query}}
+
+
+def constructor_autocomplete_payload(query: str, n: int = 20, seed: int = 7, image_host: str = "assets.weimgs.com") -> dict:
+    """A Constructor.io /autocomplete response (West Elm, R&F) with `n` priced products."""
+    return {"sections": {"Products": _constructor_products(query, n, seed, image_host, "/products"),
+                         "Search Suggestions": []},
+            "request": {"term": query}}
+
+
+def _price_text(rng: random.Random) -> str:
+    return f"${rng.randint(49, 2999):,}.{rng.randint(0, 99):02d}"
+
+
+def wayfair_loose_listing_page(cards: int = 36, seed: int = 11, chrome_blocks: int = 20) -> str:
+    """A keyword.php page whose titles sit outside their card links.
+
+    Thumbnails are found through sibling containers for even cards and only
+    through <img alt> matching for odd ones, the two slow paths of
+    wayfair._find_thumbnail. Every fifth card has no price, so price rows
+    shift against title rows as they do on sponsored blocks.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(cards):
+        name = product_name(rng)
+        img = f"https://assets.wfcdn.com/im/{rng.randint(10**7, 10**8)}/resize-h400-w400/{i}.jpg"
+        price = '' if i % 5 == 4 else f'<span data-test-id="PriceDisplay">{_price_text(rng)}</span>'
+        if i % 2 == 0:
+            media = f'<div class="Media"><a href="/furniture/pdp/loose-{i}.html"><img data-src="{img}" alt=""></a></div>'
+        else:
+            media = '<div class="Media"><span class="Badge">Sale</span></div>'
+            rows.append(f'<aside class="Recently"><img src="{img}" alt="{name.lower()}"></aside>')
+        rows.append(f'<section class="Row">{media}<div class="Body"><div class="Head">'
+                    f'<h2 data-test-id="ListingCard-ListingCardName-Text">{name}</h2></div>{price}</div></section>')
+    return (
+        '<!DOCTYPE html><html><head><title>Search results</title></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header><main>{"".join(rows)}</main>'
+        f'<footer>{_chrome(rng, chrome_blocks // 2)}</footer></body></html>'
+    )
+
+
+def wayfair_product_card_page(cards: int = 24, seed: int = 13, chrome_blocks: int = 20) -> str:
+    """A Wayfair search page in the ProductCard markup app.WAYFAIR_SPEC matches.
+
+    Some cards carry the sale price only in their text, and some prices only
+    in a data-hb-id attribute span, to exercise each price selector.
+    """
+    rng = random.Random(seed)
+    cards_html = []
+    for i in range(cards):
+        name = product_name(rng)
+        img = f"https://assets.wfcdn.com/im/{i}/resize-h300-w300/{i}.jpg"
+        if i % 4 == 0:
+            price = f'<span data-enzyme-id="SalePrice">{_price_text(rng)}</span><s>{_price_text(rng)}</s>'
+        elif i % 4 == 1:
+            price = f'<div data-hb-id="PriceBlock"><span>{_price_text(rng)}</span></div>'
+        elif i % 4 == 2:
+            price = f'<span class="ProductCard-price">{_price_text(rng)}</span>'
+        else:
+            price = f'<p>Now only {_price_text(rng)} with free delivery</p>'
+        cards_html.append(
+            f'<div data-enzyme-id="ProductCard" class="ProductCard-{i}">'
+            f'<a href="/furniture/pdp/card-{i}.html"><img data-srcset="{img} 1x, {img.replace("h300-w300", "h600-w600")} 2x" alt="{name}"></a>'
+            f'<div data-enzyme-id="ProductName">{name}</div>{price}'
+            f'<div class="Reviews"><span>{rng.randint(1, 5)} out of 5</span></div></div>'
+        )
+    return (
+        '<!DOCTYPE html><html><head><title>Search</title></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header>'
+        f'<main><div class="BrowseResults">{"".join(cards_html)}</div></main></body></html>'
+    )
+
+
+def ikea_search_page(cards: int = 24, seed: int = 17, chrome_blocks: int = 20) -> str:
+    """An IKEA search page in pip-product-compact markup.
+
+    The nested image and bottom containers also carry "product" in their
+    class, as on the live site, so app.IKEA_SPEC matches them as cards too.
+    """
+    rng = random.Random(seed)
+    cards_html = []
+    for i in range(cards):
+        family = rng.choice(['SÖDERHAMN', 'KIVIK', 'LACK', 'BILLY', 'HEMNES', 'STOCKHOLM'])
+        kind = rng.choice(NOUNS)
+        href = f"https://www.ikea.com/us/en/p/{family.lower()}-{kind.lower().replace(' ', '-')}-{10000 + i}/"
+        cards_html.append(
+            f'<div class="plp-fragment-wrapper"><div class="pip-product-compact" data-product-number="{10000 + i}">'
+            f'<a href="{href}" class="pip-product-compact__wrapper-link"><div class="pip-product-compact__image-container">'
+            f'<img class="pip-image" src="https://www.ikea.com/us/en/images/products/{i}.jpg" alt="{family} {kind}"></div></a>'
+            f'<div class="pip-product-compact__bottom-wrapper"><a href="{href}"><h3 class="pip-header-section">'
+            f'<span class="pip-header-section__title--small">{family}</span>'
+            f'<span class="pip-header-section__description-text">{kind}, {rng.choice(["gray", "white", "oak"])}</span></h3></a>'
+            f'<span class="pip-price"><span class="pip-price__currency">$</span>'
+            f'<span class="pip-price__integer">{rng.randint(9, 1299)}</span></span></div></div></div>'
+        )
+    return (
+        '<!DOCTYPE html><html><head><title>Search - IKEA</title></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header>'
+        f'<main><div class="plp-product-list">{"".join(cards_html)}</div></main></body></html>'
+    )
+
+
+def westelm_search_page(cards: int = 24, seed: int = 19, chrome_blocks: int = 20) -> str:
+    """A West Elm search results grid (grid-item / product-cell markup)."""
+    rng = random.Random(seed)
+    cards_html = []
+    for i in range(cards):
+        name = product_name(rng)
+        href = f"/products/{name.lower().replace(' ', '-')}-h{i}/"
+        low, high = rng.randint(99, 1500), rng.randint(1600, 3999)
+        price = (f'<span class="product-price"><span class="price-amount">${low}</span> &ndash; '
+                 f'<span class="price-amount">${high}</span></span>') if i % 3 else \
+                f'<span class="product-price price-sale">Sale ${low:,}.00</span>'
+        cards_html.append(
+            f'<div class="grid-item product-cell" data-pid="{i}"><a class="product-image-link" href="{href}">'
+            f'<img src="https://assets.weimgs.com/weimgs/ab/images/wcm/products/{i}/img{i}c.jpg" alt="{name}"></a>'
+            f'<div class="product-info"><a class="product-name" href="{href}"><span>{name}</span></a>{price}</div></div>'
+        )
+    return (
+        '<!DOCTYPE html><html><head><title>West Elm</title></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header>'
+        f'<main><div class="search-results-grid">{"".join(cards_html)}</div></main></body></html>'
+    )
+
+
+def ldjson_graph_page(products: int = 30, seed: int = 23, chrome_blocks: int = 20) -> str:
+    """A page with no product cards, only an ld+json @graph of Products.
+
+    Offers come as dicts or lists, with price, lowPrice or a top-level price,
+    and images as strings or lists; a malformed block and a non-product
+    BreadcrumbList sit next to it.
+    """
+    rng = random.Random(seed)
+    graph = [{"@type": "BreadcrumbList", "itemListElement": [{"@type": "ListItem", "position": 1, "name": "Home"}]}]
+    for i in range(products):
+        name = product_name(rng)
+        obj = {"@type": ["Product", "Thing"] if i % 7 == 0 else "Product", "name": name,
+               "url": f"/products/ld-{i}/",
+               "image": [f"https://cdn.example.com/{i}-s.jpg", f"https://cdn.example.com/{i}-l.jpg"] if i % 2 else f"https://cdn.example.com/{i}.jpg"}
+        price = f"{rng.randint(49, 2999)}.{rng.randint(0, 99):02d}"
+        if i % 3 == 0:
+            obj["offers"] = {"@type": "Offer", "price": price, "priceCurrency": "USD"}
+        elif i % 3 == 1:
+            obj["offers"] = [{"@type": "AggregateOffer", "lowPrice": f"${int(float(price)):,}", "highPrice": "4,999"}]
+        else:
+            obj["price"] = price
+        graph.append(obj)
+    ld = json.dumps({"@context": "https://schema.org", "@graph": graph})
+    return (
+        '<!DOCTYPE html><html><head><title>Products</title>'
+        '<script type="application/ld+json">{"@context": "https://schema.org", "@type": "Organization",</script>'
+        f'<script type="application/ld+json">{ld}</script></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header><main><p>Loading results...</p></main></body></html>'
+    )
+
+
+def inline_state_page(products: int = 150, seed: int = 29, chrome_blocks: int = 20) -> str:
+    """A client-rendered page: no cards or ld+json, products only in inline state scripts."""
+    rng = random.Random(seed)
+    analytics = 'window.dataLayer = [' + ','.join(
+        json.dumps({"event": "view", "page": {"name": f"search {i}", "type": "plp"}}) for i in range(40)) + '];'
+    return (
+        '<!DOCTYPE html><html><head><title>Search</title>'
+        f'<script>{analytics}</script></head><body>'
+        f'<header>{_chrome(rng, chrome_blocks)}</header><div id="root"></div>'
+        f'<script>{_inline_state(rng, products // 3)}</script>'
+        f'<script>{_inline_state(rng, products - products // 3)}</script></body></html>'
+    )
+
+
+def _price_variant(rng: random.Random, i: int) -> dict:
+    """Constructor data price fields in the shapes the extractors accept, by index."""
+    amount = round(rng.uniform(49, 2999), 2)
+    shapes = [
+        {"lowestPrice": amount},
+        {"lowestPrice": f"{amount:.2f}"},
+        {"lowestPrice": "", "salePriceMin": int(amount)},
+        {"salePrice": f"${amount:,.2f}"},
+        {"price": str(int(amount))},
+        {"Pricing": json.dumps({"price": amount, "originalPrice": amount + 100})},
+        {"Pricing": json.dumps({"price": None, "overridePrice": 0, "originalPrice": amount})},
+        {"Pricing": json.dumps({"financePricing": {"amount": round(amount / 12, 2)}})},
+        {"Analytics": json.dumps({"name": f"analytics name {i}", "price": f"{amount}"})},
+        {"Pricing": "not json", "Analytics": "{broken"},
+        {},
+    ]
+    return shapes[i % len(shapes)]
+
+
+def constructor_mixed_price_payload(query: str, n: int = 44, seed: int = 31, shape: str = "search",
+                                    image_host: str = "assets.pbimgs.com", url_prefix: str = "/products") -> dict:
+    """A Constructor.io payload whose products cycle through every price field shape.
+
+    shape is "search" (response.results) or "autocomplete" (sections.Products,
+    with search suggestions). Some items lack a title so extractors fall back
+    to the item value, and some urls are relative.
+    """
+    items = _constructor_products(query, n, seed, image_host, url_prefix)
+    rng = random.Random(seed)
+    for i, item in enumerate(items):
+        data = item["data"]
+        del data["lowestPrice"]
+        data.update(_price_variant(rng, i))
+        if i % 6 == 5:
+            del data["title"]
+        if i % 4 == 3:
+            data["url"] = data["url"].lstrip("/")
+        elif i % 4 == 2:
+            data["url"] = "https://www.example.com" + data["url"]
+    if shape == "search":
+        return {"response": {"results": items, "total_num_results": n, "facets": []}, "request": {"term": query}}
+    suggestions = [{"value": f"{query} {word}", "data": {"id": str(i)}} for i, word in enumerate(["set", "sale", "small", "large"])]
+    return {"sections": {"Products": items, "Search Suggestions": suggestions}, "request": {"term": query}}
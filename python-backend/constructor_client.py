@@ -0,0 +1,164 @@
+"""Shared GET path for the Constructor.io APIs behind West Elm, Pottery Barn and R&F.
+
+Keys rotate without notice. When a call comes back 401, or with
+Constructor's invalid-key message ("We have no record of this key"), the
+key is marked stale for the site. Other 4xx answers, such as a 403 from a
+bot wall or a rejected filter, take the normal error path. The
+call then looks for a replacement key:
+  - If another worker already wrote a different key to the key store, that
+    key is used directly.
+  - Otherwise one background Playwright refresh is started through
+    key_refresher; every site and caller shares it. The call waits up to
+    KEY_REFRESH_WAIT seconds and is retried once if the key changed.
+Requests that arrive for a stale key while the refresh runs wait the same
+way rather than spending a round trip on a key known to fail. With
+CONSTRUCTOR_KEY_REFRESH_WAIT=0 they fail fast instead.
+"""
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+import tracing
+import upstream
+
+try:
+    from constructor_keys import get_keys as ctor_get_keys
+except Exception:
+    ctor_get_keys = None  # type: ignore
+
+try:
+    import key_refresher
+except Exception:
+    key_refresher = None  # type: ignore
+
+try:
+    from fast_json import response_json
+except Exception:
+    def response_json(resp):
+        return resp.json()
+
+# Constructor.io API origin, overridable for all sites or per site (<SITE>_API_BASE_URL,
+# e.g. WEST_ELM_API_BASE_URL) so a replay.py stand-in can tell the sites apart
+API_BASE = os.getenv('CONSTRUCTOR_BASE_URL', 'https://ac.cnstrc.com').rstrip('/')
+KEY_REFRESH_WAIT = float(os.getenv('CONSTRUCTOR_KEY_REFRESH_WAIT', '10'))
+# A failed refresh isn't retried, and a stale key isn't re-tested, for this many seconds
+KEY_REFRESH_COOLDOWN = float(os.getenv('CONSTRUCTOR_KEY_REFRESH_COOLDOWN', '600'))
+
+# Error messages Constructor.io returns for a missing, wrong or revoked key. Only
+# these: other errors mentioning a key (e.g. a bad filters[...] facet) are not auth failures.
+_KEY_ERROR = re.compile(r'no record of this key|(invalid|unknown|missing|revoked) (api[ _-]?)?key\b'
+                        r'|(api[ _-]?)?key (is )?(invalid|required|missing|revoked)', re.IGNORECASE)
+
+_session = requests.Session()
+_stale_lock = threading.Lock()
+_stale: Dict[str, Tuple[str, float]] = {}  # site -> (rejected key, time.monotonic() of rejection)
+
+
+def api_base(site: str) -> str:
+    return os.getenv(f'{site.upper()}_API_BASE_URL', API_BASE).rstrip('/')
+
+
+def current_keys(site: str, fallback_key: str, fallback_clientlib: str) -> Tuple[str, str]:
+    """(key, clientlib) from the key store, else the caller's defaults."""
+    if ctor_get_keys is None:
+        return fallback_key, fallback_clientlib
+    try:
+        k, c = ctor_get_keys(site, fallback_key=fallback_key, fallback_clientlib=fallback_clientlib)
+        return k or fallback_key, c or fallback_clientlib
+    except Exception:
+        return fallback_key, fallback_clientlib
+
+
+def is_auth_failure(status: int, payload: Any) -> bool:
+    if status == 401:
+        return True
+    if isinstance(payload, dict) and 'response' not in payload and 'sections' not in payload:
+        message = payload.get('message') or payload.get('error') or ''
+        return isinstance(message, str) and bool(_KEY_ERROR.search(message))
+    return False
+
+
+def _is_stale(site: str, key: str) -> bool:
+    with _stale_lock:
+        entry = _stale.get(site)
+        if entry is None or entry[0] != key:
+            return False
+        if time.monotonic() - entry[1] > KEY_REFRESH_COOLDOWN:
+            # Let a request through now and then in case the failure wasn't the key
+            del _stale[site]
+            return False
+        return True
+
+
+def _replacement_key(site: str, stale_key: str, fallback_key: str, fallback_clientlib: str) -> Optional[Tuple[str, str]]:
+    """A key other than `stale_key`, refreshing (at most once at a time) if needed."""
+    key, clientlib = current_keys(site, fallback_key, fallback_clientlib)
+    if key != stale_key:
+        return key, clientlib
+    refresher = key_refresher.refresher if key_refresher is not None else None
+    if refresher is None or not key_refresher.PLAYWRIGHT_AVAILABLE:
+        return None
+    job = refresher.start(headless=True, trigger=f'auth-failure:{site}', cooldown=KEY_REFRESH_COOLDOWN,
+                          stale={site: stale_key})
+    if KEY_REFRESH_WAIT > 0:
+        refresher.wait(job['id'], KEY_REFRESH_WAIT)
+    key, clientlib = current_keys(site, fallback_key, fallback_clientlib)
+    return (key, clientlib) if key != stale_key else None
+
+
+def get_json(site: str, url: str, params: Dict[str, str], fallback_key: str, fallback_clientlib: str,
+             headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None, label: str = 'Constructor.io'):
+    """GET a Constructor.io endpoint with the site's current key; parsed JSON or None.
+
+    `params` must not include "key" or "c": they are filled in here, and
+    replaced if the key turns out to be stale. The request goes through the
+    "<site>_api" upstream (breaker, adaptive timeout capped at `timeout`).
+    """
+    with tracing.span('constructor.get_json', site=site) as span:
+        payload = _get_json(site, url, params, fallback_key, fallback_clientlib, headers, timeout, label)
+        span.set(ok=payload is not None)
+        return payload
+
+
+def _get_json(site, url, params, fallback_key, fallback_clientlib, headers, timeout, label):
+    key, clientlib = current_keys(site, fallback_key, fallback_clientlib)
+    if _is_stale(site, key):
+        replacement = _replacement_key(site, key, fallback_key, fallback_clientlib)
+        if replacement is None:
+            print(f"Skipping {label} request: API key was rejected and no new key is available yet")
+            return None
+        key, clientlib = replacement
+
+    for attempt in range(2):
+        try:
+            resp = upstream.get(f'{site}_api', url, timeout=timeout, session=_session, headers=headers,
+                                params={**params, 'c': clientlib, 'key': key})
+        except requests.RequestException as e:
+            print(f"Error fetching {label}: {e}")
+            return None
+        try:
+            payload = response_json(resp)
+        except ValueError:
+            payload = None
+        if not is_auth_failure(resp.status_code, payload):
+            if resp.status_code >= 400 or payload is None:
+                print(f"Error fetching {label}: HTTP {resp.status_code}")
+                return None
+            return payload
+
+        print(f"{label} rejected API key {key} (HTTP {resp.status_code})")
+        with _stale_lock:
+            _stale[site] = (key, time.monotonic())
+        if attempt:
+            break
+        replacement = _replacement_key(site, key, fallback_key, fallback_clientlib)
+        if replacement is None:
+            return None
+        key, clientlib = replacement
+        tracing.current_span().set(key_refreshed=True)
+        print(f"Retrying {label} with refreshed API key")
+    return None
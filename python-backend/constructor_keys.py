@@ -1,9 +1,19 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from typing import Dict, Tuple, Optional
 from datetime import datetime  # NEW
 
+try:
+    import fcntl  # POSIX only; without it writes are still atomic, just not serialized across processes
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
 _KEYS_FILE = os.path.join(os.path.dirname(__file__), 'constructor_keys.json')
+_LOCK_FILE = _KEYS_FILE + '.lock'
 
 SITE_ENV_MAP = {
     'west_elm': ('WEST_ELM_API_KEY', 'WEST_ELM_CLIENT_LIB'),
@@ -11,22 +21,79 @@ SITE_ENV_MAP = {
     'raymour_flanigan': ('RAYMOUR_FLANIGAN_API_KEY', 'RAYMOUR_FLANIGAN_CLIENT_LIB'),
 }
 
-def _load_file() -> Dict:
+# NEW: parsed file contents, reused while the file's (mtime, size, inode) is unchanged.
+# Writers replace the file by rename, so another worker's save always changes the inode.
+_lock = threading.RLock()
+_cache: Dict = {'stamp': None, 'data': {}}
+
+
+def _stamp() -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(_KEYS_FILE)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _read_file() -> Dict:
     try:
         if os.path.exists(_KEYS_FILE):
             with open(_KEYS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f) or {}
+                data = json.load(f) or {}
+                return data if isinstance(data, dict) else {}
     except Exception:
         pass
     return {}
 
 
+def _load_file() -> Dict:
+    """Return the parsed keys file; one stat() per call on a cache hit.
+
+    The returned dict is shared: callers must not mutate it.
+    """
+    stamp = _stamp()
+    with _lock:
+        if stamp is not None and stamp == _cache['stamp']:
+            return _cache['data']
+        data = _read_file() if stamp is not None else {}
+        _cache['stamp'], _cache['data'] = stamp, data
+        return data
+
+
+@contextmanager
+def _file_lock():
+    """Serialize read-modify-write of the keys file across threads and worker processes."""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(_LOCK_FILE, 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
 def _save_file(keys: Dict) -> None:
+    """Write via a temp file and os.replace so readers never see a partial file."""
+    directory = os.path.dirname(_KEYS_FILE)
     try:
-        with open(_KEYS_FILE, 'w', encoding='utf-8') as f:
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.constructor_keys.', suffix='.tmp')
+    except Exception:
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
             json.dump(keys, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, _KEYS_FILE)
+        _cache['stamp'], _cache['data'] = _stamp(), keys
     except Exception:
-        pass
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
 
 
 def get_keys(site: str, fallback_key: Optional[str] = None, fallback_clientlib: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
@@ -52,9 +119,13 @@ def save_keys(new_keys: Dict[str, Dict[str, Optional[str]]]) -> Dict:
     """Merge and persist new keys. Returns merged keys.
     Adds/updates per-site 'updated_at' timestamp when new values provided.
     """
-    data = _load_file()
-    if not isinstance(data, dict):
-        data = {}
+    with _file_lock():
+        return _merge_and_save(new_keys)
+
+
+def _merge_and_save(new_keys: Dict[str, Dict[str, Optional[str]]]) -> Dict:
+    # Copy: the cached dict is shared with concurrent readers
+    data = copy.deepcopy(_load_file())
     for site, vals in (new_keys or {}).items():
         if not isinstance(vals, dict):
             continue
@@ -65,6 +136,7 @@ def save_keys(new_keys: Dict[str, Dict[str, Optional[str]]]) -> Dict:
         merged_key = in_key or curr.get('key')
         merged_cli = in_cli or curr.get('clientlib')
         entry = {
+            **curr,  # keep extra per-site settings such as 'price_facet'
             'key': merged_key,
             'clientlib': merged_cli,
         }
@@ -74,6 +146,9 @@ def save_keys(new_keys: Dict[str, Dict[str, Optional[str]]]) -> Dict:
         else:
             if 'updated_at' in curr:
                 entry['updated_at'] = curr['updated_at']
+        if in_key:
+            # Last time a refresh confirmed the key, even when it was unchanged
+            entry['checked_at'] = datetime.utcnow().isoformat() + 'Z'
         data[site] = entry
     _save_file(data)
     return data
@@ -88,5 +163,34 @@ def status() -> Dict[str, Dict[str, bool]]:
             'has_key': bool(entry.get('key') or os.getenv(SITE_ENV_MAP[site][0])),
             'has_clientlib': bool(entry.get('clientlib') or os.getenv(SITE_ENV_MAP[site][1])),
             'updated_at': entry.get('updated_at'),  # NEW: last refresh timestamp if available
+            'checked_at': entry.get('checked_at'),
         }
     return out
+
+
+# Name of the Constructor.io range facet holding the product price, per site.
+# Unset means price ranges are not pushed into that site's API requests.
+PRICE_FACET_ENV_MAP = {
+    'west_elm': 'WEST_ELM_PRICE_FACET',
+    'pottery_barn': 'POTTERY_BARN_PRICE_FACET',
+    'raymour_flanigan': 'RAYMOUR_FLANIGAN_PRICE_FACET',
+}
+
+
+def price_filter_params(site: str, price_min: Optional[float] = None, price_max: Optional[float] = None) -> Dict[str, str]:
+    """Return Constructor.io query params restricting results to a price range.
+
+    Uses `filters[<facet>]=<min>-<max>` with an open upper bound written as
+    "inf". The facet comes from the JSON file ('price_facet') or the
+    environment; returns {} when neither is set or no bound is given.
+    """
+    if price_min is None and price_max is None:
+        return {}
+    data = _load_file()
+    site_entry = (data.get(site) or {}) if isinstance(data, dict) else {}
+    facet = site_entry.get('price_facet') or os.getenv(PRICE_FACET_ENV_MAP.get(site, ''), '')
+    if not facet:
+        return {}
+    lo = f"{price_min:g}" if price_min is not None else '0'
+    hi = f"{price_max:g}" if price_max is not None else 'inf'
+    return {f'filters[{facet}]': f'{lo}-{hi}'}
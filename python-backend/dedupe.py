@@ -0,0 +1,163 @@
+"""Collapse duplicate products across retailers.
+
+Two passes over the combined result list:
+  1. canonical URLs: tracking params, fragments, "www." and trailing
+     slashes are dropped so the same product page is only kept once
+  2. near duplicates: titles are MinHashed over character shingles of their
+     sorted tokens and bucketed with LSH; candidate pairs from *different*
+     retailers whose estimated Jaccard similarity clears DUP_THRESHOLD (and
+     whose numbers, e.g. sizes, agree) are merged. An optional image hash
+     function can confirm borderline title matches.
+
+Merged records keep the first occurrence as the entry and list the others
+as alternate offers.
+"""
+import os
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+import tracing
+from product_record import Product
+from ranking import tokenize
+
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'dclid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+                   'ref', 'ref_', 'refid', 'cid', 'icid', 'cm_ven', 'cm_cat', 'cm_pla', 'cm_ite', 'cm_mmc'}
+TRACKING_PREFIXES = ('utm_', 'cm_', 'pk_')
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+LSH_BANDS = 16  # 16 bands x 4 rows: pairs at Jaccard 0.7 collide with p ~0.98
+DUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.7'))
+# Title matches this close are merged only when image hashes agree too
+IMAGE_CONFIRM_THRESHOLD = 0.5
+IMAGE_MAX_DISTANCE = 10  # bits of a 64-bit perceptual hash
+SIGNATURE_CACHE_SIZE = 8192
+
+# Fixed seed: signatures must not change between processes or restarts
+_rng = np.random.RandomState(0x5EED)
+_PERM_A = _rng.randint(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.randint(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+
+def canonical_url(url: str) -> str:
+    if not url:
+        return ''
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https' if parts.scheme in ('http', 'https', '') else parts.scheme,
+                       host, path, urlencode(sorted(query)), ''))
+
+
+def _shingles(title: str) -> List[int]:
+    # Sorted tokens: retailers order the same words differently
+    # ("Velvet 84" Sofa" vs "Velvet Sofa, 84 in")
+    text = ' '.join(sorted(set(tokenize(title or ''))))
+    if len(text) <= SHINGLE_SIZE:
+        return [zlib.crc32(text.encode())] if text else []
+    return list({zlib.crc32(text[i:i + SHINGLE_SIZE].encode()) for i in range(len(text) - SHINGLE_SIZE + 1)})
+
+
+def _numbers(title: str) -> frozenset:
+    return frozenset(t for t in tokenize(title or '') if t.isdigit())
+
+
+@lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def minhash(title: str) -> Optional[np.ndarray]:
+    """NUM_PERM-value signature; multiply-shift hashing in wrapping uint64."""
+    sh = _shingles(title)
+    if not sh:
+        return None
+    x = np.array(sh, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        hashed = (_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+    sig = hashed.min(axis=1)
+    sig.flags.writeable = False  # shared through the cache
+    return sig
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@tracing.traced('dedupe.collapse')
+def collapse(records: List[Product], image_hash: Optional[Callable[[Product], Optional[int]]] = None) -> List[Product]:
+    """Return records with duplicates folded into the first occurrence's offers."""
+    by_url: Dict[str, int] = {}
+    kept: List[Product] = []
+    for r in records:
+        key = canonical_url(r.url)
+        if key and key in by_url:
+            continue
+        if key:
+            by_url[key] = len(kept)
+        kept.append(r)
+    if len(kept) < 2:
+        return kept
+
+    sigs = [minhash(r.title) for r in kept]
+    numbers = [_numbers(r.title) for r in kept]
+    width = (NUM_PERM // LSH_BANDS) * 8  # bytes per band
+    buckets: Dict[tuple, List[int]] = {}
+    for i, sig in enumerate(sigs):
+        if sig is None:
+            continue
+        raw = sig.tobytes()
+        for band in range(LSH_BANDS):
+            buckets.setdefault((band, raw[band * width:(band + 1) * width]), []).append(i)
+
+    parent = list(range(len(kept)))
+    # A group holds at most one offer per retailer; same-site lookalikes are
+    # usually variants (size, colour) rather than duplicates
+    group_sites = [{r.site} for r in kept]
+    checked = set()
+    for members in buckets.values():
+        for a_pos, a in enumerate(members):
+            for b in members[a_pos + 1:]:
+                if (a, b) in checked or kept[a].site == kept[b].site:
+                    continue
+                checked.add((a, b))
+                # 84" vs 96" sofas are different products however similar the rest is
+                if numbers[a] and numbers[b] and numbers[a] != numbers[b]:
+                    continue
+                sim = float(np.count_nonzero(sigs[a] == sigs[b])) / NUM_PERM
+                if sim < IMAGE_CONFIRM_THRESHOLD:
+                    continue
+                if sim < DUP_THRESHOLD:
+                    ha = image_hash(kept[a]) if image_hash else None
+                    hb = image_hash(kept[b]) if image_hash and ha is not None else None
+                    if hb is None or bin(ha ^ hb).count('1') > IMAGE_MAX_DISTANCE:
+                        continue
+                ra, rb = _find(parent, a), _find(parent, b)
+                if ra == rb or group_sites[ra] & group_sites[rb]:
+                    continue
+                root, child = min(ra, rb), max(ra, rb)
+                parent[child] = root
+                group_sites[root] |= group_sites[child]
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(kept)):
+        groups.setdefault(_find(parent, i), []).append(i)
+    out: List[Product] = []
+    for i, r in enumerate(kept):
+        members = groups.get(i)
+        if members is None:
+            continue
+        if len(members) > 1:
+            r.offers = [kept[j] for j in members[1:]]
+        out.append(r)
+    return out
@@ -0,0 +1,50 @@
+"""Pluggable JSON codec for upstream payloads and API responses.
+
+Uses orjson when it is installed and falls back to the stdlib json module
+otherwise (or when FAST_JSON=0). Both paths accept str or bytes and raise a
+ValueError subclass on malformed input, so callers can treat them alike.
+"""
+import json
+import os
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+if os.getenv('FAST_JSON', '1') != '1':
+    orjson = None  # type: ignore
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """Decode JSON from str/bytes/bytearray."""
+    if orjson is not None:
+        # orjson rejects str subclasses such as bs4's NavigableString (script.string)
+        if type(data) is not str and isinstance(data, str):
+            data = str(data)
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumpb(obj, sort_keys: bool = False, default=None) -> bytes:
+    """Encode to UTF-8 JSON bytes (compact separators)."""
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # Non-str dict keys, >64-bit ints, etc.: let the stdlib handle it
+            pass
+    return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj, sort_keys: bool = False, default=None) -> str:
+    return dumpb(obj, sort_keys=sort_keys, default=default).decode('utf-8')
+
+
+def response_json(resp):
+    """Drop-in for requests' resp.json() that decodes resp.content directly."""
+    return loads(resp.content)
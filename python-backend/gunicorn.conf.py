@@ -0,0 +1,65 @@
+"""gunicorn settings for the production backend.
+
+    gunicorn -c gunicorn.conf.py wsgi:app      (or: MODE=production ./start_backend.sh)
+
+Tunables (environment):
+  HOST / PORT            bind address, default 127.0.0.1:5000 like app.py
+  WEB_CONCURRENCY        worker processes, default min(4, CPUs), at least 2
+  WEB_THREADS            threads per worker, default 4. Searches mostly wait on
+                         retailers, so threads add concurrency cheaply.
+                         Background removal is CPU-bound, so workers add more
+                         rembg throughput than threads.
+  WEB_TIMEOUT            seconds before a silent worker is killed and replaced, default 60
+  WEB_GRACEFUL_TIMEOUT   seconds in-flight requests get on reload/shutdown, default 30
+  WEB_MAX_REQUESTS       recycle a worker after this many requests, with jitter; 0 = never
+  WEB_ACCESS_LOG         access log destination, default "-" (stdout); empty disables it
+  PRELOAD_APP            1 (default): import the app and rembg models in the master
+                         before forking (see wsgi.py); 0: each worker loads its own
+  CONSTRUCTOR_KEY_REFRESH_INTERVAL
+                         the periodic key refresh runs in one worker at a time, never in
+                         the master
+
+Reloads:
+  kill -HUP <master>     re-reads this file and replaces the workers one by one.
+                         In-flight requests finish within WEB_GRACEFUL_TIMEOUT. With
+                         PRELOAD_APP=1 the new workers fork from the master, so they run
+                         the code and models that were loaded at start.
+  kill -USR2 <master>    deploys new code: starts a new master and workers alongside the
+                         old ones. Send WINCH then QUIT to the old master once the new one
+                         is serving.
+  kill -TERM <master>    graceful shutdown.
+"""
+import os
+
+bind = f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(max(2, min(4, os.cpu_count() or 1)))))
+threads = int(os.getenv('WEB_THREADS', '4'))
+worker_class = 'gthread'
+preload_app = os.getenv('PRELOAD_APP', '1') != '0'
+# rembg on a large image plus a full multi-retailer search (SEARCH_DEADLINE) fit well inside this
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv('WEB_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Imported here at the latest, in the master: the metrics directory is keyed
+    # by the master's pid and the workers inherit it (see metrics.py)
+    import metrics
+    metrics.remove_stale_directories()
+    # Snapshots left by a previous run in this directory (a container restarting
+    # with the same pids, or a fixed METRICS_DIR) would look alive
+    metrics.remove_snapshots()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} started ({threads} threads, preloaded={preload_app})")
+    # Every worker starts the key refresh scheduler; a file lock lets one of
+    # them refresh at a time, and another takes over when it exits
+    import app
+    app.start_key_refresh_schedule(leader_lock=True)
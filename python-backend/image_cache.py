@@ -0,0 +1,210 @@
+"""Resized thumbnail variants for the /image-proxy endpoint.
+
+Variants are keyed by (source URL, width, format) and stored on disk as
+<dir>/<key[:2]>/<key>.<ext>. Writes go through a temp file and os.replace
+so concurrent workers never serve a half-written file. The ETag is derived
+from the key and the file's mtime, so a cache hit never has to read the
+file before answering a conditional request.
+
+Expired variants are deleted when a lookup finds them. A sweep, at most
+every IMAGE_CACHE_SWEEP_SECONDS across all workers and run in the
+background after a store, deletes the rest and then the oldest variants
+until the cache fits in IMAGE_CACHE_MAX_MB.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+CACHE_DIR = os.getenv('IMAGE_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'image_cache')
+CACHE_TTL_SECONDS = int(os.getenv('IMAGE_CACHE_TTL', str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024)
+SWEEP_INTERVAL_SECONDS = int(os.getenv('IMAGE_CACHE_SWEEP_SECONDS', '600'))
+# Its mtime records the last sweep by any worker
+_SWEEP_MARKER = '.last_sweep'
+_sweep_lock = threading.Lock()
+# Requested widths snap up to one of these so the cache holds few variants per image
+WIDTHS = (96, 160, 240, 320, 480, 640, 960, 1280)
+DEFAULT_WIDTH = 320
+MAX_SOURCE_BYTES = 15 * 1024 * 1024
+
+# format -> (Pillow format, mimetype, extension, save options)
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', 'avif', {'quality': 60, 'speed': 8}),
+    'webp': ('WEBP', 'image/webp', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def _encoders():
+    Image.init()
+    return {name for name, (pil_format, _, _, _) in FORMATS.items() if pil_format in Image.SAVE}
+
+
+# AVIF needs Pillow >= 11.3 (or pillow-avif-plugin); WEBP needs libwebp
+AVAILABLE_FORMATS = _encoders()
+
+
+def snap_width(width) -> int:
+    try:
+        w = int(width)
+    except (TypeError, ValueError):
+        return DEFAULT_WIDTH
+    for allowed in WIDTHS:
+        if w <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """Pick the smallest format the client accepts and we can encode."""
+    accept = (accept or '').lower()
+    for fmt in ('avif', 'webp'):
+        if fmt in AVAILABLE_FORMATS and f'image/{fmt}' in accept:
+            return fmt
+    return 'jpeg'
+
+
+def variant_key(url: str, width: int, fmt: str) -> str:
+    return hashlib.sha256(f'{url}|{width}|{fmt}'.encode('utf-8')).hexdigest()
+
+
+def _path(key: str, fmt: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f'{key}.{FORMATS[fmt][2]}')
+
+
+def _etag(key: str, mtime: float) -> str:
+    return f'{key[:20]}-{int(mtime)}'
+
+
+def lookup(key: str, fmt: str) -> Optional[Tuple[str, str]]:
+    """Return (path, etag) for a fresh cached variant, else None."""
+    path = _path(key, fmt)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if time.time() - st.st_mtime > CACHE_TTL_SECONDS:
+        _remove(path)
+        return None
+    return path, _etag(key, st.st_mtime)
+
+
+def read(path: str) -> Optional[bytes]:
+    """Contents of a variant returned by lookup(), or None if a sweep removed it since."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def render(source: bytes, width: int, fmt: str) -> bytes:
+    """Downscale (never upscale) an encoded image to `width` and re-encode it."""
+    img = Image.open(io.BytesIO(source))
+    img.draft('RGB', (width, width * 4))  # JPEG: decode at reduced scale when possible
+    img = ImageOps.exif_transpose(img)
+    keep_alpha = fmt != 'jpeg' and (img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info))
+    img = img.convert('RGBA' if keep_alpha else 'RGB')
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    pil_format, _, _, options = FORMATS[fmt]
+    out = io.BytesIO()
+    img.save(out, format=pil_format, **options)
+    return out.getvalue()
+
+
+def store(key: str, fmt: str, data: bytes) -> Tuple[str, str]:
+    """Atomically write a variant; returns (path, etag)."""
+    path = _path(key, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    etag = _etag(key, os.stat(path).st_mtime)
+    _maybe_sweep()
+    return path, etag
+
+
+def _maybe_sweep() -> None:
+    """Start a background sweep when no worker has run one for SWEEP_INTERVAL_SECONDS."""
+    marker = os.path.join(CACHE_DIR, _SWEEP_MARKER)
+    try:
+        if time.time() - os.stat(marker).st_mtime < SWEEP_INTERVAL_SECONDS:
+            return
+    except OSError:
+        pass
+    if not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        with open(marker, 'a'):
+            os.utime(marker)
+    except OSError:
+        _sweep_lock.release()
+        return
+    threading.Thread(target=_sweep_in_background, name='image-cache-sweep', daemon=True).start()
+
+
+def _sweep_in_background() -> None:
+    try:
+        sweep()
+    except Exception:
+        pass
+    finally:
+        _sweep_lock.release()
+
+
+def sweep(max_bytes: Optional[int] = None) -> Tuple[int, int]:
+    """Delete expired variants and leftover temp files, then the oldest
+    variants until the cache is at most max_bytes (CACHE_MAX_BYTES by default).
+    Returns (files removed, bytes kept).
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+    removed, entries, total = 0, [], 0
+    for dirpath, _dirs, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name == _SWEEP_MARKER:
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # Temp files older than an hour belong to writers that died mid-write
+            stale = 3600 if name.endswith('.tmp') else CACHE_TTL_SECONDS
+            if now - st.st_mtime > stale:
+                _remove(path)
+                removed += 1
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total > max_bytes:
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= max_bytes:
+                break
+            _remove(path)
+            removed += 1
+            total -= size
+    return removed, total
@@ -0,0 +1,330 @@
+"""Background Constructor.io key refresh jobs.
+
+A refresh drives a real browser for several seconds, so it never runs on a
+request thread. start() queues at most one job per process: while a job
+is running, further calls return that job. An optional scheduler thread
+starts a headless refresh every REFRESH_INTERVAL seconds. Each tick skips
+the refresh when the key file shows that every site was refreshed within
+the interval. Several worker processes sharing one key file therefore
+don't each launch a browser. The dev server starts the schedule in
+__main__. Under gunicorn every worker starts it, and a file lock
+(SCHEDULE_LOCK) lets one worker at a time refresh. The master never
+runs it. A forked child starts with no job and no scheduler.
+
+The current job is also written to JOB_FILE, next to the key file, so
+any worker can report it and none starts a second refresh while another
+process's job is still running. A job whose process has exited is
+reported as failed.
+"""
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl  # POSIX only; without it every process's scheduler may refresh
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the scheduler; manual refreshes through the endpoint still work
+REFRESH_INTERVAL = int(os.getenv('CONSTRUCTOR_KEY_REFRESH_INTERVAL', str(6 * 3600)))
+REFRESH_TIMEOUT_MS = int(os.getenv('CONSTRUCTOR_KEY_REFRESH_TIMEOUT_MS', '20000'))
+RETRY_AFTER = 1800
+HEADLESS = os.getenv('CONSTRUCTOR_KEY_REFRESH_HEADLESS', '1').lower() not in ('0', 'false', 'no')
+PLAYWRIGHT_AVAILABLE = importlib.util.find_spec('playwright') is not None
+# Held by the one scheduler, among several processes, that may refresh
+SCHEDULE_LOCK = os.getenv('CONSTRUCTOR_KEY_REFRESH_LOCK') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.key_refresh_schedule.lock')
+# The current or most recent job of any process, next to constructor_keys.json
+JOB_FILE = os.getenv('CONSTRUCTOR_KEY_REFRESH_JOB_FILE') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'constructor_keys.refresh_job.json')
+_DONE_STATES = ('succeeded', 'partial', 'failed')
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _parse_ts(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, TypeError):
+        return True  # exists but not ours to signal, or no pid recorded
+    return True
+
+
+@contextmanager
+def _job_file_lock():
+    """Serialize read-check-write of JOB_FILE across worker processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(JOB_FILE + '.lock', 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _read_shared() -> Optional[Dict[str, Any]]:
+    """The job recorded in JOB_FILE; a running job whose process is gone reads as failed."""
+    try:
+        with open(JOB_FILE, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        job = dict(record['job'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if job.get('state') not in _DONE_STATES and not _alive(record.get('pid')):
+        job.update(state='failed', error='The worker running this refresh exited')
+    return job
+
+
+def _write_shared(job: Dict[str, Any]) -> None:
+    """Replace JOB_FILE via a temp file so readers never see a partial record."""
+    directory = os.path.dirname(JOB_FILE)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.refresh_job.', suffix='.tmp')
+    except OSError as e:
+        logger.warning(f"Could not record key refresh job: {e}")
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'job': job}, f)
+        os.replace(tmp, JOB_FILE)
+    except OSError as e:
+        logger.warning(f"Could not record key refresh job: {e}")
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+class KeyRefresher:
+    """Runs fetch_keys_once() on a worker thread and records the outcome."""
+
+    def __init__(self, save_keys: Callable[[Dict], Dict], status: Callable[[], Dict],
+                 get_keys: Optional[Callable[[str], Any]] = None):
+        self._save_keys = save_keys
+        self._status = status
+        self._get_keys = get_keys
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._job: Optional[Dict[str, Any]] = None
+        self._scheduler: Optional[threading.Thread] = None
+
+    def _after_fork(self):
+        # The child has none of the parent's threads: a job queued or running
+        # there would never finish here, and neither would the scheduler run.
+        # The lock may have been held by one of those threads at fork time.
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        if self._job and self._job['state'] not in _DONE_STATES:
+            self._job = None
+        self._scheduler = None
+
+    def job(self) -> Optional[Dict[str, Any]]:
+        """Copy of the current or most recent job of any process, None before the first."""
+        shared = _read_shared()
+        if shared is not None:
+            return shared
+        with self._lock:
+            return dict(self._job) if self._job else None
+
+    def start(self, headless: bool = HEADLESS, trigger: str = 'manual', cooldown: float = 0,
+              stale: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Queue a refresh, or return the running one (of this or another process).
+
+        With `cooldown`, a job that finished less than that many seconds ago
+        is returned instead of starting another. `stale` maps sites to keys
+        that were rejected: once the job holds the browser profile it skips
+        the capture if every one of them has been replaced meanwhile.
+        """
+        with self._lock, _job_file_lock():
+            if self._job and self._job['state'] not in _DONE_STATES:
+                return dict(self._job)
+            shared = _read_shared()
+            if shared and shared['state'] not in _DONE_STATES:
+                return shared
+            if cooldown:
+                last = shared or self._job
+                finished = _parse_ts(last.get('finished_at')) if last else None
+                if finished is not None and time.time() - finished < cooldown:
+                    return dict(last)
+            self._job = {
+                'id': uuid.uuid4().hex[:12],
+                'state': 'queued',
+                'trigger': trigger,
+                'headless': headless,
+                'queued_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+                'duration_ms': None,
+                'captured': [],
+                'missing': [],
+                'error': None,
+            }
+            job = dict(self._job)
+            _write_shared(job)
+        threading.Thread(target=self._run, args=(job['id'], headless, stale), name='key-refresh', daemon=True).start()
+        return job
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            if self._job and self._job['id'] == job_id:
+                self._job.update(fields)
+                with _job_file_lock():
+                    shared = _read_shared()
+                    if shared is None or shared['id'] == job_id:
+                        _write_shared(dict(self._job))
+                if fields.get('state') in _DONE_STATES:
+                    self._done.notify_all()
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Block until the job ends or `timeout` seconds pass; returns the job.
+
+        A job of this process wakes the caller as soon as it ends; another
+        process's job is polled through JOB_FILE.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.job()
+            remaining = deadline - time.monotonic()
+            if not job or job['id'] != job_id or job['state'] in _DONE_STATES or remaining <= 0:
+                return job
+            with self._done:
+                self._done.wait(min(remaining, 0.5))
+
+    def _replaced(self, stale: Dict[str, str]) -> bool:
+        """True when the key file no longer holds any of the rejected keys."""
+        if self._get_keys is None:
+            return False
+        for site, stale_key in stale.items():
+            key = self._get_keys(site)[0]
+            if not key or key == stale_key:
+                return False
+        return True
+
+    def _run(self, job_id: str, headless: bool, stale: Optional[Dict[str, str]] = None):
+        started = time.monotonic()
+        self._update(job_id, state='running', started_at=_now())
+        keys: Dict[str, Dict[str, Optional[str]]] = {}
+        error = None
+        try:
+            from refresh_api_keys import KeyRefreshError, fetch_keys_once
+            # Another process's refresh may have replaced the keys while this
+            # one waited for the browser profile
+            skip = (lambda: self._replaced(stale)) if stale else None
+            try:
+                keys = fetch_keys_once(headless=headless, timeout_ms=REFRESH_TIMEOUT_MS, skip=skip)
+            except KeyRefreshError as e:
+                keys, error = e.keys, str(e)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        captured = sorted(s for s, v in keys.items() if v.get('key'))
+        if captured:
+            try:
+                self._save_keys({s: keys[s] for s in captured})
+            except Exception as e:
+                error = f'Saving keys failed: {e}'
+                captured = []
+        missing = sorted(s for s, v in (self._status() or {}).items()
+                         if not (v.get('has_key') and v.get('has_clientlib')))
+        state = 'succeeded' if not error else ('partial' if captured else 'failed')
+        duration_ms = int((time.monotonic() - started) * 1000)
+        self._update(job_id, state=state, finished_at=_now(), duration_ms=duration_ms,
+                     captured=captured, missing=missing, error=error)
+        log = logger.info if state == 'succeeded' else logger.warning
+        log(f"Constructor key refresh {state} in {duration_ms} ms (captured: {captured or 'none'}"
+            f"{', error: ' + error if error else ''})")
+
+    def _due(self, interval: int) -> bool:
+        status = self._status() or {}
+        oldest = None
+        for entry in status.values():
+            ts = _parse_ts(entry.get('checked_at') or entry.get('updated_at'))
+            if ts is None:
+                return True
+            oldest = ts if oldest is None else min(oldest, ts)
+        return oldest is None or time.time() - oldest >= interval
+
+    def start_schedule(self, interval: int = REFRESH_INTERVAL, leader_lock: Optional[str] = None) -> bool:
+        """Start the periodic headless refresher once per process; False when disabled.
+
+        With `leader_lock`, only the process holding an exclusive lock on that
+        file refreshes. The others try to take it at every tick, so one of them
+        takes over when the holder exits.
+        """
+        if interval <= 0:
+            return False
+        with self._lock:
+            if self._scheduler is not None:
+                return True
+            self._scheduler = threading.Thread(target=self._schedule_loop, args=(interval, leader_lock),
+                                               name='key-refresh-scheduler', daemon=True)
+        self._scheduler.start()
+        logger.info(f"Constructor key refresh scheduled every {interval}s")
+        return True
+
+    @staticmethod
+    def _try_lead(path: str):
+        """The open lock file if this process now holds it, else None."""
+        lock = open(path, 'a')
+        if fcntl is None:
+            return lock
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        logger.info(f"Process {os.getpid()} now runs the scheduled key refreshes")
+        return lock
+
+    def _schedule_loop(self, interval: int, leader_lock: Optional[str] = None):
+        # Check every few minutes so a refresh done by another worker is noticed, but
+        # after a failed attempt wait RETRY_AFTER before launching a browser again
+        tick = min(interval, 300)
+        retry_after = min(interval, RETRY_AFTER)
+        last_attempt = None
+        lead = None  # kept open: the lock lasts as long as this process
+        while True:
+            try:
+                if leader_lock and lead is None:
+                    lead = self._try_lead(leader_lock)
+                if (not leader_lock or lead is not None) \
+                        and (last_attempt is None or time.monotonic() - last_attempt >= retry_after) and self._due(interval):
+                    last_attempt = time.monotonic()
+                    self.start(headless=True, trigger='scheduled')
+            except Exception as e:
+                logger.warning(f"Scheduled key refresh failed to start: {e}")
+            time.sleep(tick)
+
+
+try:
+    from constructor_keys import get_keys as _get_keys, save_keys as _save_keys, status as _status
+    refresher: Optional[KeyRefresher] = KeyRefresher(_save_keys, _status, _get_keys)
+except Exception:
+    refresher = None
+
+if refresher is not None and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=refresher._after_fork)
@@ -0,0 +1,435 @@
+"""Prometheus text-format metrics that add up across worker processes.
+
+Each process keeps its counters, gauges and histograms in memory. A daemon
+thread flushes them every FLUSH_SECONDS to METRICS_DIR/metrics-<pid>.json
+(temp file + os.replace). A scrape of /metrics in any worker writes its own
+fresh snapshot and merges every live process's file:
+
+  - counters and histograms are summed across processes
+  - gauges get a `pid` label, one series per process
+
+When a process exits (recycled, killed by the timeout, crashed), its
+counters and histograms are folded into METRICS_DIR/metrics-dead.json,
+either by the process itself at exit or by the next scrape that finds its
+pid gone. The summed series therefore never go down, which rate() would
+read as a reset. Its gauges are dropped. Another worker's numbers can lag
+by up to FLUSH_SECONDS.
+
+Unless METRICS_DIR is set, each server gets its own directory, keyed by
+the pid of the process that imports this module first. Under gunicorn
+that is the master (gunicorn.conf.py imports it in on_starting), and the
+forked workers inherit it, so two servers on one host never merge each
+other's numbers.
+
+No prometheus_client dependency. Usage:
+
+    REQUESTS = metrics.counter('upstream_requests_total', 'Requests.', ('upstream', 'outcome'))
+    REQUESTS.inc(upstream='wayfair', outcome='ok')
+"""
+import atexit
+import bisect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl  # POSIX only; without it two scrapes could fold the same dead process twice
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+_BASE_DIR = os.path.join(tempfile.gettempdir(), 'moodboard-metrics')
+METRICS_DIR = os.getenv('METRICS_DIR') or os.path.join(_BASE_DIR, str(os.getpid()))
+FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_metrics: Dict[str, '_Metric'] = {}
+_callbacks: List[Tuple['_Metric', Callable[[], Dict[Tuple[str, ...], float]]]] = []
+_flusher_started = False
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def snapshot(self) -> dict:
+        return {'kind': self.kind, 'help': self.help, 'labelnames': list(self.labelnames),
+                'values': [[list(k), v] for k, v in self._values.items()]}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _ensure_flusher()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+        _ensure_flusher()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            # per-bucket (non-cumulative) counts, +Inf last, then sum and count
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+        _ensure_flusher()
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def snapshot(self) -> dict:
+        out = super().snapshot()
+        out['buckets'] = list(self.buckets)
+        out['values'] = [[k, list(v)] for k, v in out['values']]
+        return out
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels):
+        self._histogram, self._labels = histogram, labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+        return False
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, help, labelnames))  # type: ignore[return-value]
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+
+def gauge_callback(name: str, help: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]):
+    """Gauge whose values come from fn() -> {label values tuple: value}, read at each snapshot."""
+    metric = gauge(name, help, labelnames)
+    with _lock:
+        _callbacks.append((metric, fn))
+    return metric
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux /proc; ru_maxrss peak elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if os.uname().sysname == 'Darwin' else peak * 1024
+        except Exception:
+            return None
+
+
+# -- per-process snapshots ---------------------------------------------------
+
+def _snapshot() -> dict:
+    for metric, fn in list(_callbacks):
+        try:
+            values = fn()
+        except Exception:
+            continue
+        with _lock:
+            metric._values = {tuple(str(x) for x in k): float(v) for k, v in values.items()}
+    rss = rss_bytes()
+    if rss is not None:
+        _PROCESS_RSS.set(rss)
+    with _lock:
+        return {'pid': os.getpid(), 'time': time.time(), 'metrics': {n: m.snapshot() for n, m in _metrics.items()}}
+
+
+def _path(pid) -> str:
+    return os.path.join(METRICS_DIR, f'metrics-{pid}.json')
+
+
+def _write(path: str, data: dict):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this process's snapshot for other workers' scrapes."""
+    data = _snapshot()
+    try:
+        _write(_path(data['pid']), data)
+    except OSError:
+        pass
+    return data
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _after_fork():
+    # A forked worker starts from zero and needs its own flusher thread. The lock
+    # may have been held by another thread of the parent at fork time.
+    global _flusher_started, _lock
+    _lock = threading.Lock()
+    _flusher_started = False
+    for metric in _metrics.values():
+        metric._values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+@contextmanager
+def _dir_lock():
+    """Serialize reading and folding of snapshots across worker processes."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _merge(merged: Dict[str, dict], snap: dict, gauges: bool = True):
+    """Add one snapshot's metrics into `merged`: counters and histograms summed,
+    gauges keyed by pid (or skipped with gauges=False)."""
+    pid = str(snap.get('pid'))
+    for name, m in (snap.get('metrics') or {}).items():
+        if m['kind'] == 'gauge' and not gauges:
+            continue
+        target = merged.setdefault(name, {**m, 'values': {}})
+        for labels, value in m['values']:
+            if m['kind'] == 'gauge':
+                target['values'][tuple(labels) + (pid,)] = value
+            elif m['kind'] == 'histogram':
+                prev = target['values'].get(tuple(labels))
+                target['values'][tuple(labels)] = value if prev is None else [a + b for a, b in zip(prev, value)]
+            else:
+                target['values'][tuple(labels)] = target['values'].get(tuple(labels), 0) + value
+
+
+def _load_dead() -> dict:
+    try:
+        with open(_path('dead')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'pid': 'dead', 'metrics': {}}
+
+
+def _fold(pid: int):
+    """Fold an exited process's counters and histograms into metrics-dead.json
+    and delete its snapshot. Called with _dir_lock() held, so each file is
+    folded once."""
+    path = _path(pid)
+    try:
+        with open(path) as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        snap = None  # gone, or torn/empty: nothing to keep
+    try:
+        if snap:
+            merged: Dict[str, dict] = {}
+            _merge(merged, _load_dead(), gauges=False)
+            _merge(merged, snap, gauges=False)
+            for m in merged.values():
+                m['values'] = [[list(k), v] for k, v in m['values'].items()]
+            _write(_path('dead'), {'pid': 'dead', 'metrics': merged})
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+@atexit.register
+def _retire_own_snapshot():
+    if not os.path.exists(_path(os.getpid())):
+        return
+    # Final counts, so requests since the last flush are kept too
+    flush()
+    try:
+        with _dir_lock():
+            _fold(os.getpid())
+    except OSError:
+        pass
+
+
+def remove_snapshots():
+    """Delete every process's snapshot file; for a server master before it forks workers."""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith('metrics-') and name.endswith('.json'):
+            try:
+                os.unlink(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_directories():
+    """Delete the per-server default directories of servers that have exited."""
+    try:
+        names = os.listdir(_BASE_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.isdigit() and int(name) != os.getpid() and not _alive(int(name)):
+            shutil.rmtree(os.path.join(_BASE_DIR, name), ignore_errors=True)
+
+
+def _load_all() -> List[dict]:
+    own = flush()
+    out = [own]
+    try:
+        # Under the lock an exiting worker is never read both from its own
+        # snapshot and from the dead totals
+        with _dir_lock():
+            for name in os.listdir(METRICS_DIR):
+                if not (name.startswith('metrics-') and name.endswith('.json')):
+                    continue
+                try:
+                    pid = int(name[len('metrics-'):-len('.json')])
+                except ValueError:
+                    continue
+                if pid == own['pid']:
+                    continue
+                if not _alive(pid):
+                    _fold(pid)
+                    continue
+                try:
+                    with open(os.path.join(METRICS_DIR, name)) as f:
+                        out.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+            out.append(_load_dead())
+    except OSError:
+        pass
+    return out
+
+
+# -- exposition ----------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(str(v))}"' for n, v in pairs) + '}'
+
+
+def _num(v: float) -> str:
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+
+def render() -> str:
+    """All processes' metrics in the Prometheus text exposition format."""
+    merged: Dict[str, dict] = {}
+    for snap in _load_all():
+        _merge(merged, snap)
+    lines = []
+    for name in sorted(merged):
+        m = merged[name]
+        names = m['labelnames'] + (['pid'] if m['kind'] == 'gauge' else [])
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['kind']}")
+        for labels, value in sorted(m['values'].items()):
+            if m['kind'] != 'histogram':
+                lines.append(f"{name}{_labels(names, labels)} {_num(value)}")
+                continue
+            cumulative = 0
+            for le, n in zip(m['buckets'] + ['+Inf'], value[:-2]):
+                cumulative += n
+                le = le if isinstance(le, str) else _num(float(le))
+                lines.append(f"{name}_bucket{_labels(names, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_num(value[-2])}")
+            lines.append(f"{name}_count{_labels(names, labels)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+_PROCESS_RSS = gauge('process_resident_memory_bytes', 'Resident memory size in bytes.')
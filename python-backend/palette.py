@@ -0,0 +1,212 @@
+"""Dominant colours of product images.
+
+extract() downsamples an image to at most 64x64 and drops background
+pixels. With a cutout (RGBA output of /remove-background), background
+means alpha below 128. Otherwise it means pixels close to a uniform
+border colour, such as the white studio backdrops retailers use. The
+remaining pixels are clustered in CIELAB with mini-batch k-means, all in
+numpy. Palettes are cached per image URL in memory and in the product
+index database. A palette computed from a cutout is never replaced by
+one computed from the raw photo.
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    import product_index
+except Exception:
+    product_index = None  # type: ignore
+
+SAMPLE_SIZE = 64
+K = 5
+BATCH_SIZE = 256
+ITERATIONS = 30
+MIN_SHARE = 0.04  # clusters smaller than this are dropped from the palette
+# A border whose pixels deviate less than this (Lab units) is treated as backdrop
+BACKDROP_MAX_STD = 12.0
+BACKDROP_DISTANCE = 18.0
+# A colour filter matches a palette entry with at least this share within this ΔE
+FILTER_MIN_SHARE = 0.12
+FILTER_MAX_DELTA_E = 25.0
+CACHE_SIZE = 4096
+
+# Colour families accepted by the `color` filter, as reference sRGB values
+NAMED_COLORS = {
+    'black': (20, 20, 20), 'white': (245, 245, 242), 'gray': (128, 128, 128), 'beige': (215, 198, 170),
+    'brown': (110, 72, 45), 'tan': (190, 150, 105), 'red': (190, 35, 40), 'orange': (225, 120, 40),
+    'yellow': (230, 200, 60), 'green': (70, 130, 70), 'olive': (110, 115, 60), 'teal': (40, 125, 125),
+    'blue': (50, 95, 180), 'navy': (30, 40, 80), 'purple': (110, 60, 140), 'pink': (225, 150, 170),
+}
+
+
+def _srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(N, 3) uint8/float sRGB -> (N, 3) CIELAB (D65)."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193], [0.3576, 0.7152, 0.1192], [0.1805, 0.0722, 0.9505]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+_NAMES = list(NAMED_COLORS)
+_NAMED_LAB = _srgb_to_lab(np.array([NAMED_COLORS[n] for n in _NAMES]))
+
+
+def _foreground(img: Image.Image) -> np.ndarray:
+    """(N, 3) uint8 RGB of the pixels that belong to the product."""
+    img = img.copy()
+    img.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        px = np.asarray(img.convert('RGBA'))
+        return px[px[..., 3] >= 128][:, :3]
+    px = np.asarray(img.convert('RGB'))
+    border = np.concatenate([px[0], px[-1], px[:, 0], px[:, -1]])
+    border_lab = _srgb_to_lab(border)
+    flat = px.reshape(-1, 3)
+    if border_lab.std(axis=0).max() <= BACKDROP_MAX_STD:
+        backdrop = border_lab.mean(axis=0)
+        keep = np.linalg.norm(_srgb_to_lab(flat) - backdrop, axis=1) > BACKDROP_DISTANCE
+        if keep.mean() >= 0.05:  # don't erase products that match their backdrop
+            return flat[keep]
+    return flat
+
+
+def _kmeans(points: np.ndarray, k: int, rng: np.random.RandomState):
+    """Mini-batch k-means (Sculley 2010) with k-means++ seeding."""
+    centers = [points[rng.randint(len(points))]]
+    for _ in range(1, k):
+        d2 = np.min(((points[:, None, :] - np.array(centers)[None]) ** 2).sum(-1), axis=1)
+        total = d2.sum()
+        if total <= 0:
+            break
+        centers.append(points[rng.choice(len(points), p=d2 / total)])
+    centers = np.array(centers, dtype=np.float64)
+    counts = np.zeros(len(centers))
+    k = len(centers)
+    for _ in range(ITERATIONS):
+        batch = points[rng.randint(0, len(points), min(BATCH_SIZE, len(points)))]
+        nearest = np.argmin(((batch[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+        n = np.bincount(nearest, minlength=k)
+        sums = np.stack([np.bincount(nearest, weights=batch[:, d], minlength=k) for d in range(3)], axis=1)
+        hit = n > 0
+        counts[hit] += n[hit]
+        # Per-centre learning rate 1/count: each centre is the running mean of its points
+        step = (sums[hit] - n[hit, None] * centers[hit]) / counts[hit, None]
+        centers[hit] += step
+        if np.abs(step).max() < 0.5:
+            break
+    labels = np.argmin(((points[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+    return centers, np.bincount(labels, minlength=len(centers))
+
+
+def _lab_to_hex(lab: np.ndarray) -> str:
+    fy = (lab[0] + 16) / 116
+    f = np.array([fy + lab[1] / 500, fy, fy - lab[2] / 200])
+    xyz = np.where(f ** 3 > 216 / 24389, f ** 3, (116 * f - 16) / (24389 / 27)) * np.array([0.95047, 1.0, 1.08883])
+    lin = np.array([[3.2406, -1.5372, -0.4986], [-0.9689, 1.8758, 0.0415], [0.0557, -0.2040, 1.0570]]) @ xyz
+    srgb = np.where(lin > 0.0031308, 1.055 * np.clip(lin, 0, None) ** (1 / 2.4) - 0.055, 12.92 * lin)
+    r, g, b = (np.clip(srgb, 0, 1) * 255).round().astype(int)
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def extract(img: Image.Image, k: int = K) -> List[Dict[str, Any]]:
+    """[{'hex', 'name', 'share', 'lab'}] sorted by share, largest first."""
+    rgb = _foreground(img)
+    if len(rgb) == 0:
+        return []
+    lab = _srgb_to_lab(rgb)
+    centers, sizes = _kmeans(lab, min(k, len(lab)), np.random.RandomState(0))
+    total = sizes.sum()
+    palette = []
+    for center, size in zip(centers, sizes):
+        share = size / total
+        if share < MIN_SHARE:
+            continue
+        name = _NAMES[int(np.argmin(np.linalg.norm(_NAMED_LAB - center, axis=1)))]
+        palette.append({'hex': _lab_to_hex(center), 'name': name, 'share': round(float(share), 3),
+                        'lab': [round(float(v), 1) for v in center]})
+    palette.sort(key=lambda c: -c['share'])
+    return palette
+
+
+def _target_lab(color: str) -> Optional[np.ndarray]:
+    color = (color or '').strip().lower()
+    if color in NAMED_COLORS:
+        return _NAMED_LAB[_NAMES.index(color)]
+    hexval = color.lstrip('#')
+    if len(hexval) == 6:
+        try:
+            return _srgb_to_lab(np.array([[int(hexval[i:i + 2], 16) for i in (0, 2, 4)]]))[0]
+        except ValueError:
+            return None
+    return None
+
+
+def matches(palette: Optional[List[Dict[str, Any]]], color: str) -> bool:
+    """True when a large enough palette entry is near `color` (family name or #hex)."""
+    target = _target_lab(color)
+    if target is None or not palette:
+        return False
+    for c in palette:
+        if c['share'] < FILTER_MIN_SHARE:
+            continue
+        if c['name'] == color.strip().lower() or np.linalg.norm(np.array(c['lab']) - target) <= FILTER_MAX_DELTA_E:
+            return True
+    return False
+
+
+def valid_color(color: str) -> bool:
+    return _target_lab(color) is not None
+
+
+class PaletteCache:
+    """LRU in front of the persistent image_colors table."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._items: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._size = size
+
+    def _remember(self, image: str, palette, cutout: bool):
+        with self._lock:
+            self._items[image] = (palette, cutout)
+            self._items.move_to_end(image)
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+    def get_many(self, images: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        out, missing = {}, []
+        with self._lock:
+            for image in images:
+                hit = self._items.get(image)
+                if hit is not None:
+                    out[image] = hit[0]
+                else:
+                    missing.append(image)
+        if missing and product_index is not None:
+            for image, (colors, cutout) in product_index.image_colors(missing).items():
+                palette = json.loads(colors)
+                self._remember(image, palette, cutout)
+                out[image] = palette
+        return out
+
+    def put(self, image: str, palette: List[Dict[str, Any]], cutout: bool = False):
+        with self._lock:
+            hit = self._items.get(image)
+        if hit is not None and hit[1] and not cutout:
+            return
+        self._remember(image, palette, cutout)
+        if product_index is not None:
+            product_index.upsert_image_colors(image, json.dumps(palette), cutout)
+
+
+cache = PaletteCache()
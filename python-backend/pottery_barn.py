@@ -1,49 +1,37 @@
-import requests
-import json
 import csv
 from datetime import datetime
 from urllib.parse import quote_plus
 
-try:
-    from constructor_keys import get_keys as ctor_get_keys
-except Exception:
-    ctor_get_keys = None  # type: ignore
+import constructor_client
+import tracing
+
+API_BASE = constructor_client.api_base('pottery_barn')
 
 # Default fallbacks
 _DEFAULT_KEY = "key_w3v8XC1kGR9REv46"
 _DEFAULT_CLIENTLIB = "ciojs-client-2.66.0"
 
 
-def fetch_pottery_barn_data(query: str = "sofa", num_results: int = 20):
-    """Fetch data from Pottery Barn Constructor.io Search API for a given query."""
-    url = f"https://ac.cnstrc.com/search/{quote_plus(query)}"
-    # Pull overrides from store on every call
-    api_key = _DEFAULT_KEY
-    client_lib = _DEFAULT_CLIENTLIB
-    if 'ctor_get_keys' in globals() and ctor_get_keys:
-        try:
-            k, c = ctor_get_keys('pottery_barn', fallback_key=api_key, fallback_clientlib=client_lib)
-            api_key = k or api_key
-            client_lib = c or client_lib
-        except Exception:
-            pass
+def fetch_pottery_barn_data(query: str = "sofa", num_results: int = 20, filters=None):
+    """Fetch data from Pottery Barn Constructor.io Search API for a given query.
+
+    `filters` is an optional dict of extra query params (e.g. {"filters[price]": "0-200"}).
+    """
+    url = f"{API_BASE}/search/{quote_plus(query)}"
     params = {
-        "c": client_lib,
-        "key": api_key,
         "i": "f70eef75-549d-4dc0-98e1-5addb6c8c3cc",
         "s": "3",
         "offset": "0",
         "num_results_per_page": str(num_results),
     }
-    try:
-        response = requests.get(url, params=params, timeout=20)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data: {e}")
-        return None
+    if filters:
+        params.update(filters)
+    # Key/clientlib come from the store on every call; a rejected key triggers a refresh
+    return constructor_client.get_json('pottery_barn', url, params, _DEFAULT_KEY, _DEFAULT_CLIENTLIB,
+                                       label="Pottery Barn search")
 
 
+@tracing.traced('pottery_barn.extract')
 def extract_product_info(data):
     """Extract structured product information from API response"""
     products = []
@@ -0,0 +1,309 @@
+"""Local full-text index of products seen in search results.
+
+Every adapted result is upserted into a SQLite FTS5 table so repeated or
+related queries can be answered locally in milliseconds. Rows keep a
+first-seen/last-seen timestamp so callers can tell when the index is stale.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from product_record import PLACEHOLDER_IMAGE, PRICE_REGEX, Product
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('PRODUCT_INDEX_PATH') or os.path.join(os.path.dirname(__file__), 'product_index.db')
+# A query is answered locally only when it has at least this many hits...
+MIN_LOCAL_RESULTS = int(os.getenv('PRODUCT_INDEX_MIN_RESULTS', '12'))
+# ...and the freshest matching row was seen within this window
+STALE_AFTER_SECONDS = int(os.getenv('PRODUCT_INDEX_STALE_SECONDS', str(24 * 3600)))
+
+TOKEN_REGEX = re.compile(r'\w+', re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    price TEXT,
+    price_value REAL,
+    site TEXT,
+    image TEXT,
+    url TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_last_seen ON products(last_seen);
+CREATE INDEX IF NOT EXISTS products_image ON products(image);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    title, site, content='products', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts(rowid, title, site) VALUES (new.id, new.title, new.site);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, title, site) VALUES ('delete', old.id, old.title, old.site);
+END;
+CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE OF title, site ON products BEGIN
+    INSERT INTO products_fts(products_fts, rowid, title, site) VALUES ('delete', old.id, old.title, old.site);
+    INSERT INTO products_fts(rowid, title, site) VALUES (new.id, new.title, new.site);
+END;
+CREATE TABLE IF NOT EXISTS image_hashes (
+    image TEXT PRIMARY KEY,
+    phash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    computed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS image_colors (
+    image TEXT PRIMARY KEY,
+    colors TEXT NOT NULL,
+    cutout INTEGER NOT NULL DEFAULT 0,
+    computed_at REAL NOT NULL
+);
+"""
+
+_UPSERT = """
+INSERT INTO products (key, title, price, price_value, site, image, url, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    title = excluded.title,
+    price = excluded.price,
+    price_value = excluded.price_value,
+    site = excluded.site,
+    image = excluded.image,
+    url = excluded.url,
+    last_seen = excluded.last_seen
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Return this thread's connection, creating the schema on first use."""
+    global _initialized
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(DB_PATH, timeout=5)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(_SCHEMA)
+                _initialized = True
+    _local.conn = conn
+    return conn
+
+
+def _price_value(price) -> Optional[float]:
+    if price is None:
+        return None
+    if isinstance(price, (int, float)):
+        return float(price)
+    m = PRICE_REGEX.search(str(price))
+    if not m:
+        return None
+    try:
+        return float(m.group(1).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def _row_key(url: str, title: str, site: str) -> Optional[str]:
+    url = (url or '').strip()
+    if url:
+        return url
+    if not title:
+        return None
+    return f"{site or ''}:{title.lower()}"
+
+
+def _row_fields(it) -> Optional[Tuple[str, Optional[str], Optional[float], str, str, str]]:
+    """(title, price_text, price_value, site, image, url) for a Product or result dict."""
+    if isinstance(it, Product):
+        return it.title, it.price_label, it.price, it.site, it.image, it.url
+    if not isinstance(it, dict):
+        return None
+    price = it.get('price')
+    return (it.get('title') or '', price if isinstance(price, str) else None, _price_value(price),
+            it.get('site') or '', it.get('image') or '', it.get('url') or '')
+
+
+def upsert_products(items: Iterable[Any]) -> int:
+    """Insert or refresh Product records (or app-schema dicts). Returns rows written."""
+    now = time.time()
+    rows = []
+    for it in items or []:
+        fields = _row_fields(it)
+        if fields is None:
+            continue
+        title, price_text, price_value, site, image, url = fields
+        title = (title or '').strip()
+        key = _row_key(url, title, site)
+        if not title or not key:
+            continue
+        if image == PLACEHOLDER_IMAGE:
+            image = ''
+        if price_text == '$':
+            price_text = None
+        rows.append((key, title, price_text, price_value, site or '', image or '', url or '', now, now))
+    if not rows:
+        return 0
+    try:
+        conn = _connect()
+        with conn:
+            conn.executemany(_UPSERT, rows)
+    except sqlite3.Error as e:
+        logger.warning(f"Product index upsert failed: {e}")
+        return 0
+    return len(rows)
+
+
+def _fts_query(query: str) -> Optional[str]:
+    # Quote every token so user input can never be parsed as FTS5 syntax;
+    # the trailing * gives prefix matching ("sof" -> "sofa").
+    tokens = TOKEN_REGEX.findall((query or '').lower())
+    if not tokens:
+        return None
+    return ' AND '.join(f'"{t}"*' for t in tokens)
+
+
+def search(query: str, limit: int = 20, price_min=None, price_max=None) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+    """Full-text search the index.
+
+    Returns (rows, freshest_last_seen). Rows keep the raw index columns;
+    see to_result() for conversion into the app schema. Rows without a
+    numeric price pass any price filter, matching price_in_range().
+    """
+    match = _fts_query(query)
+    if not match:
+        return [], None
+    sql = [
+        'SELECT p.title, p.price, p.price_value, p.site, p.image, p.url, p.first_seen, p.last_seen',
+        'FROM products_fts JOIN products p ON p.id = products_fts.rowid',
+        'WHERE products_fts MATCH ?',
+    ]
+    params: List[Any] = [match]
+    if price_min is not None:
+        sql.append('AND (p.price_value IS NULL OR p.price_value >= ?)')
+        params.append(price_min)
+    if price_max is not None:
+        sql.append('AND (p.price_value IS NULL OR p.price_value <= ?)')
+        params.append(price_max)
+    sql.append('ORDER BY bm25(products_fts), p.last_seen DESC LIMIT ?')
+    params.append(int(limit))
+    try:
+        rows = [dict(r) for r in _connect().execute(' '.join(sql), params)]
+    except sqlite3.Error as e:
+        logger.warning(f"Product index search failed: {e}")
+        return [], None
+    freshest = max((r['last_seen'] for r in rows), default=None)
+    return rows, freshest
+
+
+def is_sufficient(rows: List[Dict[str, Any]], freshest: Optional[float], min_results: Optional[int] = None) -> bool:
+    """True when a local answer is neither thin nor stale."""
+    needed = MIN_LOCAL_RESULTS if min_results is None else min_results
+    if len(rows) < needed or freshest is None:
+        return False
+    return (time.time() - freshest) <= STALE_AFTER_SECONDS
+
+
+def to_result(row: Dict[str, Any], idx: int, category: str, style: str) -> Product:
+    price_value = row.get('price_value')
+    label = row.get('price') or (None if price_value is not None else '$')
+    return Product(f'local-{idx}', row.get('title') or '', price_value, label, row.get('site') or '',
+                   row.get('image') or PLACEHOLDER_IMAGE, row.get('url') or '', category or 'all', style or 'all')
+
+
+def _signed64(v: int) -> int:
+    # SQLite INTEGER is signed; hashes are stored bit-for-bit
+    return v - (1 << 64) if v >= (1 << 63) else v
+
+
+def upsert_image_hash(image: str, phash: int, dhash: int) -> bool:
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO image_hashes (image, phash, dhash, computed_at) VALUES (?, ?, ?, ?)',
+                         (image, _signed64(phash), _signed64(dhash), time.time()))
+    except sqlite3.Error as e:
+        logger.warning(f"Image hash upsert failed: {e}")
+        return False
+    return True
+
+
+def image_hashes() -> List[Tuple[str, int, int]]:
+    """All stored (image, phash, dhash) rows with hashes as unsigned ints."""
+    try:
+        rows = _connect().execute('SELECT image, phash, dhash FROM image_hashes').fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Image hash load failed: {e}")
+        return []
+    mask = (1 << 64) - 1
+    return [(r['image'], r['phash'] & mask, r['dhash'] & mask) for r in rows]
+
+
+def upsert_image_colors(image: str, colors_json: str, cutout: bool = False) -> bool:
+    """Store a palette; one computed from a cutout is never replaced by a non-cutout one."""
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO image_colors (image, colors, cutout, computed_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(image) DO UPDATE SET colors = excluded.colors, cutout = excluded.cutout, '
+                'computed_at = excluded.computed_at WHERE excluded.cutout >= image_colors.cutout',
+                (image, colors_json, int(bool(cutout)), time.time()))
+    except sqlite3.Error as e:
+        logger.warning(f"Image colors upsert failed: {e}")
+        return False
+    return True
+
+
+def image_colors(images: Iterable[str]) -> Dict[str, Tuple[str, bool]]:
+    """{image: (colors_json, from_cutout)} for the images that have a stored palette."""
+    images = list(images)
+    out: Dict[str, Tuple[str, bool]] = {}
+    try:
+        conn = _connect()
+        for i in range(0, len(images), 500):
+            chunk = images[i:i + 500]
+            sql = f'SELECT image, colors, cutout FROM image_colors WHERE image IN ({",".join("?" * len(chunk))})'
+            for row in conn.execute(sql, chunk):
+                out[row['image']] = (row['colors'], bool(row['cutout']))
+    except sqlite3.Error as e:
+        logger.warning(f"Image colors lookup failed: {e}")
+    return out
+
+
+def products_by_image(images: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Most recently seen product row for each image URL."""
+    images = list(images)
+    out: Dict[str, Dict[str, Any]] = {}
+    try:
+        conn = _connect()
+        for i in range(0, len(images), 500):
+            chunk = images[i:i + 500]
+            sql = ('SELECT title, price, price_value, site, image, url, first_seen, last_seen FROM products '
+                   f'WHERE image IN ({",".join("?" * len(chunk))}) ORDER BY last_seen')
+            for row in conn.execute(sql, chunk):
+                out[row['image']] = dict(row)
+    except sqlite3.Error as e:
+        logger.warning(f"Product lookup by image failed: {e}")
+    return out
+
+
+def stats() -> Dict[str, Any]:
+    try:
+        row = _connect().execute('SELECT COUNT(*) AS n, MIN(first_seen) AS oldest, MAX(last_seen) AS newest FROM products').fetchone()
+    except sqlite3.Error as e:
+        return {'error': str(e)}
+    return {'products': row['n'], 'oldest_first_seen': row['oldest'], 'newest_last_seen': row['newest'], 'path': DB_PATH}
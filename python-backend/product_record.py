@@ -0,0 +1,137 @@
+"""Compact product record shared by every search source.
+
+Retailer adapters, the HTML scrapers and the local index all produce
+Product instances. Prices are parsed once into a float (`price`); the
+retailer's own display text, when there is one, is kept in `price_label`.
+Records are turned into the public JSON schema only when the response is
+serialized (see to_dict()).
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+PRICE_REGEX = re.compile(r'\$\s*([0-9][0-9,]*\.?[0-9]{0,2})')
+
+# Shown when a record has neither a display label nor a numeric price
+MISSING_PRICE = 'N/A'
+PLACEHOLDER_IMAGE = '/window.svg'
+
+
+class Product:
+    __slots__ = ('id', 'title', 'price', 'price_label', 'site', 'image', 'url', 'category', 'style', 'offers', 'colors')
+
+    def __init__(self, id: str, title: str, price: Optional[float], price_label: Optional[str],
+                 site: str, image: str, url: str, category: str, style: str, offers=None, colors=None):
+        self.id = id
+        self.title = title
+        self.price = price
+        self.price_label = price_label
+        self.site = site
+        self.image = image
+        self.url = url
+        self.category = category
+        self.style = style
+        # Same product at other retailers (see dedupe.collapse)
+        self.offers: Optional[List['Product']] = offers
+        # Dominant image colours (see palette.extract), when computed
+        self.colors: Optional[List[Dict[str, Any]]] = colors
+
+    def display_price(self) -> str:
+        if self.price_label:
+            return self.price_label
+        if self.price is not None:
+            return f"${self.price:.2f}"
+        return MISSING_PRICE
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public result schema returned by /search-furniture."""
+        out = {
+            'id': self.id,
+            'title': self.title,
+            'price': self.display_price(),
+            'originalPrice': None,
+            'site': self.site,
+            'image': self.image,
+            'url': self.url,
+            'category': self.category,
+            'style': self.style,
+            'inStock': True,
+        }
+        if self.offers:
+            out['alternateOffers'] = [
+                {'site': o.site, 'price': o.display_price(), 'url': o.url, 'image': o.image}
+                for o in self.offers
+            ]
+        if self.colors is not None:
+            out['colors'] = [{'hex': c['hex'], 'name': c['name'], 'share': c['share']} for c in self.colors]
+        return out
+
+    def __repr__(self):
+        return f"Product({self.id!r}, {self.title!r}, {self.price!r})"
+
+
+def parse_price(raw) -> Tuple[Optional[float], Optional[str]]:
+    """Return (value, label) for a retailer price field.
+
+    The label is "$" plus the matched digits (commas kept), or the raw text
+    when it contains "$" but no parsable amount.
+    """
+    if raw is None:
+        return None, None
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        return float(raw), None
+    s = str(raw)
+    m = PRICE_REGEX.search(s)
+    if not m:
+        return None, (s if '$' in s else None)
+    digits = m.group(1)
+    try:
+        value = float(digits.replace(',', ''))
+    except ValueError:
+        value = None
+    return value, f"${digits}"
+
+
+def absolute_image(img, origin: Optional[str] = None) -> str:
+    if not isinstance(img, str):
+        return ''
+    if img.startswith('//'):
+        return 'https:' + img
+    if origin and img.startswith('/'):
+        return origin + img
+    return img
+
+
+def normalize_items(items: Iterable[Dict[str, Any]], id_prefix: str, site: str, category: str, style: str,
+                    image_origin: Optional[str] = None) -> List[Product]:
+    """Normalize raw retailer-module dicts (title, price, url, image) into records.
+
+    Items without a title are dropped; ids keep the 1-based position in the
+    raw list. An item with no usable price is labelled "$", as the adapters
+    always did.
+    """
+    records: List[Product] = []
+    if not isinstance(items, list):
+        return records
+    category = category or 'all'
+    style = style or 'all'
+    for i, it in enumerate(items):
+        if not isinstance(it, dict):
+            continue
+        title = (it.get('title') or '').strip()
+        if not title:
+            continue
+        value, label = parse_price(it.get('price'))
+        if image_origin:
+            img = absolute_image(it.get('image') or '', image_origin)
+        else:
+            img = it.get('image') or ''
+        if value is None and not label:
+            label = '$'
+        records.append(Product(f'{id_prefix}-{i+1}', title, value, label, site,
+                               img or PLACEHOLDER_IMAGE, it.get('url') or '', category, style))
+    return records
+
+
+def serialize(records: Iterable[Any]) -> List[Dict[str, Any]]:
+    """to_dict() every Product; plain dicts pass through unchanged."""
+    return [r.to_dict() if isinstance(r, Product) else r for r in records]
@@ -0,0 +1,105 @@
+"""Deterministic relevance ranking for aggregated search results.
+
+Scores each Product title against the query with BM25, using the
+candidate set of the request as the corpus. Top slots are then spread
+across retailers, and ties fall back to each retailer's own order, so the
+same inputs always give the same top-N.
+"""
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import tracing
+from product_record import Product
+
+TOKEN_REGEX = re.compile(r'[a-z0-9]+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# At most this share of the returned slots goes to one retailer while other
+# retailers still have candidates left
+MAX_SITE_SHARE = float(os.getenv('RANK_MAX_SITE_SHARE', '0.5'))
+
+# Tokenized titles are reused across requests: the same products come back
+# for related queries and every page refresh
+TOKEN_CACHE_SIZE = int(os.getenv('RANK_TOKEN_CACHE_SIZE', '8192'))
+
+
+def _stem(tok: str) -> str:
+    # Plural folding only ("sofas" -> "sofa", "benches" -> "bench")
+    if len(tok) > 4 and tok.endswith('es') and tok[-3] in 'sxz':
+        return tok[:-2]
+    if len(tok) > 3 and tok.endswith('s') and not tok.endswith('ss'):
+        return tok[:-1]
+    return tok
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def tokenize(text: str) -> Tuple[str, ...]:
+    return tuple(_stem(t) for t in TOKEN_REGEX.findall(text.lower()))
+
+
+def bm25_scores(query: str, docs: Sequence[Tuple[str, ...]]) -> List[float]:
+    """BM25 score of every tokenized doc against the query (docs are the corpus)."""
+    n = len(docs)
+    if not n:
+        return []
+    terms = set(tokenize(query or ''))
+    if not terms:
+        return [0.0] * n
+    avgdl = (sum(len(d) for d in docs) / n) or 1.0
+    df: Dict[str, int] = dict.fromkeys(terms, 0)
+    for d in docs:
+        for t in terms.intersection(d):
+            df[t] += 1
+    idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items() if c}
+    scores = []
+    for d in docs:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(d) / avgdl)
+        s = 0.0
+        for t, w in idf.items():
+            tf = d.count(t)
+            if tf:
+                s += w * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(s)
+    return scores
+
+
+@tracing.traced('ranking.rank')
+def rank(records: List[Product], query: str, limit: int = 20) -> List[Product]:
+    """Return the best `limit` records by BM25 with per-site diversity.
+
+    `records` must be in retailer order (each site's own ranking); that
+    order breaks score ties.
+    """
+    if not records:
+        return []
+    scores = bm25_scores(query, [tokenize(r.title) for r in records])
+    # Position within its own site keeps retailers' relevance as a tiebreak
+    seen: Dict[str, int] = {}
+    site_pos = []
+    for r in records:
+        site_pos.append(seen.get(r.site, 0))
+        seen[r.site] = site_pos[-1] + 1
+    order = sorted(range(len(records)), key=lambda i: (-scores[i], site_pos[i], records[i].site or '', i))
+
+    cap = max(1, math.ceil(limit * MAX_SITE_SHARE)) if len(seen) > 1 else limit
+    taken: Dict[str, int] = {}
+    picked: List[int] = []
+    deferred: List[int] = []
+    for i in order:
+        site = records[i].site
+        if taken.get(site, 0) < cap:
+            taken[site] = taken.get(site, 0) + 1
+            picked.append(i)
+            if len(picked) == limit:
+                break
+        else:
+            deferred.append(i)
+    # Other sites ran out: fill the remaining slots from capped ones
+    picked.extend(deferred[:limit - len(picked)])
+    position = {i: k for k, i in enumerate(order)}
+    picked.sort(key=position.__getitem__)
+    return [records[i] for i in picked]
@@ -1,11 +1,13 @@
-import requests
 import csv
 import uuid
 import time
 import json
 from urllib.parse import quote_plus
 
-API_BASE = "https://ac.cnstrc.com"
+import constructor_client
+import tracing
+
+API_BASE = constructor_client.api_base('raymour_flanigan')
 API_KEY = "key_1tigFZoUEs7Ygkww"
 CLIENT_LIB = "cio-ui-autocomplete-1.23.27"
 ORIGIN = "https://www.raymourflanigan.com"
@@ -17,6 +19,11 @@ try:
 except Exception:
     ctor_get_keys = None  # type: ignore
 
+try:
+    from fast_json import loads as json_loads
+except Exception:
+    json_loads = json.loads
+
 # Optionally override module-level defaults at import time
 if 'ctor_get_keys' in globals() and ctor_get_keys:
     try:
@@ -39,7 +46,7 @@ HEADERS = {
 def _parse_json_field(val):
     try:
         if isinstance(val, str) and val.strip().startswith("{"):
-            return json.loads(val)
+            return json_loads(val)
     except Exception:
         return None
     return None
@@ -110,29 +117,17 @@ def _derive_title(item, data_obj):
     return title
 
 
-def fetch_raymour_flanigan_autocomplete(query="rug", num_suggestions=0, num_products=12, client_id=None, session="1"):
+def fetch_raymour_flanigan_autocomplete(query="rug", num_suggestions=0, num_products=12, client_id=None, session="1", filters=None):
     """Call Raymour & Flanigan (Constructor.io) autocomplete API for a query.
 
     Set num_products>0 to also retrieve product hits alongside suggestions.
+    `filters` is an optional dict of extra query params (e.g. {"filters[price]": "0-200"}).
     """
     if not client_id:
         client_id = str(uuid.uuid4())
 
-    # NEW: get latest key/clientlib from store each call
-    api_key = API_KEY
-    client_lib = CLIENT_LIB
-    if 'ctor_get_keys' in globals() and ctor_get_keys:
-        try:
-            k, c = ctor_get_keys('raymour_flanigan', fallback_key=api_key, fallback_clientlib=client_lib)
-            api_key = k or api_key
-            client_lib = c or client_lib
-        except Exception:
-            pass
-
     url = f"{API_BASE}/autocomplete/{quote_plus(query)}"
     params = {
-        "c": client_lib,
-        "key": api_key,
         "i": client_id,
         "s": str(session),
         # Note: the API expects this exact key with a space in it; requests will encode it properly.
@@ -140,16 +135,15 @@ def fetch_raymour_flanigan_autocomplete(query="rug", num_suggestions=0, num_prod
         "num_results_Search Suggestions": str(num_suggestions),
         "_dt": str(int(time.time() * 1000)),
     }
+    if filters:
+        params.update(filters)
 
-    try:
-        resp = requests.get(url, headers=HEADERS, params=params, timeout=20)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
-        print(f"Error fetching Raymour & Flanigan autocomplete: {e}")
-        return None
+    # Key/clientlib come from the persistent store on each call; a rejected key triggers a refresh
+    return constructor_client.get_json('raymour_flanigan', url, params, API_KEY, CLIENT_LIB,
+                                       headers=HEADERS, label="Raymour & Flanigan autocomplete")
 
 
+@tracing.traced('raymour_flanigan.extract')
 def extract_results(data, fallback_query="", include_suggestions=False):
     """Extract a flat list of products (and optional suggestions) from autocomplete payload.
 
@@ -208,45 +202,32 @@ def extract_results(data, fallback_query="", include_suggestions=False):
     return results
 
 
-def fetch_raymour_flanigan_search(query="rug", num_results_per_page=24, page=1, client_id=None, session="1"):
+def fetch_raymour_flanigan_search(query="rug", num_results_per_page=24, page=1, client_id=None, session="1", filters=None):
     """Call Raymour & Flanigan (Constructor.io) full search API for a query.
 
     The search endpoint typically contains price fields, unlike autocomplete.
+    `filters` is an optional dict of extra query params, as for autocomplete.
     """
     if not client_id:
         client_id = str(uuid.uuid4())
 
-    # NEW: get latest key/clientlib from store each call
-    api_key = API_KEY
-    client_lib = CLIENT_LIB
-    if 'ctor_get_keys' in globals() and ctor_get_keys:
-        try:
-            k, c = ctor_get_keys('raymour_flanigan', fallback_key=api_key, fallback_clientlib=client_lib)
-            api_key = k or api_key
-            client_lib = c or client_lib
-        except Exception:
-            pass
-
     url = f"{API_BASE}/search/{quote_plus(query)}"
     params = {
-        "c": client_lib,
-        "key": api_key,
         "i": client_id,
         "s": str(session),
         "num_results_per_page": str(num_results_per_page),
         "page": str(page),
         "_dt": str(int(time.time() * 1000)),
     }
+    if filters:
+        params.update(filters)
 
-    try:
-        resp = requests.get(url, headers=HEADERS, params=params, timeout=20)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
-        print(f"Error fetching Raymour & Flanigan search: {e}")
-        return None
+    # Key/clientlib come from the persistent store on each call; a rejected key triggers a refresh
+    return constructor_client.get_json('raymour_flanigan', url, params, API_KEY, CLIENT_LIB,
+                                       headers=HEADERS, label="Raymour & Flanigan search")
 
 
+@tracing.traced('raymour_flanigan.extract')
 def extract_results_from_search(data):
     """Extract products from the full search payload with price when available."""
     rows = []
@@ -1,6 +1,60 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
 from playwright.sync_api import sync_playwright
+
+try:
+    import fcntl  # POSIX only; elsewhere concurrent refreshes are not serialized
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
 from urllib.parse import urlparse, parse_qs
 
+# site -> (label, search page that fires a Constructor.io autocomplete request, host)
+SITES = {
+    "west_elm": ("West Elm", "https://www.westelm.com/search/results.html?words=rug", "westelm.com"),
+    "pottery_barn": ("Pottery Barn", "https://www.potterybarn.com/search/results.html?words=rug", "potterybarn.com"),
+    "raymour_flanigan": ("Raymour & Flanigan", "https://www.raymourflanigan.com/search?page=1&redirectQuery=rug&sort=", "raymourflanigan.com"),
+}
+
+# Browser profile reused between refreshes: cookies and cache make later runs faster
+# and look less like a fresh bot session
+PROFILE_DIR = os.getenv("PLAYWRIGHT_PROFILE_DIR") or os.path.join(os.path.dirname(__file__), ".playwright_profile")
+
+
+
+@contextmanager
+def _profile_lock(profile_dir):
+    """Hold an exclusive lock on the profile while a browser uses it.
+
+    Chromium refuses to open a profile another process has open. Refreshes
+    started by several workers or scripts at once take turns instead of
+    failing on the profile lock.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.abspath(profile_dir).rstrip(os.sep) + ".lock", "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+
+# Nothing in these is needed to make the page fire its autocomplete request
+_BLOCKED_RESOURCES = {"image", "media", "font"}
+
+
+class KeyRefreshError(RuntimeError):
+    """Raised when some sites' keys were not captured; .keys holds what was."""
+
+    def __init__(self, message, keys):
+        super().__init__(message)
+        self.keys = keys
+
 
 def extract_key_and_clientlib_from_request(url):
     parsed = urlparse(url)
@@ -10,7 +64,8 @@ def extract_key_and_clientlib_from_request(url):
     return key, clientlib
 
 
-def fetch_keys_once(headless: bool = True, wait_ms: int = 3000):
+def fetch_keys_once(headless: bool = True, timeout_ms: int = 20000, profile_dir: str = PROFILE_DIR,
+                    skip: Optional[Callable[[], bool]] = None):
     """Capture Constructor.io API key and clientlib for supported sites in one run.
 
     Returns a dict of the form { site: { key, clientlib } } for:
@@ -18,78 +73,90 @@ def fetch_keys_once(headless: bool = True, wait_ms: int = 3000):
       - pottery_barn
       - raymour_flanigan
 
+    All three search pages load in parallel tabs of one persistent browser
+    context, and each tab is closed as soon as its ac.cnstrc.com request is
+    seen. Returns as soon as every key is captured, or raises
+    KeyRefreshError (carrying the partial keys) after timeout_ms.
+
     headless: run browser headless (default True)
-    wait_ms: delay after navigation to allow requests to fire
+    timeout_ms: overall deadline for capturing all keys
+    profile_dir: persistent browser profile directory
+    skip: checked once the profile lock is held; when it returns True the
+          browser is not started and {} is returned (e.g. another process's
+          refresh, which held the lock, already replaced the rejected key)
     """
-    with sync_playwright() as p:
-        # Always pass window position args; they are ignored in headless mode
-        browser = p.chromium.launch(headless=headless, args=["--window-position=-10000,0"]) 
-        try:
-            page = browser.new_page()
-            # basic stealth: hide webdriver flag and use a common UA
-            page.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined});")
-            page.set_extra_http_headers({
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
-            })
-
-            keys = {
-                "west_elm": {"key": None, "clientlib": None},
-                "pottery_barn": {"key": None, "clientlib": None},
-                "raymour_flanigan": {"key": None, "clientlib": None},
-            }
-
-            def handle_request(request):
-                url = request.url
-                referer = request.headers.get("referer", "")
-                if "ac.cnstrc.com/" in url:
-                    key, clientlib = extract_key_and_clientlib_from_request(url)
-
-                    if ("westelm.com" in referer) or ("westelm.com" in url):
-                        if not keys["west_elm"]["key"] and key:
-                            keys["west_elm"]["key"] = key
-                            keys["west_elm"]["clientlib"] = clientlib
-                            print(f"Captured West Elm key: {key}, client lib: {clientlib}")
-
-                    elif ("potterybarn.com" in referer) or ("potterybarn.com" in url):
-                        if not keys["pottery_barn"]["key"] and key:
-                            keys["pottery_barn"]["key"] = key
-                            keys["pottery_barn"]["clientlib"] = clientlib
-                            print(f"Captured Pottery Barn key: {key}, client lib: {clientlib}")
-
-                    elif ("raymourflanigan.com" in referer) or ("raymourflanigan.com" in url):
-                        if not keys["raymour_flanigan"]["key"] and key:
-                            keys["raymour_flanigan"]["key"] = key
-                            keys["raymour_flanigan"]["clientlib"] = clientlib
-                            print(f"Captured Raymour & Flanigan key: {key}, client lib: {clientlib}")
-
-            page.on("request", handle_request)
-
-            # Visit West Elm search page to trigger autocomplete request
-            page.goto("https://www.westelm.com/search/results.html?words=rug")
-            page.wait_for_timeout(wait_ms)
-
-            # Visit Pottery Barn search page to trigger autocomplete request
-            page.goto("https://www.potterybarn.com/search/results.html?words=rug")
-            page.wait_for_timeout(wait_ms)
-
-            # Visit Raymour & Flanigan search page to trigger autocomplete request
-            page.goto("https://www.raymourflanigan.com/search?page=1&redirectQuery=rug&sort=")
-            page.wait_for_timeout(wait_ms)
-        finally:
-            browser.close()
-
-        # Verify we got all keys, else raise
-        if not keys["west_elm"]["key"] or not keys["pottery_barn"]["key"] or not keys["raymour_flanigan"]["key"]:
-            missing = []
-            if not keys["west_elm"]["key"]:
-                missing.append("West Elm")
-            if not keys["pottery_barn"]["key"]:
-                missing.append("Pottery Barn")
-            if not keys["raymour_flanigan"]["key"]:
-                missing.append("Raymour & Flanigan")
-            raise RuntimeError(f"Failed to extract keys for: {', '.join(missing)}")
-
-        return keys
+    keys = {site: {"key": None, "clientlib": None} for site in SITES}
+
+    def handle_request(request):
+        url = request.url
+        if "ac.cnstrc.com/" not in url:
+            return
+        referer = request.headers.get("referer", "")
+        key, clientlib = extract_key_and_clientlib_from_request(url)
+        if not key:
+            return
+        for site, (label, _, host) in SITES.items():
+            if (host in referer) or (host in url):
+                if not keys[site]["key"]:
+                    keys[site]["key"] = key
+                    keys[site]["clientlib"] = clientlib
+                    print(f"Captured {label} key: {key}, client lib: {clientlib}")
+                break
+
+    def route_request(route):
+        if route.request.resource_type in _BLOCKED_RESOURCES:
+            route.abort()
+        else:
+            route.continue_()
+
+    # Waiting for another refresh's browser doesn't count against timeout_ms
+    with _profile_lock(profile_dir):
+        if skip is not None and skip():
+            print("Keys were refreshed while waiting for the browser profile; skipping capture")
+            return {}
+        started = time.monotonic()
+        with sync_playwright() as p:
+            # Always pass window position args; they are ignored in headless mode
+            context = p.chromium.launch_persistent_context(
+                profile_dir,
+                headless=headless,
+                args=["--window-position=-10000,0"],
+                user_agent=USER_AGENT,
+            )
+            try:
+                # basic stealth: hide webdriver flag
+                context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined});")
+                context.route("**/*", route_request)
+                context.on("request", handle_request)
+
+                pages = {}
+                for site, (_, url, _) in SITES.items():
+                    page = context.new_page()
+                    try:
+                        # "commit" returns once navigation starts, so the three pages load concurrently
+                        page.goto(url, wait_until="commit", timeout=timeout_ms)
+                    except Exception as e:
+                        print(f"Navigation to {url} failed: {e}")
+                        page.close()
+                        continue
+                    pages[site] = page
+
+                deadline = started + timeout_ms / 1000.0
+                while time.monotonic() < deadline:
+                    for site in [s for s in pages if keys[s]["key"]]:
+                        pages.pop(site).close()
+                    if not pages:
+                        break
+                    # Yields to Playwright's event loop so request events are dispatched
+                    next(iter(pages.values())).wait_for_timeout(100)
+            finally:
+                context.close()
+
+    print(f"Key refresh finished in {time.monotonic() - started:.1f}s")
+    missing = [SITES[s][0] for s, v in keys.items() if not v["key"]]
+    if missing:
+        raise KeyRefreshError(f"Failed to extract keys for: {', '.join(missing)}", keys)
+    return keys
 
 
 # Example usage: fetch once, then reuse
@@ -0,0 +1,341 @@
+"""Record retailer responses and replay them from a local stand-in server.
+
+The server answers under one path prefix per upstream. Each prefix maps to
+the real origin it stands in for (ROUTES):
+
+    /wayfair/keyword.php?keyword=sofa      -> https://www.wayfair.com/keyword.php?keyword=sofa
+    /west_elm_api/autocomplete/sofa?...    -> https://ac.cnstrc.com/autocomplete/sofa?...
+    /image/assets.pbimgs.com/x.jpg         -> https://assets.pbimgs.com/x.jpg
+
+Point the backend at it with the base-URL overrides that the retailer
+modules read (WAYFAIR_BASE_URL, WEST_ELM_API_BASE_URL, SERPAPI_BASE_URL,
+IMAGE_FETCH_BASE_URL, ...). `--print-env` prints them for the chosen port.
+
+    python replay.py --record          # proxy to the real sites, saving every response
+    python replay.py                   # replay saved responses only; misses are 404
+    python replay.py --latency '*=recorded' --errors 'wayfair=0.1:503'
+
+Fixtures live in FIXTURES_DIR/<prefix>/<hash>.json (request, status,
+content type, upstream latency) next to <hash>.body. The hash covers the
+method, path and query string. Volatile parameters (VOLATILE_PARAMS:
+client IDs, timestamps, API keys) are left out, so a replay matches
+whatever key or session the backend currently sends.
+
+Injection is set per prefix, with '*' as the default:
+  --latency PREFIX=MS[:JITTER_MS]   sleep MS ± JITTER_MS before answering
+  --latency PREFIX=recorded         sleep the upstream latency measured at record time
+  --errors PREFIX=RATE[:STATUS]     answer STATUS (default 503) to this fraction of requests
+  --errors PREFIX=RATE:timeout      hold this fraction of requests for TIMEOUT_HOLD seconds
+
+GET /_replay/stats returns hits, misses, injected errors and recordings per prefix.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+FIXTURES_DIR = os.getenv('REPLAY_FIXTURES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'replay'))
+
+# prefix -> real origin (None: the host is the first path segment after the prefix)
+ROUTES: Dict[str, Optional[str]] = {
+    'wayfair': 'https://www.wayfair.com',
+    'ikea': 'https://www.ikea.com',
+    'westelm': 'https://www.westelm.com',
+    'west_elm_api': 'https://ac.cnstrc.com',
+    'pottery_barn_api': 'https://ac.cnstrc.com',
+    'raymour_flanigan_api': 'https://ac.cnstrc.com',
+    'serpapi': 'https://serpapi.com',
+    'image': None,
+}
+
+# Backend setting for each prefix, for --print-env
+ENV_VARS = {
+    'wayfair': 'WAYFAIR_BASE_URL',
+    'ikea': 'IKEA_BASE_URL',
+    'westelm': 'WESTELM_BASE_URL',
+    'west_elm_api': 'WEST_ELM_API_BASE_URL',
+    'pottery_barn_api': 'POTTERY_BARN_API_BASE_URL',
+    'raymour_flanigan_api': 'RAYMOUR_FLANIGAN_API_BASE_URL',
+    'serpapi': 'SERPAPI_BASE_URL',
+    'image': 'IMAGE_FETCH_BASE_URL',
+}
+
+VOLATILE_PARAMS = frozenset({'i', 's', '_dt', 'key', 'c', 'api_key'})
+# Request headers passed on when recording; the rest (cookies, Host, encodings) are not
+FORWARD_HEADERS = ('User-Agent', 'Accept', 'Accept-Language', 'Referer', 'Origin')
+TIMEOUT_HOLD = 30.0
+
+
+def fixture_key(method: str, path: str, query: str) -> str:
+    params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in VOLATILE_PARAMS)
+    return hashlib.sha1(f'{method.upper()} {path}?{urlencode(params)}'.encode('utf-8')).hexdigest()[:20]
+
+
+class FixtureStore:
+    """Saved responses on disk, cached in memory after the first read."""
+
+    def __init__(self, root: str = FIXTURES_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple[str, str], Optional[Tuple[Dict[str, Any], bytes]]] = {}
+
+    def _paths(self, prefix: str, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, prefix, key)
+        return base + '.json', base + '.body'
+
+    def get(self, prefix: str, method: str, path: str, query: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        key = fixture_key(method, path, query)
+        with self._lock:
+            if (prefix, key) in self._cache:
+                return self._cache[(prefix, key)]
+        meta_path, body_path = self._paths(prefix, key)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                entry = (meta, f.read())
+        except (OSError, ValueError):
+            entry = None
+        with self._lock:
+            self._cache[(prefix, key)] = entry
+        return entry
+
+    def put(self, prefix: str, method: str, path: str, query: str, status: int, content_type: str,
+            body: bytes, elapsed_ms: Optional[float] = None) -> str:
+        key = fixture_key(method, path, query)
+        meta_path, body_path = self._paths(prefix, key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            'request': {'method': method.upper(), 'path': path,
+                        'query': [[k, v] for k, v in parse_qsl(query, keep_blank_values=True) if k not in VOLATILE_PARAMS]},
+            'status': status,
+            'content_type': content_type,
+            'elapsed_ms': None if elapsed_ms is None else round(elapsed_ms, 1),
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        with open(body_path, 'wb') as f:
+            f.write(body)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        with self._lock:
+            self._cache[(prefix, key)] = (meta, body)
+        return key
+
+
+def _parse_rules(specs, parse) -> Dict[str, Any]:
+    rules = {}
+    for spec in specs or ():
+        for part in filter(None, (p.strip() for p in spec.split(','))):
+            prefix, _, value = part.partition('=')
+            rules[prefix.strip() or '*'] = parse(value.strip())
+    return rules
+
+
+def _parse_latency(value: str):
+    if value == 'recorded':
+        return 'recorded'
+    ms, _, jitter = value.partition(':')
+    return float(ms), float(jitter or 0)
+
+
+def _parse_error(value: str):
+    rate, _, status = value.partition(':')
+    return float(rate), (status if status == 'timeout' else int(status or 503))
+
+
+class ReplayServer:
+    """Threaded stand-in server; start() returns its base URL."""
+
+    def __init__(self, store: Optional[FixtureStore] = None, host: str = '127.0.0.1', port: int = 0,
+                 record: bool = False, latency: Optional[Dict[str, Any]] = None,
+                 errors: Optional[Dict[str, Any]] = None, seed: Optional[int] = None):
+        self.store = store or FixtureStore()
+        self.record = record
+        self.latency = latency or {}
+        self.errors = errors or {}
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._http = requests.Session()
+        self._conns = set()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def env(self) -> Dict[str, str]:
+        """Backend settings that route every retailer module to this server."""
+        out = {var: f'{self.base_url}/{prefix}' for prefix, var in ENV_VARS.items()}
+        # Every upstream now shares one host; don't let the politeness limits for it throttle the replay
+        out['UPSTREAM_HOST_LIMITS'] = f'{urlsplit(self.base_url).hostname}=10000/10000/256'
+        return out
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='replay-server', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        # Keep-alive connections would otherwise go on being served by this instance
+        with self._stats_lock:
+            conns = list(self._conns)
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {}
+
+    def _count(self, prefix: str, field: str):
+        with self._stats_lock:
+            entry = self.stats.setdefault(prefix, {'hits': 0, 'misses': 0, 'injected_errors': 0, 'recorded': 0})
+            entry[field] += 1
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _delay(self, prefix: str, meta: Optional[Dict[str, Any]]) -> float:
+        rule = self.latency.get(prefix, self.latency.get('*'))
+        if rule is None:
+            return 0.0
+        if rule == 'recorded':
+            return ((meta or {}).get('elapsed_ms') or 0) / 1000
+        ms, jitter = rule
+        return max(0.0, ms + (self._random() * 2 - 1) * jitter) / 1000
+
+    def _fetch(self, prefix: str, rest: str, query: str, headers) -> Tuple[int, str, bytes, float]:
+        origin = ROUTES[prefix]
+        if origin is None:
+            host, _, path = rest.lstrip('/').partition('/')
+            url = f'https://{host}/{path}'
+        else:
+            url = origin + rest
+        if query:
+            url += '?' + query
+        fwd = {h: headers[h] for h in FORWARD_HEADERS if headers.get(h)}
+        started = time.perf_counter()
+        resp = self._http.get(url, headers=fwd, timeout=30)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return resp.status_code, resp.headers.get('Content-Type', ''), resp.content, elapsed_ms
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, fmt, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._stats_lock:
+                    server._conns.add(self.connection)
+
+            def finish(self):
+                with server._stats_lock:
+                    server._conns.discard(self.connection)
+                super().finish()
+
+            def _send(self, status: int, content_type: str, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type or 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == '/_replay/stats':
+                    with server._stats_lock:
+                        body = json.dumps(server.stats).encode()
+                    return self._send(200, 'application/json', body)
+                prefix, _, rest = parts.path.lstrip('/').partition('/')
+                if prefix not in ROUTES:
+                    return self._send(404, 'application/json', b'{"error": "unknown upstream prefix"}')
+                rest = '/' + rest
+                error = server.errors.get(prefix, server.errors.get('*'))
+                if error is not None and server._random() < error[0]:
+                    server._count(prefix, 'injected_errors')
+                    if error[1] == 'timeout':
+                        time.sleep(TIMEOUT_HOLD)
+                        return self._send(504, 'text/plain', b'injected timeout')
+                    return self._send(error[1], 'text/plain', b'injected error')
+                entry = server.store.get(prefix, 'GET', rest, parts.query)
+                if entry is None and server.record:
+                    try:
+                        status, content_type, body, elapsed_ms = server._fetch(prefix, rest, parts.query, self.headers)
+                    except requests.RequestException as e:
+                        return self._send(502, 'text/plain', f'record failed: {e}'.encode())
+                    server.store.put(prefix, 'GET', rest, parts.query, status, content_type, body, elapsed_ms)
+                    server._count(prefix, 'recorded')
+                    return self._send(status, content_type, body)
+                if entry is None:
+                    server._count(prefix, 'misses')
+                    return self._send(404, 'application/json', b'{"error": "no fixture recorded for this request"}')
+                meta, body = entry
+                server._count(prefix, 'hits')
+                delay = server._delay(prefix, meta)
+                if delay:
+                    time.sleep(delay)
+                self._send(meta.get('status', 200), meta.get('content_type', ''), body)
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=int(os.getenv('REPLAY_PORT', '8765')))
+    ap.add_argument('--fixtures', default=FIXTURES_DIR)
+    ap.add_argument('--record', action='store_true', help='fetch and save responses that have no fixture yet')
+    ap.add_argument('--latency', action='append', help='PREFIX=MS[:JITTER] or PREFIX=recorded (repeatable)')
+    ap.add_argument('--errors', action='append', help='PREFIX=RATE[:STATUS|timeout] (repeatable)')
+    ap.add_argument('--seed', type=int, help='seed for jitter and error injection')
+    ap.add_argument('--print-env', action='store_true', help='print the backend overrides and exit')
+    args = ap.parse_args()
+
+    server = ReplayServer(FixtureStore(args.fixtures), args.host, args.port, record=args.record,
+                          latency=_parse_rules(args.latency, _parse_latency),
+                          errors=_parse_rules(args.errors, _parse_error), seed=args.seed)
+    env = server.env()
+    if args.print_env:
+        print('\n'.join(f'export {k}={v}' for k, v in env.items()))
+        # Only release the socket: shutdown() would wait forever for a serve_forever() that never ran
+        server._httpd.server_close()
+        return
+    print(f"{'Recording' if args.record else 'Replaying'} {args.fixtures} on {server.base_url}")
+    print("Backend environment:")
+    for k, v in env.items():
+        print(f"  {k}={v}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -39,5 +39,11 @@ else
   echo "SERPAPI_KEY not set: falling back to HTML scrapers only"
 fi
 
+# MODE=production: gunicorn with rembg models preloaded before forking (see gunicorn.conf.py)
+if [ "$MODE" = "production" ]; then
+  echo "Starting production backend (gunicorn) on http://${HOST:-127.0.0.1}:${PORT:-5000}"
+  exec $PYTHON_BIN -m gunicorn -c gunicorn.conf.py wsgi:app
+fi
+
 echo "Starting backend on http://127.0.0.1:5001"
 exec $PYTHON_BIN app.py
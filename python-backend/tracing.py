@@ -0,0 +1,241 @@
+"""Lightweight in-process request tracing.
+
+A trace is started per HTTP request (see the hooks in app.py) and carries the
+request ID. Code anywhere below it opens nested spans:
+
+    with tracing.span('dedupe.collapse', records=len(records)) as s:
+        ...
+        s.set(groups=n)
+
+or wrap a whole function with @tracing.traced('retailer.wayfair').
+
+The current span lives in a ContextVar. Outside a trace, span() is a no-op
+costing one lookup, so retailer modules stay usable as scripts. Work handed to
+thread pools is not traced unless it runs in a copied context.
+
+Finished traces are kept in memory twice:
+  - the TRACE_KEEP_SLOWEST slowest traces, for GET /debug/traces
+  - the last TRACE_KEEP_RECENT traces, for lookup by request ID
+With TRACE_EXPORT set, a finished trace is also written as one JSON line.
+The value is either "stdout" or a file path. Traces faster than
+TRACE_EXPORT_MIN_MS are not exported.
+"""
+import functools
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+ENABLED = os.getenv('TRACE', '1') != '0'
+EXPORT = os.getenv('TRACE_EXPORT', '')
+EXPORT_MIN_MS = float(os.getenv('TRACE_EXPORT_MIN_MS', '0'))
+KEEP_SLOWEST = int(os.getenv('TRACE_KEEP_SLOWEST', '20'))
+KEEP_RECENT = int(os.getenv('TRACE_KEEP_RECENT', '200'))
+MAX_SPANS = 1000  # per trace; later spans are counted but dropped
+
+_current: ContextVar[Optional['Span']] = ContextVar('trace_span', default=None)
+_lock = threading.Lock()
+_slowest: List[tuple] = []  # min-heap of (duration_ms, seq, trace dict)
+_recent: 'OrderedDict[str, dict]' = OrderedDict()
+_seq = itertools.count()
+_export_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'parent', 'attrs', 'start', 'end', 'error', 'index')
+
+    def __init__(self, name: str, trace: Optional['Trace'], parent: Optional['Span'], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.index = -1
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, name: str, request_id: str, attrs: Dict[str, Any]):
+        self.request_id = request_id
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.root = self._add(Span(name, self, None, attrs))
+
+    def _add(self, span: Span) -> Span:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+        else:
+            span.index = len(self.spans)
+            self.spans.append(span)
+        return span
+
+    def to_dict(self) -> Dict[str, Any]:
+        t0 = self.root.start
+        return {
+            'request_id': self.request_id,
+            'name': self.root.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.root.duration_ms, 2),
+            'attrs': self.root.attrs,
+            'error': self.root.error,
+            'dropped_spans': self.dropped,
+            'spans': [{
+                'id': s.index,
+                'parent': s.parent.index if s.parent is not None else None,
+                'name': s.name,
+                'start_ms': round((s.start - t0) * 1000, 2),
+                'duration_ms': round(s.duration_ms, 2),
+                'attrs': s.attrs,
+                'error': s.error,
+            } for s in self.spans[1:]],
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: total plus the root's direct children, summed by name."""
+        totals: Dict[str, float] = {}
+        for s in self.spans[1:]:
+            if s.parent is self.root and s.end is not None:
+                totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+        parts = [f'total;dur={self.root.duration_ms:.1f}']
+        parts += [f'{name.replace(".", "-")};dur={ms:.1f}' for name, ms in totals.items()]
+        return ', '.join(parts)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> Optional[str]:
+    s = _current.get()
+    return s.trace.request_id if s is not None and s.trace is not None else None
+
+
+def start_trace(name: str, request_id: Optional[str] = None, **attrs):
+    """Begin a root span in the current context; returns a token for finish_trace()."""
+    if not ENABLED:
+        return None
+    t = Trace(name, request_id or new_request_id(), attrs)
+    return t, _current.set(t.root)
+
+
+def finish_trace(handle, **attrs) -> Optional[Trace]:
+    if handle is None:
+        return None
+    t, token = handle
+    t.root.attrs.update(attrs)
+    t.root.end = time.perf_counter()
+    try:
+        _current.reset(token)
+    except ValueError:
+        _current.set(None)  # finished from a different context
+    _record(t)
+    return t
+
+
+def current_trace() -> Optional[Trace]:
+    s = _current.get()
+    return s.trace if s is not None else None
+
+
+def current_span():
+    """The innermost open span, or a no-op stand-in outside a trace; for set()."""
+    s = _current.get()
+    return s if s is not None else _NOOP
+
+
+@contextmanager
+def span(name: str, **attrs):
+    parent = _current.get()
+    if parent is None:
+        yield _NOOP
+        return
+    s = parent.trace._add(Span(name, parent.trace, parent, attrs))
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f'{type(e).__name__}: {e}'[:200]
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running the function inside span(name or its qualified name)."""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _record(t: Trace):
+    data = t.to_dict()
+    with _lock:
+        item = (data['duration_ms'], next(_seq), data)
+        if len(_slowest) < KEEP_SLOWEST:
+            heapq.heappush(_slowest, item)
+        elif item[0] > _slowest[0][0]:
+            heapq.heapreplace(_slowest, item)
+        _recent[t.request_id] = data
+        while len(_recent) > KEEP_RECENT:
+            _recent.popitem(last=False)
+    if EXPORT and data['duration_ms'] >= EXPORT_MIN_MS:
+        _export(data)
+
+
+def _export(data: Dict[str, Any]):
+    line = json.dumps(data, default=str) + '\n'
+    with _export_lock:
+        try:
+            if EXPORT == 'stdout':
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(EXPORT, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError:
+            pass
+
+
+def slowest(limit: int = KEEP_SLOWEST) -> List[Dict[str, Any]]:
+    with _lock:
+        items = sorted(_slowest, key=lambda x: -x[0])
+    return [data for _, _, data in items[:limit]]
+
+
+def get(request_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        return _recent.get(request_id)
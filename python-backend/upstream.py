@@ -0,0 +1,501 @@
+"""Resilient GETs to retailer upstreams: circuit breakers, adaptive timeouts, retry budgets.
+
+Every retailer call goes through get(name, url, ...). `name` identifies the
+upstream (one per retailer endpoint), and each name gets:
+
+  - a circuit breaker: after BREAKER_FAILURES consecutive failures the
+    breaker opens and calls fail immediately with CircuitOpenError for
+    BREAKER_OPEN_SECONDS. The open period doubles on each failed probe, up
+    to BREAKER_MAX_OPEN_SECONDS. After that one probe request is let
+    through (half-open): success closes the breaker, failure re-opens it.
+  - an adaptive timeout: TIMEOUT_MULTIPLIER x the p99 of recent latencies,
+    clamped to [TIMEOUT_MIN, the caller's maximum]. A timed-out call
+    records its timeout as a latency sample, so the timeout grows back if
+    the upstream slowed down for real.
+  - a retry budget: connection errors, timeouts and 429/502/503/504 are
+    retried with full-jitter backoff. Retries are only allowed while they
+    stay under RETRY_BUDGET_RATIO of the requests in the last
+    RETRY_WINDOW_SECONDS (with RETRY_MIN_PER_WINDOW as a floor), so a dead
+    upstream doesn't receive twice the traffic.
+
+Before any of that, a request takes a token from its *host's* token bucket
+and a slot from the host's concurrency semaphore (HOST_LIMITS, shared by
+every upstream on the host, e.g. all three ac.cnstrc.com retailers). It may
+queue for them until its deadline: the enclosing deadline() block, capped
+at LIMITER_MAX_WAIT. A request that would have to wait longer is skipped
+with SkippedError. Wait times are recorded per host (limiter_status()).
+The slot is held until the response headers arrive, or, with stream=True,
+until the body has been read to the end or the response is closed.
+
+Failures are exceptions, 5xx and 429. Other 4xx answers mean the upstream
+is up and count as successes. CircuitOpenError subclasses
+requests.RequestException, so existing `except requests.RequestException`
+handlers treat an open breaker like any other failed request.
+"""
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+import tracing
+
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv('BREAKER_MAX_OPEN_SECONDS', '300'))
+
+TIMEOUT_MIN = float(os.getenv('UPSTREAM_TIMEOUT_MIN', '2'))
+TIMEOUT_MAX = float(os.getenv('UPSTREAM_TIMEOUT_MAX', '10'))
+TIMEOUT_MULTIPLIER = float(os.getenv('UPSTREAM_TIMEOUT_MULTIPLIER', '2'))
+LATENCY_WINDOW = 200  # samples kept per upstream
+MIN_SAMPLES = 20  # below this the caller's maximum is used as is
+
+RETRIES = int(os.getenv('UPSTREAM_RETRIES', '1'))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.1'))
+RETRY_MIN_PER_WINDOW = 3
+RETRY_WINDOW_SECONDS = 10.0
+RETRY_BACKOFF_BASE = 0.1
+RETRY_BACKOFF_CAP = 1.0
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# host -> (requests per second, burst, max concurrent requests); rate 0 = no rate limit.
+# Override or extend with UPSTREAM_HOST_LIMITS="host=rate/burst/concurrency,..."
+HOST_LIMITS: Dict[str, Tuple[float, int, int]] = {
+    'www.wayfair.com': (2.0, 4, 2),
+    'ac.cnstrc.com': (10.0, 20, 8),
+    # Retailer image CDNs: many small files per results page
+    'assets.wfcdn.com': (20.0, 40, 8),
+    'assets.weimgs.com': (20.0, 40, 8),
+    'assets.pbimgs.com': (20.0, 40, 8),
+    '*': (5.0, 10, 4),
+}
+LIMITER_MAX_WAIT = float(os.getenv('LIMITER_MAX_WAIT', '2'))
+WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _parse_host_limits(spec: str) -> Dict[str, Tuple[float, int, int]]:
+    out = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        try:
+            host, values = part.split('=', 1)
+            rate, burst, concurrency = values.split('/')
+            out[host.strip().lower()] = (float(rate), max(1, int(burst)), max(1, int(concurrency)))
+        except ValueError:
+            continue
+    return out
+
+
+HOST_LIMITS.update(_parse_host_limits(os.getenv('UPSTREAM_HOST_LIMITS', '')))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+REQUESTS = metrics.counter('upstream_requests_total', 'Retailer requests by upstream and outcome class.',
+                           ('upstream', 'outcome'))
+DURATION = metrics.histogram('upstream_request_duration_seconds', 'Retailer request latency (to response headers).',
+                             ('upstream',))
+RETRIES_TOTAL = metrics.counter('upstream_retries_total', 'Retries sent by upstream.', ('upstream',))
+LIMITER_WAIT = metrics.histogram('upstream_limiter_wait_seconds', 'Time queued for a host rate/concurrency slot.',
+                                 ('host',), buckets=WAIT_BUCKETS)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class SkippedError(requests.RequestException):
+    """Raised when a host limiter could not admit the request before its deadline."""
+
+
+_deadline: ContextVar[Optional[float]] = ContextVar('upstream_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Upstream requests made inside the block stop queueing for limiters after `seconds`."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _percentile(ordered, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Upstream:
+    """Breaker, latency window and retry budget of one upstream; thread-safe."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self.state = CLOSED
+        self.failures = 0  # consecutive
+        self._open_for = BREAKER_OPEN_SECONDS
+        self._opened_at = 0.0
+        self._probing = False
+        self.totals = {'requests': 0, 'failures': 0, 'retries': 0, 'short_circuited': 0, 'retries_denied': 0}
+
+    # -- breaker ---------------------------------------------------------
+
+    def short_circuited(self) -> bool:
+        """True while open: checked before queueing for a limiter slot."""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self._opened_at < self._open_for
+
+    def acquire(self):
+        """Raise CircuitOpenError unless a request may go out now."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._open_for:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                self.totals['short_circuited'] += 1
+                retry_in = max(0.0, self._open_for - (time.monotonic() - self._opened_at))
+                raise CircuitOpenError(f"{self.name}: circuit open, retry in {retry_in:.0f}s")
+            if self.state == HALF_OPEN:
+                self._probing = True
+            now = time.monotonic()
+            self._requests.append(now)
+            self._trim(now)
+            self.totals['requests'] += 1
+
+    def success(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self.failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._open_for = BREAKER_OPEN_SECONDS
+            self._probing = False
+
+    def failure(self, latency: Optional[float] = None):
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self.failures += 1
+            self.totals['failures'] += 1
+            if self.state == HALF_OPEN:
+                self._open_for = min(self._open_for * 2, BREAKER_MAX_OPEN_SECONDS)
+                self._trip()
+            elif self.state == CLOSED and self.failures >= BREAKER_FAILURES:
+                self._trip()
+            self._probing = False
+
+    def _trip(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+
+    # -- timeouts --------------------------------------------------------
+
+    def timeout(self, maximum: float = TIMEOUT_MAX) -> float:
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return maximum
+            p99 = _percentile(sorted(self._latencies), 0.99)
+        return max(min(TIMEOUT_MIN, maximum), min(maximum, p99 * TIMEOUT_MULTIPLIER))
+
+    # -- retry budget ----------------------------------------------------
+
+    def _trim(self, now: float):
+        cutoff = now - RETRY_WINDOW_SECONDS
+        for q in (self._requests, self._retries):
+            while q and q[0] < cutoff:
+                q.popleft()
+
+    def allow_retry(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= max(RETRY_MIN_PER_WINDOW, RETRY_BUDGET_RATIO * len(self._requests)):
+                self.totals['retries_denied'] += 1
+                return False
+            self._retries.append(now)
+            self.totals['retries'] += 1
+        RETRIES_TOTAL.inc(upstream=self.name)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            out: Dict[str, Any] = {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'samples': len(ordered),
+                **self.totals,
+            }
+            if self.state == OPEN:
+                out['retry_in_s'] = round(max(0.0, self._open_for - (time.monotonic() - self._opened_at)), 1)
+        if ordered:
+            for q in (0.5, 0.95, 0.99):
+                out[f'p{int(q * 100)}_ms'] = round(_percentile(ordered, q) * 1000, 1)
+        out['timeout_s'] = round(self.timeout(), 2)
+        return out
+
+
+class HostLimiter:
+    """Token bucket plus concurrency semaphore for one host, with wait-time stats."""
+
+    def __init__(self, host: str, rate: float, burst: int, concurrency: int):
+        self.host = host
+        self.rate, self.burst, self.concurrency = rate, burst, concurrency
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.in_flight = 0
+        self.admitted = 0
+        self.skipped = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)  # last bucket is +Inf
+
+    def _reserve(self, max_wait: float) -> Optional[float]:
+        """Take a token now or in the future; seconds to wait, None if more than max_wait."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def _skip(self):
+        with self._lock:
+            self.skipped += 1
+        raise SkippedError(f"{self.host}: rate limit queue is past the request deadline")
+
+    def admit(self, until: float) -> float:
+        """Take a token and a concurrency slot, queueing until `until` at most.
+
+        Returns the seconds waited; raises SkippedError when that is not
+        enough. Every admit() must be paired with one release().
+        """
+        started = time.monotonic()
+        wait = self._reserve(until - started)
+        if wait is None:
+            self._skip()
+        if wait:
+            time.sleep(wait)
+        if not self._slots.acquire(timeout=max(0.0, until - time.monotonic())):
+            self._skip()
+        waited = time.monotonic() - started
+        LIMITER_WAIT.observe(waited, host=self.host)
+        with self._lock:
+            self.admitted += 1
+            self.in_flight += 1
+            self.wait_sum += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.wait_buckets[next((i for i, b in enumerate(WAIT_BUCKETS) if waited <= b), len(WAIT_BUCKETS))] += 1
+        return waited
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self, until: float):
+        waited = self.admit(until)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'rate_per_s': self.rate, 'burst': self.burst, 'concurrency': self.concurrency,
+                'in_flight': self.in_flight, 'admitted': self.admitted, 'skipped': self.skipped,
+                'wait_avg_ms': round(self.wait_sum / self.admitted * 1000, 2) if self.admitted else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 2),
+                'wait_sum_s': round(self.wait_sum, 4),
+                # cumulative, Prometheus-histogram style: requests that waited <= le seconds
+                'wait_buckets': {str(le): n for le, n in zip(WAIT_BUCKETS + ('+Inf',), _cumulative(self.wait_buckets))},
+            }
+
+
+class _SlotResponse(requests.Response):
+    """A streamed response that holds its host's concurrency slot until the
+    body has been read to the end or the response is closed (or collected)."""
+
+    _slot_release = None
+
+    def iter_content(self, *args, **kwargs):  # also what .content/.text/.json() read through
+        try:
+            yield from super().iter_content(*args, **kwargs)
+        finally:
+            self.release_slot()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.release_slot()
+
+    def release_slot(self):
+        if self._slot_release is not None:
+            self._slot_release()  # a weakref.finalize: runs at most once
+
+
+def _hold_slot(resp: requests.Response, release) -> None:
+    resp.__class__ = _SlotResponse
+    resp._slot_release = weakref.finalize(resp, release)
+
+
+def _cumulative(counts):
+    total = 0
+    for n in counts:
+        total += n
+        yield total
+
+
+_registry_lock = threading.Lock()
+_upstreams: Dict[str, Upstream] = {}
+_limiters: Dict[str, HostLimiter] = {}
+_session = requests.Session()
+
+
+def upstream(name: str) -> Upstream:
+    with _registry_lock:
+        u = _upstreams.get(name)
+        if u is None:
+            u = _upstreams[name] = Upstream(name)
+        return u
+
+
+def host_limiter(url: str) -> HostLimiter:
+    host = (urlsplit(url).hostname or '').lower()
+    with _registry_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(host, *HOST_LIMITS.get(host, HOST_LIMITS['*']))
+        return limiter
+
+
+def _in_flight():
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    return {(limiter.host,): limiter.in_flight for limiter in limiters}
+
+
+metrics.gauge_callback('upstream_in_flight', 'Retailer requests in flight, by host.', ('host',), _in_flight)
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    with _registry_lock:
+        items = list(_upstreams.items())
+    return {name: u.snapshot() for name, u in sorted(items)}
+
+
+def limiter_status() -> Dict[str, Dict[str, Any]]:
+    with _registry_lock:
+        items = list(_limiters.items())
+    return {host: limiter.snapshot() for host, limiter in sorted(items)}
+
+
+def get(name: str, url: str, timeout: Optional[float] = None, retries: int = RETRIES,
+        session: Optional[requests.Session] = None, **kwargs) -> requests.Response:
+    """requests.get through the upstream's breaker, adaptive timeout and retry budget.
+
+    `timeout` is the maximum; the adaptive timeout is usually lower. Raises
+    requests.RequestException (CircuitOpenError when short-circuited) when
+    no attempt succeeds, SkippedError when the host's limiter can't admit it
+    in time. A final 5xx/429 response is returned rather than raised, like
+    requests itself. With stream=True the host slot stays taken until the
+    body is read or the response closed, so callers must do one of them.
+    """
+    u = upstream(name)
+    limiter = host_limiter(url)
+    http = session or _session
+    maximum = timeout if timeout is not None else TIMEOUT_MAX
+    attempt = 0
+    while True:
+        until = time.monotonic() + LIMITER_MAX_WAIT
+        end = _deadline.get()
+        if end is not None:
+            until = min(until, end)
+        with tracing.span('upstream.get', upstream=name, attempt=attempt) as span:
+            entered = time.monotonic()
+            try:
+                if u.short_circuited():
+                    u.acquire()  # raises CircuitOpenError without spending a rate-limit token
+                limiter.admit(until)
+                held = False
+                try:
+                    u.acquire()
+                    t = u.timeout(maximum)
+                    started = time.monotonic()
+                    try:
+                        resp = http.get(url, timeout=t, **kwargs)
+                        error = None
+                    except requests.RequestException as e:
+                        error = e
+                    latency = time.monotonic() - started
+                    if error is None and kwargs.get('stream'):
+                        # The body is still to be read: resp.close() (or reading it) frees the slot
+                        _hold_slot(resp, limiter.release)
+                        held = True
+                finally:
+                    if not held:
+                        limiter.release()
+            except CircuitOpenError:
+                REQUESTS.inc(upstream=name, outcome='circuit_open')
+                raise
+            except SkippedError:
+                REQUESTS.inc(upstream=name, outcome='skipped')
+                raise
+            outcome = _outcome(error, resp if error is None else None)
+            DURATION.observe(latency, upstream=name)
+            REQUESTS.inc(upstream=name, outcome=outcome)
+            span.set(outcome=outcome, timeout_s=round(t, 2), wait_ms=round((started - entered) * 1000, 1),
+                     status=resp.status_code if error is None else None)
+        if error is not None:
+            u.failure(t if isinstance(error, requests.Timeout) else None)
+            if not _backoff(u, attempt, retries):
+                raise error
+            attempt += 1
+            continue
+        if resp.status_code < 500 and resp.status_code != 429:
+            u.success(latency)
+            return resp
+        u.failure(latency)
+        if resp.status_code not in RETRY_STATUSES or not _backoff(u, attempt, retries):
+            return resp
+        resp.close()
+        attempt += 1
+
+
+def _outcome(error: Optional[Exception], resp: Optional[requests.Response]) -> str:
+    if isinstance(error, requests.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.ConnectionError):
+        return 'connection_error'
+    if error is not None:
+        return 'error'
+    if resp.status_code == 429:
+        return 'http_429'
+    return 'ok' if resp.status_code < 400 else f'http_{resp.status_code // 100}xx'
+
+
+def _backoff(u: Upstream, attempt: int, retries: int) -> bool:
+    """Sleep before retry number attempt + 1; False when out of retries or budget."""
+    if attempt >= retries or not u.allow_retry():
+        return False
+    time.sleep(random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** (attempt + 1))))
+    return True
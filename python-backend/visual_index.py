@@ -0,0 +1,169 @@
+"""Perceptual hashes of product images and "visually similar" lookups.
+
+Each image gets a 64-bit pHash (DCT of a 32x32 grayscale thumbnail) and a
+64-bit dHash (horizontal gradient signs of a 9x8 thumbnail), both computed
+with numpy. Hashes persist in the product index database; an in-memory
+multi-index hash (MIH) answers Hamming-radius queries without re-fetching
+or scanning every image:
+
+    The 64 bits are split into 4 16-bit chunks. Two hashes within Hamming
+    distance r agree to within floor(r / 4) bits on at least one chunk, so
+    probing each chunk table with every value that close and verifying the
+    candidates finds all matches.
+"""
+import itertools
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    import product_index
+except Exception:
+    product_index = None  # type: ignore
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MAX_RADIUS = 15  # probes stay cheap up to floor(15 / 4) = 3 bits per chunk
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def _gray(img: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    return np.asarray(img.convert('L').resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def phash(img: Image.Image) -> int:
+    pixels = _gray(img, (_DCT_SIZE, _DCT_SIZE))
+    coeffs = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE]
+    # The DC term only carries overall brightness: leave it out of the median
+    med = np.median(coeffs.ravel()[1:])
+    return _bits_to_int(coeffs > med)
+
+
+def dhash(img: Image.Image) -> int:
+    pixels = _gray(img, (_HASH_SIZE + 1, _HASH_SIZE))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _chunks(h: int) -> List[int]:
+    return [(h >> (CHUNK_BITS * c)) & CHUNK_MASK for c in range(CHUNKS)]
+
+
+def _neighbors(value: int, bits: int):
+    """All CHUNK_BITS-wide values within `bits` flips of value."""
+    yield value
+    for d in range(1, bits + 1):
+        for flips in itertools.combinations(range(CHUNK_BITS), d):
+            v = value
+            for f in flips:
+                v ^= 1 << f
+            yield v
+
+
+class VisualIndex:
+    """Thread-safe MIH over (image URL -> pHash); dHash is kept for tie-breaks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, Tuple[int, int]] = {}
+        self._tables: List[Dict[int, Set[str]]] = [dict() for _ in range(CHUNKS)]
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = product_index.image_hashes() if product_index is not None else []
+            for image, ph, dh in rows:
+                self._insert(image, ph, dh)
+            self._loaded = True
+            logger.info(f"Visual index loaded {len(rows)} image hashes")
+
+    def _insert(self, image: str, ph: int, dh: int):
+        old = self._hashes.get(image)
+        if old is not None:
+            for c, v in enumerate(_chunks(old[0])):
+                self._tables[c].get(v, set()).discard(image)
+        self._hashes[image] = (ph, dh)
+        for c, v in enumerate(_chunks(ph)):
+            self._tables[c].setdefault(v, set()).add(image)
+
+    def __len__(self):
+        self._load()
+        return len(self._hashes)
+
+    def get(self, image: str) -> Optional[Tuple[int, int]]:
+        self._load()
+        return self._hashes.get(image)
+
+    def add(self, image: str, img: Image.Image) -> Tuple[int, int]:
+        """Hash a decoded image, persist it and make it searchable."""
+        self._load()
+        ph, dh = phash(img), dhash(img)
+        with self._lock:
+            self._insert(image, ph, dh)
+        if product_index is not None:
+            product_index.upsert_image_hash(image, ph, dh)
+        return ph, dh
+
+    def search(self, ph: int, radius: int = 10, limit: int = 20, dh: Optional[int] = None,
+               exclude: Optional[str] = None) -> List[Tuple[str, int]]:
+        """(image, pHash distance) pairs within `radius`, closest first."""
+        self._load()
+        radius = max(0, min(int(radius), MAX_RADIUS))
+        probe_bits = radius // CHUNKS
+        candidates: Set[str] = set()
+        with self._lock:
+            for c, v in enumerate(_chunks(ph)):
+                table = self._tables[c]
+                for n in _neighbors(v, probe_bits):
+                    hit = table.get(n)
+                    if hit:
+                        candidates.update(hit)
+            hashes = {img: self._hashes[img] for img in candidates if img != exclude}
+        scored = []
+        for img, (cph, cdh) in hashes.items():
+            d = hamming(ph, cph)
+            if d <= radius:
+                scored.append((d, hamming(dh, cdh) if dh is not None else 0, img))
+        scored.sort()
+        return [(img, d) for d, _, img in scored[:limit]]
+
+
+index = VisualIndex()
+
+
+def image_hash(image_url: str) -> Optional[int]:
+    """Stored pHash for an image URL (no fetching); None when unknown."""
+    if not image_url:
+        return None
+    h = index.get(image_url)
+    return h[0] if h else None
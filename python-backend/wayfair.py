@@ -1,15 +1,33 @@
+import os
 import requests
-from bs4 import BeautifulSoup
+import tracing
+import upstream
+from bs4 import BeautifulSoup, SoupStrainer
 import csv
 from urllib.parse import urljoin
 
+try:
+    import lxml  # noqa: F401
+    FAST_PARSER = 'lxml'
+except Exception:
+    FAST_PARSER = 'html.parser'
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
     'Accept-Language': 'en-US,en;q=0.9',
 }
 
-BASE_URL = "https://www.wayfair.com/keyword.php"
 WAYFAIR_DOMAIN = "https://www.wayfair.com"
+# Where listing pages are fetched from (e.g. a replay.py stand-in); product links keep WAYFAIR_DOMAIN
+BASE_URL = os.getenv('WAYFAIR_BASE_URL', WAYFAIR_DOMAIN).rstrip('/') + "/keyword.php"
+
+# Parse only ListingCard subtrees with lxml when a scan of the raw markup shows
+# every card can be resolved on its own; other pages get one full parse.
+FAST_PARSE = os.getenv('WAYFAIR_FAST_PARSE', '1') == '1'
+
+TITLE_MARKER = 'ListingCard-ListingCardName-Text'
+TITLE_SELECTOR = f'h2[data-test-id="{TITLE_MARKER}"]'
+PRICE_SELECTOR = 'span[data-test-id="PriceDisplay"]'
 
 
 
@@ -74,9 +92,128 @@ def _find_root(node):
     return cur
 
 
-def _extract_img_from_node(node) -> str | None:
+IMG_URL_ATTRS = ('data-src', 'data-srcset', 'srcset', 'src', 'data-original')
+
+
+def _img_url(img) -> str | None:
+    for attr in IMG_URL_ATTRS:
+        val = img.get(attr)
+        if val:
+            return _normalize_img_url(val)
+    return None
+
+
+def _img_rank(img) -> int:
+    """Preference used by _extract_img_from_node: lower is better."""
+    test_id = img.get('data-test-id') or ''
+    if 'ListingCardImageCarousel' in test_id:
+        return 0
+    if 'LeadImage' in test_id:
+        return 1
+    if img.get('data-hb-id') == 'FluidImage':
+        return 2
+    return 3
+
+
+def _grams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ImageIndex:
+    """Per-document thumbnail lookup built in a single pass over <img> tags.
+
+    Every ancestor of an image (listing cards, anchors, wrappers) maps to the
+    image _extract_img_from_node() would pick for it, so thumbnail resolution
+    no longer re-scans the tree once per title.
+
+    Alt texts are indexed by character trigram for the <img alt> fallback:
+    an alt containing the title holds every trigram of the title, and an alt
+    contained in the title starts with one of them. A lookup only verifies
+    those candidates, in document order, so it returns the same image as the
+    tree walk's first-match scan.
+    """
+
+    def __init__(self, soup):
+        self._soup = soup  # keeps node ids stable for the index lifetime
+        self._slots: dict[int, list] = {}
+        self._alt_list: list[tuple[str, object]] = []  # (lowercased alt, img) in document order
+        self._alt_grams: dict[str, list[int]] | None = None  # trigram -> positions of alts containing it
+        self._alt_heads: dict[str, list[int]] = {}  # first trigram -> positions of alts starting with it
+        self._short_alts: list[int] = []  # alts under three characters
+        self._urls: dict[int, str | None] = {}
+        for img in soup.find_all('img'):
+            rank = _img_rank(img)
+            for anc in img.parents:
+                slots = self._slots.get(id(anc))
+                if slots is None:
+                    slots = self._slots[id(anc)] = [None, None, None, None]
+                elif slots[rank] is not None and slots[3] is not None:
+                    # An earlier image already filled this ancestor and, by
+                    # containment, every ancestor above it.
+                    break
+                if slots[rank] is None:
+                    slots[rank] = img
+                if slots[3] is None:
+                    slots[3] = img
+            alt = (img.get('alt') or '').strip().lower()
+            if alt:
+                self._alt_list.append((alt, img))
+
+    def image_for(self, node) -> str | None:
+        slots = self._slots.get(id(node))
+        if not slots:
+            return None
+        for img in slots:
+            if img is not None:
+                return _img_url(img)
+        return None
+
+    def _index_alts(self) -> dict[str, list[int]]:
+        # Built on the first alt lookup: pages whose cards hold their own images never need it
+        grams_index: dict[str, list[int]] = {}
+        for pos, (alt, _img) in enumerate(self._alt_list):
+            if len(alt) < 3:
+                self._short_alts.append(pos)
+                continue
+            for gram in _grams(alt):
+                grams_index.setdefault(gram, []).append(pos)
+            self._alt_heads.setdefault(alt[:3], []).append(pos)
+        self._alt_grams = grams_index
+        return grams_index
+
+    def _alt_candidates(self, title_l: str) -> set[int]:
+        alt_grams = self._alt_grams if self._alt_grams is not None else self._index_alts()
+        if len(title_l) < 3:
+            # No trigram to look up; such titles are rare enough to scan for
+            return set(range(len(self._alt_list)))
+        grams = _grams(title_l)
+        found: set[int] = set(self._short_alts)
+        postings = [alt_grams.get(g) for g in grams]
+        if all(postings):
+            found.update(min(postings, key=len))
+        for gram in grams:
+            found.update(self._alt_heads.get(gram, ()))
+        return found
+
+    def match_alt(self, title_l: str) -> str | None:
+        """First <img> in document order whose alt contains, or is contained in, the title."""
+        if not title_l:
+            return None
+        for pos in sorted(self._alt_candidates(title_l)):
+            alt, img = self._alt_list[pos]
+            if title_l in alt or alt in title_l:
+                if pos not in self._urls:
+                    self._urls[pos] = _img_url(img)
+                if self._urls[pos]:
+                    return self._urls[pos]
+        return None
+
+
+def _extract_img_from_node(node, index: ImageIndex | None = None) -> str | None:
     if not node:
         return None
+    if index is not None:
+        return index.image_for(node)
     # Prefer the ListingCard lead image or FluidImage
     img = node.select_one('img[data-test-id*="ListingCardImageCarousel"]') \
           or node.select_one('img[data-test-id*="LeadImage"]') \
@@ -84,20 +221,21 @@ def _extract_img_from_node(node) -> str | None:
           or node.find('img')
     if not img:
         return None
-    for attr in ('data-src', 'data-srcset', 'srcset', 'src', 'data-original'):
-        val = img.get(attr)
-        if val:
-            return _normalize_img_url(val)
-    return None
+    return _img_url(img)
 
 
-def _find_thumbnail(title_elem) -> str | None:
+def _find_thumbnail(title_elem, index: ImageIndex | None = None) -> str | None:
     if not title_elem:
         return None
+    return _find_card_thumbnail(title_elem, index) or _find_context_thumbnail(title_elem, index)
+
+
+def _find_card_thumbnail(title_elem, index: ImageIndex | None = None) -> str | None:
+    """Steps 1-2: images inside the title's anchor or enclosing card containers."""
     # 1) Look within the closest anchor first
     parent_link = title_elem.find_parent('a')
     if parent_link:
-        val = _extract_img_from_node(parent_link)
+        val = _extract_img_from_node(parent_link, index)
         if val:
             return val
 
@@ -114,11 +252,15 @@ def _find_thumbnail(title_elem) -> str | None:
         ) or (
             node.get('class') and any('ListingCard' in ' '.join(node.get('class')) for _ in [0])
         ) or node.name in ('li', 'article', 'div'):
-            val = _extract_img_from_node(node)
+            val = _extract_img_from_node(node, index)
             if val:
                 return val
         node = node.parent
+    return None
 
+
+def _find_context_thumbnail(title_elem, index: ImageIndex | None = None) -> str | None:
+    """Steps 3-4: sibling containers, then any <img alt> matching the title."""
     # 3) Try sibling anchors around the title (common pattern: image/link sibling before title)
     container = title_elem.parent
     for _ in range(3):
@@ -127,13 +269,13 @@ def _find_thumbnail(title_elem) -> str | None:
         # Check previous and next siblings for images
         sib = container.previous_sibling
         while sib and hasattr(sib, 'name'):
-            val = _extract_img_from_node(sib)
+            val = _extract_img_from_node(sib, index)
             if val:
                 return val
             sib = sib.previous_sibling
         sib = container.next_sibling
         while sib and hasattr(sib, 'name'):
-            val = _extract_img_from_node(sib)
+            val = _extract_img_from_node(sib, index)
             if val:
                 return val
             sib = sib.next_sibling
@@ -142,6 +284,8 @@ def _find_thumbnail(title_elem) -> str | None:
     # 4) Global fallback: match <img alt> that contains the product title text
     title_text = title_elem.get_text(strip=True) or ''
     title_text_l = title_text.lower()
+    if index is not None:
+        return index.match_alt(title_text_l)
     root = _find_root(title_elem)
     try:
         imgs = root.find_all('img')
@@ -164,6 +308,7 @@ def _find_thumbnail(title_elem) -> str | None:
     return best
 
 
+@tracing.traced('retailer.wayfair')
 def get_products(query="black leather sofa", max_pages=1):
     all_products = []
     current_page = 1
@@ -171,42 +316,150 @@ def get_products(query="black leather sofa", max_pages=1):
     while current_page <= max_pages:
         params = {'keyword': query, 'curpage': current_page}
         print(f"[INFO] Scraping listing page {current_page}...")
-        response = requests.get(BASE_URL, headers=HEADERS, params=params)
+        try:
+            # Bounded by the breaker and adaptive timeout shared with the HTML scraper
+            response = upstream.get('wayfair', BASE_URL, headers=HEADERS, params=params)
+        except requests.RequestException as e:
+            print(f"[ERROR] Failed to load page {current_page}: {e}")
+            break
 
         if response.status_code != 200:
             print(f"[ERROR] Failed to load page {current_page}, status code: {response.status_code}")
             break
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        product_titles = soup.select('h2[data-test-id="ListingCard-ListingCardName-Text"]')
-        prices = soup.select('span[data-test-id="PriceDisplay"]')
+        page_products = parse_listing_page(response.text)
 
-        if not product_titles:
+        if not page_products:
             print(f"[INFO] No products found on page {current_page}.")
             break
 
-        for i in range(len(product_titles)):
-            title_elem = product_titles[i]
-            title = title_elem.get_text(strip=True) if title_elem else "N/A"
-            price = prices[i].get_text(strip=True) if i < len(prices) else "N/A"
-
-            parent_link = title_elem.find_parent("a")
-            product_url = urljoin(WAYFAIR_DOMAIN, parent_link["href"]) if parent_link and parent_link.has_attr("href") else "N/A"
-            # NEW: thumbnail image (robust)
-            image_url = _find_thumbnail(title_elem) or ""
-
-            all_products.append({
-                "title": title,
-                "price": price,
-                "url": product_url,
-                "image": image_url,
-            })
-
+        all_products.extend(page_products)
         current_page += 1
 
     return all_products
 
 
+def _has_listing_marker(name, attrs) -> bool:
+    """Decide at tag-creation time whether a top-level tag is worth building."""
+    if not attrs:
+        return False
+    if name == 'script':
+        return 'ld+json' in (attrs.get('type') or '')
+    test_id = attrs.get('data-test-id') or ''
+    if 'ListingCard' in test_id or test_id == 'PriceDisplay':
+        return True
+    for attr in ('data-enzyme-id', 'data-hb-id'):
+        if 'ListingCard' in (attrs.get(attr) or ''):
+            return True
+    cls = attrs.get('class') or ''
+    if not isinstance(cls, str):
+        cls = ' '.join(cls)
+    return 'ListingCard' in cls
+
+
+class ListingStrainer(SoupStrainer):
+    """Keep only ListingCard subtrees, PriceDisplay spans and ld+json scripts.
+
+    Everything nested inside a kept tag is built as usual, so each card keeps
+    its full markup; unrelated page chrome is never turned into Tag objects.
+    """
+
+    def allow_tag_creation(self, nsprefix, name, attrs):  # bs4 >= 4.13
+        return _has_listing_marker(name, attrs)
+
+    def search_tag(self, markup_name=None, markup_attrs={}):  # bs4 < 4.13
+        return _has_listing_marker(markup_name, markup_attrs)
+
+
+def _extract_listing(soup, card_only: bool = False) -> list[dict] | None:
+    """Extract listing rows from a parsed page.
+
+    With card_only=True (restricted parse) thumbnails may only be resolved
+    inside the title's own card; None is returned when any row would need
+    page context the restricted tree does not have.
+    """
+    product_titles = soup.select(TITLE_SELECTOR)
+    prices = soup.select(PRICE_SELECTOR)
+    index = ImageIndex(soup) if product_titles else None
+    products = []
+    for i in range(len(product_titles)):
+        title_elem = product_titles[i]
+        title = title_elem.get_text(strip=True) if title_elem else "N/A"
+        price = prices[i].get_text(strip=True) if i < len(prices) else "N/A"
+
+        parent_link = title_elem.find_parent("a")
+        if card_only and parent_link is None:
+            return None
+        product_url = urljoin(WAYFAIR_DOMAIN, parent_link["href"]) if parent_link and parent_link.has_attr("href") else "N/A"
+        # NEW: thumbnail image (robust)
+        if card_only:
+            image_url = _find_card_thumbnail(title_elem, index)
+            if not image_url:
+                return None
+        else:
+            image_url = _find_thumbnail(title_elem, index) or ""
+
+        products.append({
+            "title": title,
+            "price": price,
+            "url": product_url,
+            "image": image_url,
+        })
+    return products
+
+
+def _anchor_start(low: str, pos: int) -> int:
+    """Offset of the last <a> start tag before pos (not <abbr>, <article>, ...), or -1."""
+    i = low.rfind('<a', 0, pos)
+    while i >= 0 and low[i + 2:i + 3] not in (' ', '>', '\t', '\n', '\r', '/'):
+        i = low.rfind('<a', 0, i)
+    return i
+
+
+def _titles_in_image_links(html: str) -> bool:
+    """Cheap pre-check on the raw markup for the restricted parse.
+
+    True when the page has card titles and each one sits inside an <a> that
+    also holds an <img>, i.e. every row can be resolved from its own card.
+    Pages without cards, or with titles outside their links, go straight to
+    the full parse instead of paying for a restricted parse that cannot
+    answer them.
+    """
+    low = html.lower()
+    marker = TITLE_MARKER.lower()
+    pos = low.find(marker)
+    if pos < 0:
+        return False
+    while pos >= 0:
+        start = _anchor_start(low, pos)
+        if start < 0 or low.find('</a', start, pos) >= 0:
+            return False
+        end = low.find('</a', pos)
+        if low.find('<img', start, end if end >= 0 else len(low)) < 0:
+            return False
+        pos = low.find(marker, pos + len(marker))
+    return True
+
+
+def parse_listing_page(html: str, fast: bool | None = None) -> list[dict]:
+    """Parse one keyword results page into title/price/url/image rows."""
+    if fast is None:
+        fast = FAST_PARSE
+    with tracing.span('wayfair.parse', bytes=len(html)) as span:
+        if fast and _titles_in_image_links(html):
+            soup = BeautifulSoup(html, FAST_PARSER, parse_only=ListingStrainer())
+            products = _extract_listing(soup, card_only=True)
+            if products:
+                span.set(parser='fast', products=len(products))
+                return products
+            # Only markup the pre-check cannot see (e.g. <img> without a URL) gets here
+            span.set(fast_miss=True)
+        soup = BeautifulSoup(html, 'html.parser')
+        products = _extract_listing(soup) or []
+        span.set(parser='full', products=len(products))
+        return products
+
+
 def save_products(products, filename="wayfair_bs4_products.csv"):
     with open(filename, "w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=["title", "price", "url", "image"])
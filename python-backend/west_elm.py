@@ -1,15 +1,17 @@
-import requests
 import csv
 import uuid
 import time
 from urllib.parse import quote_plus
 
+import constructor_client
+import tracing
+
 try:
     from constructor_keys import get_keys as ctor_get_keys
 except Exception:
     ctor_get_keys = None  # type: ignore
 
-API_BASE = "https://ac.cnstrc.com"
+API_BASE = constructor_client.api_base('west_elm')
 API_KEY = "key_SQBuGmXjiXmP0UNI"
 CLIENT_LIB = "ciojs-client-2.66.0"
 # Override from key store if available
@@ -29,29 +31,17 @@ HEADERS = {
     "Referer": REFERER,
 }
 
-def fetch_west_elm_autocomplete(query="rug", num_suggestions=0, num_products=12, client_id=None, session="1"):
+def fetch_west_elm_autocomplete(query="rug", num_suggestions=0, num_products=12, client_id=None, session="1", filters=None):
     """Call West Elm (Constructor.io) autocomplete API for a query.
 
     Set num_products>0 to also retrieve product hits alongside suggestions.
+    `filters` is an optional dict of extra query params (e.g. {"filters[price]": "0-200"}).
     """
     if not client_id:
         client_id = str(uuid.uuid4())
 
-    # Pull latest key/clientlib from persistent store each call
-    api_key = API_KEY
-    client_lib = CLIENT_LIB
-    if 'ctor_get_keys' in globals() and ctor_get_keys:
-        try:
-            k, c = ctor_get_keys('west_elm', fallback_key=api_key, fallback_clientlib=client_lib)
-            api_key = k or api_key
-            client_lib = c or client_lib
-        except Exception:
-            pass
-
     url = f"{API_BASE}/autocomplete/{quote_plus(query)}"
     params = {
-        "c": client_lib,
-        "key": api_key,
         "i": client_id,
         "s": str(session),
         # Note: the API expects this exact key with a space in it; requests will encode it properly.
@@ -59,16 +49,15 @@ def fetch_west_elm_autocomplete(query="rug", num_suggestions=0, num_products=12,
         "num_results_Search Suggestions": str(num_suggestions),
         "_dt": str(int(time.time() * 1000)),
     }
+    if filters:
+        params.update(filters)
 
-    try:
-        resp = requests.get(url, headers=HEADERS, params=params, timeout=20)
-        resp.raise_for_status()
-        return resp.json()
-    except requests.RequestException as e:
-        print(f"Error fetching West Elm autocomplete: {e}")
-        return None
+    # Key/clientlib come from the persistent store on each call; a rejected key triggers a refresh
+    return constructor_client.get_json('west_elm', url, params, API_KEY, CLIENT_LIB,
+                                       headers=HEADERS, label="West Elm autocomplete")
 
 
+@tracing.traced('west_elm.extract')
 def extract_results(data, fallback_query="", include_suggestions=False):
     """Extract a flat list of products (and optional suggestions) from autocomplete payload.
 
@@ -0,0 +1,35 @@
+"""WSGI entry point for the production server.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app (the default in gunicorn.conf.py), this module is imported
+once in the gunicorn master. The master loads REMBG_PRELOAD_MODELS and
+freezes the GC, then forks the workers. The model weights live in native
+onnxruntime buffers that Python never writes to, so the workers share
+those pages copy-on-write instead of each loading its own ~170 MB copy.
+
+Sessions loaded before fork run single-threaded. An onnxruntime intra-op
+thread pool created in the master would not exist in the forked workers.
+rembg sizes the pool from OMP_NUM_THREADS, so it is set to 1 here unless
+the environment already sets it. Workers get parallelism from gunicorn's
+processes and threads instead.
+"""
+import gc
+import logging
+import os
+
+if os.getenv('REMBG_PRELOAD_MODELS', 'u2net').strip():
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+from app import app, preload_models  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+_loaded = preload_models()
+if _loaded:
+    logger.info(f"Preloaded rembg models before fork: {', '.join(_loaded)}")
+# Keep the import-time heap out of the collector's generations: gc passes in the
+# workers then don't touch (and un-share) pages inherited from the master.
+gc.freeze()
+
+__all__ = ['app']
@@ -109,12 +109,25 @@ const MoodBoardApp = () => {
       try {
         const res = await fetch(`${base}/constructor-keys/refresh`, { method: 'POST' });
         if (!res.ok) continue;
-        const json = await res.json();
+        let json = await res.json();
         if (json.success) {
+          // The refresh runs in the background: poll its job until it finishes
+          const jobId = json.job?.id;
+          const deadline = Date.now() + 90_000;
+          while (json.success && ['queued', 'running'].includes(json.job?.state) && Date.now() < deadline) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const poll = await fetch(`${base}/constructor-keys/refresh`, { cache: 'no-store' });
+            json = await poll.json();
+            if (json.success && json.job?.id !== jobId) {
+              // A newer refresh replaced ours; its outcome is not ours to report
+              json = { success: false, status: json.status, error: 'Another key refresh replaced this one' };
+            }
+          }
           setIsRefreshingKeys(false);
-          // Prefer status if present; also keep missing_sites from refresh payload
-          const data = json.status ? { ...json.status, missing_sites: json.missing_sites } : (json.keys || null);
-          setKeyStatus({ loading: false, data, error: null });
+          const job = json.job || {};
+          const data = json.status ? { ...json.status, missing_sites: job.missing } : null;
+          const error = job.state === 'succeeded' ? null : (job.error || json.error || 'Refresh still running');
+          setKeyStatus({ loading: false, data, error });
           return;
         } else {
           setIsRefreshingKeys(false);